@@ -3,6 +3,7 @@
 Production entry point for Chess Game Application
 """
 
+import gc
 import os
 
 from chess_app import app
@@ -11,6 +12,17 @@ if __name__ == "__main__":
     # For local development
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port, debug=False)
+elif os.environ.get("CHESS_SERVER", "wsgi") == "asgi":
+    # For an ASGI server such as uvicorn: idle event streams wait on the
+    # event loop instead of holding a thread each (see asgi.py)
+    from asgi import ASGIAdapter
+
+    application = ASGIAdapter(app, int(os.environ.get("CHESS_ASGI_THREADS", 32)))
 else:
     # For production (gunicorn will import this)
     application = app
+
+# Keep the collector off everything built at import (move tables, Zobrist
+# keys, the Flask app), so workers forked under gunicorn --preload leave those
+# pages shared with the master
+gc.freeze()
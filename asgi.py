@@ -0,0 +1,216 @@
+"""
+ASGI Adapter
+Serves a WSGI app from an asyncio event loop: ordinary requests run in a
+thread pool, while async response bodies such as event streams stay on the
+loop
+"""
+
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# WSGI environ key holding the running event loop. A view that finds it may
+# return an async iterable body (with direct_passthrough), which is then
+# consumed on the loop instead of in a worker thread.
+ASGI_LOOP_KEY = "asgi.event_loop"
+
+
+def build_environ(scope, body, loop):
+    """Translate an ASGI HTTP scope and request body into a WSGI environ"""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    raw_path = scope.get("raw_path")
+    if raw_path:
+        path = raw_path.split(b"?", 1)[0].decode("latin-1")
+    else:
+        path = scope["path"].encode("utf-8").decode("latin-1")
+    root_path = scope.get("root_path", "")
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path) :]
+
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": root_path,
+        "PATH_INFO": path,
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.input_terminated": True,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+        ASGI_LOOP_KEY: loop,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif name != "CONTENT_LENGTH":  # set from the body below
+            key = "HTTP_" + name
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    environ["CONTENT_LENGTH"] = str(len(body))
+    return environ
+
+
+class AsyncBody:
+    """Async response body with a close callback, like Response.call_on_close
+
+    ASGIAdapter closes the body once the response is over, even if it was
+    never iterated, so whatever was set up for it is always released.
+    """
+
+    def __init__(self, iterable, on_close):
+        self.iterable = iterable
+        self.on_close = on_close
+
+    def __aiter__(self):
+        return self.iterable.__aiter__()
+
+    async def aclose(self):
+        try:
+            if hasattr(self.iterable, "aclose"):
+                await self.iterable.aclose()
+        finally:
+            self.on_close()
+
+
+class ASGIAdapter:
+    """ASGI application wrapping a WSGI application
+
+    Each request is handed to the WSGI app on a bounded thread pool, and a
+    synchronous body is read to the end there, so the event loop never runs
+    application code. An async iterable body is streamed from the loop
+    until the client disconnects; thousands of idle streams then cost only
+    their coroutines. CPU-heavy work is expected to sit behind the app's
+    own process pools.
+    """
+
+    def __init__(self, wsgi_app, threads=32):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="asgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self.http(scope, receive, send)
+        elif scope["type"] == "websocket":
+            await send({"type": "websocket.close", "code": 1000})
+
+    async def lifespan(self, receive, send):
+        """Answer server start-up and shutdown messages"""
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def http(self, scope, receive, send):
+        """Serve one HTTP request"""
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+
+        loop = asyncio.get_running_loop()
+        environ = build_environ(scope, b"".join(chunks), loop)
+        status, headers, body = await loop.run_in_executor(
+            self.executor, self.call_wsgi, environ
+        )
+        try:
+            await send(
+                {"type": "http.response.start", "status": status, "headers": headers}
+            )
+        except BaseException:
+            if hasattr(body, "aclose"):
+                await body.aclose()
+            raise
+        if isinstance(body, list):
+            await send({"type": "http.response.body", "body": b"".join(body)})
+        else:
+            await self.stream(body, receive, send)
+
+    def call_wsgi(self, environ):
+        """Run the WSGI app in a worker thread
+
+        Returns (status, headers, body), where body is a list of byte strings
+        or an async iterable to stream from the event loop.
+        """
+        response = []
+        written = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response[:] = [
+                int(status.split(" ", 1)[0]),
+                [
+                    (name.lower().encode("latin-1"), value.encode("latin-1"))
+                    for name, value in headers
+                ],
+            ]
+            return written.append
+
+        result = self.wsgi_app(environ, start_response)
+        if hasattr(result, "__aiter__"):
+            return response[0], response[1], result
+        try:
+            body = written + [chunk for chunk in result if chunk]
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        return response[0], response[1], body
+
+    async def stream(self, body, receive, send):
+        """Send an async body chunk by chunk until it ends or the client leaves"""
+        disconnected = asyncio.ensure_future(self.wait_disconnect(receive))
+        iterator = body.__aiter__()
+        chunk = None
+        try:
+            while True:
+                chunk = asyncio.ensure_future(iterator.__anext__())
+                await asyncio.wait(
+                    (chunk, disconnected), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not chunk.done():
+                    break
+                try:
+                    data = chunk.result()
+                except StopAsyncIteration:
+                    break
+                await send(
+                    {"type": "http.response.body", "body": data, "more_body": True}
+                )
+            if not disconnected.done():
+                await send({"type": "http.response.body", "body": b""})
+        except OSError:
+            pass  # the connection dropped while sending
+        finally:
+            disconnected.cancel()
+            if chunk is not None and not chunk.done():
+                chunk.cancel()
+                await asyncio.wait((chunk,))  # let the generator unwind first
+            if hasattr(body, "aclose"):
+                await body.aclose()
+
+    @staticmethod
+    async def wait_disconnect(receive):
+        """Wait until the client closes the connection"""
+        while (await receive())["type"] != "http.disconnect":
+            pass
@@ -0,0 +1,490 @@
+"""
+Bitboard Move Generator
+Alternative ChessGame backend that keeps one 64-bit integer per piece code
+"""
+
+from chess_game import (
+    BISHOP,
+    CASTLING_MASK,
+    COLOR_SHIFT,
+    KING,
+    KING_OFFSETS,
+    KNIGHT,
+    KNIGHT_OFFSETS,
+    MOVE_PROMOTION_SHIFT,
+    MOVE_SQUARE_MASK,
+    MOVE_TO_SHIFT,
+    NO_SQUARE,
+    PAWN,
+    PROMOTION_TYPES,
+    QUEEN,
+    ROOK,
+    TYPE_MASK,
+    WHITE,
+    ZOBRIST_BLACK_TO_MOVE,
+    ZOBRIST_CASTLING,
+    ZOBRIST_EP_FILE,
+    ZOBRIST_PIECES,
+    ChessGame,
+    legal_generation_calls,
+)
+
+# Bit n of a bitboard is square n of ChessGame.squares (row * 8 + col)
+FULL = (1 << 64) - 1
+FILE_A = sum(1 << (row * 8) for row in range(8))
+FILE_H = FILE_A << 7
+NOT_FILE_A = FULL ^ FILE_A
+NOT_FILE_H = FULL ^ FILE_H
+ROW_MASKS = [0xFF << (row * 8) for row in range(8)]
+
+
+def _step_attacks(offsets):
+    """Build a per-square table of targets one offset away"""
+    table = []
+    for sq in range(64):
+        row, col = sq >> 3, sq & 7
+        bits = 0
+        for dr, dc in offsets:
+            if 0 <= row + dr < 8 and 0 <= col + dc < 8:
+                bits |= 1 << ((row + dr) * 8 + col + dc)
+        table.append(bits)
+    return table
+
+
+def _ray_table(dr, dc):
+    """Build a per-square table of every square along one direction"""
+    table = []
+    for sq in range(64):
+        row, col = sq >> 3, sq & 7
+        bits = 0
+        row, col = row + dr, col + dc
+        while 0 <= row < 8 and 0 <= col < 8:
+            bits |= 1 << (row * 8 + col)
+            row, col = row + dr, col + dc
+        table.append(bits)
+    return table
+
+
+KNIGHT_ATTACKS = _step_attacks(KNIGHT_OFFSETS)
+KING_ATTACKS = _step_attacks(KING_OFFSETS)
+# Squares attacked by a pawn of each color standing on a square
+PAWN_ATTACKS = (_step_attacks(((-1, -1), (-1, 1))), _step_attacks(((1, -1), (1, 1))))
+
+# Rays that run towards higher square numbers end at their lowest set
+# blocker, the others at their highest
+ROOK_RAYS_UP = (_ray_table(0, 1), _ray_table(1, 0))
+ROOK_RAYS_DOWN = (_ray_table(0, -1), _ray_table(-1, 0))
+BISHOP_RAYS_UP = (_ray_table(1, 1), _ray_table(1, -1))
+BISHOP_RAYS_DOWN = (_ray_table(-1, 1), _ray_table(-1, -1))
+
+# Every square sharing a rank, file or diagonal with each square
+QUEEN_LINES = [
+    sum(rays[sq] for rays in ROOK_RAYS_UP + ROOK_RAYS_DOWN)
+    | sum(rays[sq] for rays in BISHOP_RAYS_UP + BISHOP_RAYS_DOWN)
+    for sq in range(64)
+]
+
+
+def _slider_attacks(sq, occupied, rays_up, rays_down):
+    """Get the squares a slider attacks along the given rays"""
+    attacks = 0
+    for rays in rays_up:
+        ray = rays[sq]
+        blockers = ray & occupied
+        if blockers:
+            ray ^= rays[(blockers & -blockers).bit_length() - 1]
+        attacks |= ray
+    for rays in rays_down:
+        ray = rays[sq]
+        blockers = ray & occupied
+        if blockers:
+            ray ^= rays[blockers.bit_length() - 1]
+        attacks |= ray
+    return attacks
+
+
+def rook_attacks(sq, occupied):
+    """Get the squares a rook on sq attacks given the occupied squares"""
+    return _slider_attacks(sq, occupied, ROOK_RAYS_UP, ROOK_RAYS_DOWN)
+
+
+def bishop_attacks(sq, occupied):
+    """Get the squares a bishop on sq attacks given the occupied squares"""
+    return _slider_attacks(sq, occupied, BISHOP_RAYS_UP, BISHOP_RAYS_DOWN)
+
+
+def iter_squares(bits):
+    """Yield the square numbers of the set bits in a bitboard"""
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+class BitboardChessGame(ChessGame):
+    """ChessGame backend generating moves with bitboards
+
+    The byte-per-square board is still maintained so every ChessGame view
+    keeps working; the bitboards drive move generation and attack tests.
+    """
+
+    backend = "bitboard"
+
+    __slots__ = ("pieces", "occupancy")
+
+    def set_squares(self, squares):
+        """Replace the board and rebuild the bitboards from it"""
+        super().set_squares(squares)
+        self.pieces = [0] * 16  # indexed by piece code
+        self.occupancy = [0, 0]  # indexed by color
+        for sq, piece in enumerate(squares):
+            if piece:
+                self.pieces[piece] |= 1 << sq
+                self.occupancy[piece >> COLOR_SHIFT] |= 1 << sq
+
+    def is_square_attacked(self, sq, by_color):
+        """Check if any piece of the given color attacks a square"""
+        pieces = self.pieces
+        side = by_color << COLOR_SHIFT
+
+        if KNIGHT_ATTACKS[sq] & pieces[side | KNIGHT]:
+            return True
+        if KING_ATTACKS[sq] & pieces[side | KING]:
+            return True
+        # A pawn attacks sq exactly when an enemy pawn on sq would attack it
+        if PAWN_ATTACKS[by_color ^ 1][sq] & pieces[side | PAWN]:
+            return True
+
+        occupied = self.occupancy[0] | self.occupancy[1]
+        queens = pieces[side | QUEEN]
+        rooks = pieces[side | ROOK] | queens
+        if rooks and rook_attacks(sq, occupied) & rooks:
+            return True
+        bishops = pieces[side | BISHOP] | queens
+        if bishops and bishop_attacks(sq, occupied) & bishops:
+            return True
+
+        return False
+
+    def ep_capturable(self):
+        """Whether the side to move has a pawn attacking the en-passant square"""
+        turn = self.turn
+        return bool(
+            PAWN_ATTACKS[turn ^ 1][self.ep_square]
+            & self.pieces[(turn << COLOR_SHIFT) | PAWN]
+        )
+
+    def piece_targets(self, sq, piece):
+        """Get a bitboard of pseudo-legal targets for a piece, without castling"""
+        color = piece >> COLOR_SHIFT
+        own = self.occupancy[color]
+        enemy = self.occupancy[color ^ 1]
+        piece_type = piece & TYPE_MASK
+
+        if piece_type == PAWN:
+            occupied = own | enemy
+            if color == WHITE:
+                push = (1 << sq) >> 8
+                if push & occupied:
+                    push = 0
+                elif sq >> 3 == 6 and not (push >> 8) & occupied:
+                    push |= push >> 8
+            else:
+                push = (1 << sq) << 8 & FULL
+                if push & occupied:
+                    push = 0
+                elif sq >> 3 == 1 and not (push << 8) & occupied:
+                    push |= push << 8
+            if self.ep_square >= 0:
+                enemy |= 1 << self.ep_square
+            return push | (PAWN_ATTACKS[color][sq] & enemy)
+        if piece_type == KNIGHT:
+            return KNIGHT_ATTACKS[sq] & ~own
+        if piece_type == KING:
+            return KING_ATTACKS[sq] & ~own
+
+        occupied = own | enemy
+        if piece_type == ROOK:
+            return rook_attacks(sq, occupied) & ~own
+        if piece_type == BISHOP:
+            return bishop_attacks(sq, occupied) & ~own
+        return (rook_attacks(sq, occupied) | bishop_attacks(sq, occupied)) & ~own
+
+    def get_valid_moves(self, row, col):
+        """Get all valid moves for a piece at the given position"""
+        if not self.is_valid_position(row, col):
+            return []
+
+        sq = row * 8 + col
+        piece = self.squares[sq]
+        if not piece or piece >> COLOR_SHIFT != self.turn:
+            return []
+
+        moves = [
+            divmod(to_sq, 8) for to_sq in iter_squares(self.piece_targets(sq, piece))
+        ]
+        if piece & TYPE_MASK == KING:
+            moves.extend(self.get_castling_moves(row, col, self.turn))
+        return moves
+
+    def generate_moves(self):
+        """Generate pseudo-legal packed moves for the side to move"""
+        moves = []
+        color = self.turn
+        side = color << COLOR_SHIFT
+        pieces = self.pieces
+        own = self.occupancy[color]
+        enemy = self.occupancy[color ^ 1]
+        occupied = own | enemy
+        empty = FULL ^ occupied
+
+        # Pawns are generated set-wise, one shift per move kind
+        pawns = pieces[side | PAWN]
+        if color == WHITE:
+            singles = (pawns >> 8) & empty
+            doubles = ((singles & ROW_MASKS[5]) >> 8) & empty
+            pawn_moves = (
+                (singles, 8),
+                (doubles, 16),
+                (((pawns & NOT_FILE_A) >> 9) & enemy, 9),
+                (((pawns & NOT_FILE_H) >> 7) & enemy, 7),
+            )
+        else:
+            singles = (pawns << 8) & empty
+            doubles = ((singles & ROW_MASKS[2]) << 8) & empty
+            pawn_moves = (
+                (singles, -8),
+                (doubles, -16),
+                (((pawns & NOT_FILE_A) << 7) & enemy, -7),
+                (((pawns & NOT_FILE_H) << 9) & enemy, -9),
+            )
+        last_row = ROW_MASKS[0] | ROW_MASKS[7]
+        for targets, back in pawn_moves:
+            for to_sq in iter_squares(targets & ~last_row):
+                moves.append((to_sq + back) | (to_sq << MOVE_TO_SHIFT))
+            for to_sq in iter_squares(targets & last_row):
+                move = (to_sq + back) | (to_sq << MOVE_TO_SHIFT)
+                for promotion in PROMOTION_TYPES:
+                    moves.append(move | (promotion << MOVE_PROMOTION_SHIFT))
+        ep_square = self.ep_square
+        if ep_square >= 0:
+            for sq in iter_squares(PAWN_ATTACKS[color ^ 1][ep_square] & pawns):
+                moves.append(sq | (ep_square << MOVE_TO_SHIFT))
+
+        not_own = FULL ^ own
+        for piece_type, table in ((KNIGHT, KNIGHT_ATTACKS), (KING, KING_ATTACKS)):
+            for sq in iter_squares(pieces[side | piece_type]):
+                for to_sq in iter_squares(table[sq] & not_own):
+                    moves.append(sq | (to_sq << MOVE_TO_SHIFT))
+
+        queens = pieces[side | QUEEN]
+        for sq in iter_squares(pieces[side | ROOK] | queens):
+            for to_sq in iter_squares(rook_attacks(sq, occupied) & not_own):
+                moves.append(sq | (to_sq << MOVE_TO_SHIFT))
+        for sq in iter_squares(pieces[side | BISHOP] | queens):
+            for to_sq in iter_squares(bishop_attacks(sq, occupied) & not_own):
+                moves.append(sq | (to_sq << MOVE_TO_SHIFT))
+
+        king_sq = self.king_squares[color]
+        if king_sq >= 0:
+            for to_row, to_col in self.get_castling_moves(
+                king_sq >> 3, king_sq & 7, color
+            ):
+                moves.append(king_sq | ((to_row * 8 + to_col) << MOVE_TO_SHIFT))
+
+        return moves
+
+    def generate_legal_moves(self):
+        """Generate the packed moves that don't leave the mover's king in check
+
+        Rather than playing each move, the king's attackers are recomputed
+        from the occupancy after the move. When the king is not in check,
+        only king moves and moves starting on a line through the king can
+        expose it, so every other move is accepted without any test.
+        """
+        legal_generation_calls.inc()
+        color = self.turn
+        king_sq = self.king_squares[color]
+        moves = self.generate_moves()
+        if king_sq < 0:
+            return moves
+
+        pieces = self.pieces
+        enemy = (color ^ 1) << COLOR_SHIFT
+        knights = pieces[enemy | KNIGHT]
+        pawns = pieces[enemy | PAWN]
+        kings = pieces[enemy | KING]
+        rooks = pieces[enemy | ROOK] | pieces[enemy | QUEEN]
+        bishops = pieces[enemy | BISHOP] | pieces[enemy | QUEEN]
+        pawn_attacks = PAWN_ATTACKS[color]
+        occupied = self.occupancy[0] | self.occupancy[1]
+        exposed = FULL if self.is_square_attacked(king_sq, color ^ 1) else 0
+        exposed |= QUEEN_LINES[king_sq] | (1 << king_sq)
+        # En passant removes a pawn from a square the move doesn't touch, so
+        # those captures are played out instead
+        ep_square = self.ep_square
+        if ep_square >= 0:
+            exposed |= PAWN_ATTACKS[color ^ 1][ep_square]
+
+        legal_moves = []
+        for move in moves:
+            from_sq = move & MOVE_SQUARE_MASK
+            if not (exposed >> from_sq) & 1:
+                legal_moves.append(move)
+                continue
+
+            to_sq = (move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK
+            if to_sq == ep_square and self.squares[from_sq] & TYPE_MASK == PAWN:
+                self.push(move)
+                if not self.is_king_in_check(color):
+                    legal_moves.append(move)
+                self.pop()
+                continue
+
+            target_sq = to_sq if from_sq == king_sq else king_sq
+            survivors = FULL ^ (1 << to_sq)
+            after = (occupied ^ (1 << from_sq)) | (1 << to_sq)
+            if (
+                KNIGHT_ATTACKS[target_sq] & knights & survivors
+                or pawn_attacks[target_sq] & pawns & survivors
+                or KING_ATTACKS[target_sq] & kings
+                or rook_attacks(target_sq, after) & rooks & survivors
+                or bishop_attacks(target_sq, after) & bishops & survivors
+            ):
+                continue
+            legal_moves.append(move)
+
+        return legal_moves
+
+    def push(self, move):
+        """Play a packed move without validation, recording how to undo it"""
+        squares = self.squares
+        pieces = self.pieces
+        occupancy = self.occupancy
+        from_sq = move & MOVE_SQUARE_MASK
+        to_sq = (move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK
+        piece = squares[from_sq]
+        captured = squares[to_sq]
+        color = piece >> COLOR_SHIFT
+        ep_square = self.ep_square
+        castling = self.castling
+        zobrist = ZOBRIST_PIECES
+
+        self.undo_stack.append(
+            (move, captured, castling, ep_square, self.halfmove_clock, self.hash)
+        )
+
+        h = self.hash ^ ZOBRIST_BLACK_TO_MOVE ^ ZOBRIST_CASTLING[castling]
+        h ^= zobrist[piece][from_sq] ^ zobrist[piece][to_sq]
+        if captured:
+            h ^= zobrist[captured][to_sq]
+        if ep_square >= 0 and self.ep_capturable():
+            h ^= ZOBRIST_EP_FILE[ep_square & 7]
+
+        to_bit = 1 << to_sq
+        move_bits = (1 << from_sq) | to_bit
+        pieces[piece] ^= move_bits
+        occupancy[color] ^= move_bits
+        if captured:
+            pieces[captured] ^= to_bit
+            occupancy[color ^ 1] ^= to_bit
+        squares[to_sq] = piece
+        squares[from_sq] = 0
+        self.ep_square = NO_SQUARE
+        self.halfmove_clock = 0 if captured else self.halfmove_clock + 1
+
+        piece_type = piece & TYPE_MASK
+        if piece_type == PAWN:
+            self.halfmove_clock = 0
+            promotion = move >> MOVE_PROMOTION_SHIFT
+            if promotion:
+                promoted = (piece & ~TYPE_MASK) | promotion
+                pieces[piece] ^= to_bit
+                pieces[promoted] ^= to_bit
+                squares[to_sq] = promoted
+                h ^= zobrist[piece][to_sq] ^ zobrist[promoted][to_sq]
+            elif to_sq == ep_square:
+                # En passant: the captured pawn stands beside the source square
+                captured_sq = (from_sq & ~7) | (to_sq & 7)
+                enemy_pawn = piece ^ (1 << COLOR_SHIFT)
+                pieces[enemy_pawn] ^= 1 << captured_sq
+                occupancy[color ^ 1] ^= 1 << captured_sq
+                squares[captured_sq] = 0
+                h ^= zobrist[enemy_pawn][captured_sq]
+            elif to_sq - from_sq in (16, -16):
+                self.ep_square = (from_sq + to_sq) >> 1
+        elif piece_type == KING:
+            self.king_squares[color] = to_sq
+            # Castling also moves the rook
+            rook = (color << COLOR_SHIFT) | ROOK
+            if to_sq - from_sq == 2:
+                self._move_rook(from_sq + 3, from_sq + 1)
+                h ^= zobrist[rook][from_sq + 3] ^ zobrist[rook][from_sq + 1]
+            elif from_sq - to_sq == 2:
+                self._move_rook(from_sq - 4, from_sq - 1)
+                h ^= zobrist[rook][from_sq - 4] ^ zobrist[rook][from_sq - 1]
+
+        castling &= CASTLING_MASK[from_sq] & CASTLING_MASK[to_sq]
+        self.castling = castling
+        self.turn ^= 1
+        self.ply += 1
+        if self.ep_square >= 0 and self.ep_capturable():
+            h ^= ZOBRIST_EP_FILE[to_sq & 7]
+        self.hash = h ^ ZOBRIST_CASTLING[castling]
+
+    def pop(self):
+        """Take back the last move played with push"""
+        move, captured, castling, ep_square, halfmove_clock, h = self.undo_stack.pop()
+        squares = self.squares
+        pieces = self.pieces
+        occupancy = self.occupancy
+        from_sq = move & MOVE_SQUARE_MASK
+        to_sq = (move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK
+        piece = squares[to_sq]
+        color = piece >> COLOR_SHIFT
+
+        to_bit = 1 << to_sq
+        if move >> MOVE_PROMOTION_SHIFT:
+            pawn = (piece & ~TYPE_MASK) | PAWN
+            pieces[piece] ^= to_bit
+            pieces[pawn] ^= to_bit
+            piece = pawn
+
+        move_bits = (1 << from_sq) | to_bit
+        pieces[piece] ^= move_bits
+        occupancy[color] ^= move_bits
+        if captured:
+            pieces[captured] ^= to_bit
+            occupancy[color ^ 1] ^= to_bit
+        squares[from_sq] = piece
+        squares[to_sq] = captured
+
+        piece_type = piece & TYPE_MASK
+        if piece_type == PAWN:
+            if to_sq == ep_square:
+                captured_sq = (from_sq & ~7) | (to_sq & 7)
+                pieces[piece ^ (1 << COLOR_SHIFT)] ^= 1 << captured_sq
+                occupancy[color ^ 1] ^= 1 << captured_sq
+                squares[captured_sq] = piece ^ (1 << COLOR_SHIFT)
+        elif piece_type == KING:
+            self.king_squares[color] = from_sq
+            if to_sq - from_sq == 2:
+                self._move_rook(from_sq + 1, from_sq + 3)
+            elif from_sq - to_sq == 2:
+                self._move_rook(from_sq - 1, from_sq - 4)
+
+        self.castling = castling
+        self.ep_square = ep_square
+        self.halfmove_clock = halfmove_clock
+        self.hash = h
+        self.turn ^= 1
+        self.ply -= 1
+
+    def _move_rook(self, from_sq, to_sq):
+        """Move a castling rook on both the board and the bitboards"""
+        rook = self.squares[from_sq]
+        move_bits = (1 << from_sq) | (1 << to_sq)
+        self.pieces[rook] ^= move_bits
+        self.occupancy[rook >> COLOR_SHIFT] ^= move_bits
+        self.squares[to_sq] = rook
+        self.squares[from_sq] = 0
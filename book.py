@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Opening Book
+Compiles PGN collections into a sorted binary file of (position hash, move,
+weight) records and looks positions up in it through a memory map
+"""
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+from collections import Counter
+
+from chess_game import (
+    GAME_BACKENDS,
+    MOVE_SQUARE_MASK,
+    MOVE_TO_SHIFT,
+    create_game,
+    move_to_uci,
+)
+from ingest import parse_san, read_pgn, san_tokens
+
+# File layout: a header, then fixed-width records sorted by position hash
+# and, within a position, by descending weight. Integers are little-endian.
+BOOK_MAGIC = b"CHBK"
+BOOK_VERSION = 2  # 2: en-passant file hashed only when a capture is possible
+HEADER = struct.Struct("<4sHHQQ")  # magic, version, record size, key check, count
+RECORD = struct.Struct("<QHH")  # Zobrist hash, packed move, weight
+MAX_WEIGHT = 0xFFFF
+
+
+class OpeningBook:
+    """Read-only view of a book file
+
+    The file is memory-mapped, so opening it costs no parsing and every
+    process serving from the same file shares its pages through the OS
+    page cache. A lookup is a binary search over the records.
+    """
+
+    def __init__(self, path, key_check=None):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < HEADER.size:
+            raise ValueError(f"Not an opening book: {path}")
+        magic, version, record_size, book_key, count = HEADER.unpack_from(self._map)
+        if magic != BOOK_MAGIC or record_size != RECORD.size:
+            raise ValueError(f"Not an opening book: {path}")
+        if version != BOOK_VERSION:
+            raise ValueError(f"Unsupported opening book version {version}: {path}")
+        if len(self._map) < HEADER.size + count * RECORD.size:
+            raise ValueError(f"Truncated opening book: {path}")
+        if key_check is not None and book_key != key_check:
+            raise ValueError(f"Opening book built with other Zobrist keys: {path}")
+        self.path = path
+        self.count = count
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        """Unmap the file"""
+        self._map.close()
+
+    def lookup(self, key):
+        """Get the [(move, weight)] recorded for a position hash, best first"""
+        data = self._map
+        unpack = RECORD.unpack_from
+        base = HEADER.size
+        size = RECORD.size
+        low, high = 0, self.count
+        while low < high:  # first record whose hash is >= key
+            middle = (low + high) >> 1
+            if unpack(data, base + middle * size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        entries = []
+        while low < self.count:
+            record_key, move, weight = unpack(data, base + low * size)
+            if record_key != key:
+                break
+            entries.append((move, weight))
+            low += 1
+        return entries
+
+    def moves(self, game):
+        """Get the [(move, weight)] for the game's position that are legal
+
+        Checking legality guards against the rare hash collision. It uses
+        the game's cached legal-move map, so a position already shown to a
+        player costs no move generation.
+        """
+        entries = self.lookup(game.hash)
+        if not entries:
+            self.misses += 1
+            return entries
+        move_map = game.get_legal_move_map()[0]
+        entries = [
+            (move, weight)
+            for move, weight in entries
+            if (move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK
+            in move_map.get(move & MOVE_SQUARE_MASK, ())
+        ]
+        if entries:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return entries
+
+    def choose(self, game, rng=None):
+        """Pick a book move for the game, or return (0, 0)
+
+        Returns (move, weight). Without rng the heaviest move is taken;
+        with one, moves are drawn in proportion to their weights so the
+        computer opponent varies its openings.
+        """
+        entries = self.moves(game)
+        if not entries:
+            return 0, 0
+        if rng is None:
+            return entries[0]
+        return rng.choices(entries, weights=[weight for _, weight in entries])[0]
+
+
+def collect_moves(games, plies=20, backend="bitboard"):
+    """Count how often each (position hash, move) was played in the games
+
+    games yields (headers, movetext) pairs as from ingest.read_pgn. Only
+    the first plies half-moves of each game are replayed; games that start
+    from a custom FEN are skipped. Returns the Counter and the number of
+    games used.
+    """
+    counts = Counter()
+    used = 0
+    for headers, movetext in games:
+        if headers.get("FEN"):
+            continue
+        game = create_game(backend)
+        try:
+            for san in san_tokens(movetext)[:plies]:
+                move = parse_san(game, san)
+                counts[game.hash, move] += 1
+                game.push(move)
+        except ValueError:
+            pass  # keep the moves up to the first bad one
+        used += 1
+    return counts, used
+
+
+def write_book(counts, path, key_check, min_games=1):
+    """Write counted moves as a sorted book file, returning the record count
+
+    Moves played in fewer than min_games games are left out. The file is
+    written beside the target and renamed over it, so processes already
+    serving the old book keep a consistent view of it.
+    """
+    records = sorted(
+        (key, -min(count, MAX_WEIGHT), move)
+        for (key, move), count in counts.items()
+        if count >= min_games
+    )
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(
+            HEADER.pack(BOOK_MAGIC, BOOK_VERSION, RECORD.size, key_check, len(records))
+        )
+        for key, weight, move in records:
+            f.write(RECORD.pack(key, move, -weight))
+    os.replace(temporary, path)
+    return len(records)
+
+
+def start_key():
+    """Hash of the standard starting position, recorded to detect stale books"""
+    return create_game("mailbox").hash
+
+
+def open_book(path):
+    """Open a book file, checking it matches this build's Zobrist keys"""
+    return OpeningBook(path, start_key())
+
+
+def main(argv=None):
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Build or probe an opening book")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="compile PGN files into a book")
+    build.add_argument("paths", nargs="+", help="PGN files ('-' for stdin)")
+    build.add_argument("--output", "-o", default="book.bin", help="book file")
+    build.add_argument("--plies", type=int, default=20, help="half-moves per game")
+    build.add_argument(
+        "--min-games", type=int, default=1, help="drop moves played less often"
+    )
+    build.add_argument(
+        "--backend", choices=GAME_BACKENDS, default="bitboard", help="move generator"
+    )
+    probe = commands.add_parser("probe", help="list the book moves of a position")
+    probe.add_argument("book", help="book file")
+    probe.add_argument("fen", nargs="?", help="position (default the start)")
+    args = parser.parse_args(argv)
+
+    if args.command == "probe":
+        book = open_book(args.book)
+        game = create_game()
+        if args.fen:
+            game.set_fen(args.fen)
+        start = time.perf_counter()
+        entries = book.moves(game)
+        seconds = time.perf_counter() - start
+        total = sum(weight for _, weight in entries)
+        for move, weight in entries:
+            print(f"{move_to_uci(move):<6} {weight:>6} {weight / total:7.1%}")
+        print(
+            f"📖 {len(entries)} book moves ({len(book)} records) in "
+            f"{seconds * 1e6:.0f}µs",
+            file=sys.stderr,
+        )
+        return 0 if entries else 1
+
+    start = time.perf_counter()
+    counts = Counter()
+    games = 0
+    for path in args.paths:
+        source = (
+            sys.stdin if path == "-" else open(path, encoding="utf-8", errors="replace")
+        )
+        try:
+            path_counts, path_games = collect_moves(
+                read_pgn(source), args.plies, args.backend
+            )
+        finally:
+            if source is not sys.stdin:
+                source.close()
+        counts.update(path_counts)
+        games += path_games
+    records = write_book(counts, args.output, start_key(), args.min_games)
+    print(
+        f"📖 {records} book moves from {games} games in "
+        f"{time.perf_counter() - start:.2f}s, written to {args.output}",
+        file=sys.stderr,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
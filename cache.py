@@ -0,0 +1,148 @@
+"""
+LRU Cache
+Small thread-safe least-recently-used caches with hit/miss counters
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Bounded mapping that evicts the least recently used entry"""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Look up a key, marking it as recently used"""
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Store a value, evicting the oldest entry when full"""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop every entry and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Get the size and hit/miss counters"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+class Flight:
+    """A computation in progress that other callers wait on"""
+
+    __slots__ = ("version", "done", "value", "error")
+
+    def __init__(self, version):
+        self.version = version
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class VersionedCache:
+    """Bounded cache holding each key's value for one version at a time
+
+    get() returns the cached value while it was computed for the version
+    asked for, and computes a new one otherwise. Concurrent misses on the
+    same key and version are coalesced (single flight): one caller runs the
+    computation while the others wait for its result.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0  # misses served by another caller's computation
+        self._entries = LRUCache(maxsize)  # key -> (version, value)
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, version, compute):
+        """Get the value of key for version, calling compute() on a miss"""
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            self.hits += 1
+            return entry[1]
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None or flight.version != version
+            if leader:
+                flight = self._flights[key] = Flight(version)
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute()
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                if flight.error is None:
+                    entry = self._entries.get(key)
+                    if entry is None or entry[0] <= version:  # keep newer values
+                        self._entries.put(key, (version, flight.value))
+            flight.done.set()
+        return flight.value
+
+    def clear(self):
+        """Drop every entry and reset the counters"""
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def stats(self):
+        """Get the size and hit/miss counters"""
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._entries),
+            "maxsize": self._entries.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
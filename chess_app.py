@@ -1,530 +1,410 @@
 #!/usr/bin/env python3
 """
 Chess Game Application
-A complete chess game with move validation and game state management
+Flask app serving the games of chess_game.py over a JSON API, with shared
+game storage, live updates and engine workers
 """
 
-import json
+import math
 import os
-from datetime import datetime
-
-from flask import Flask, jsonify, render_template, request, session
+import random
+import time
+from contextlib import contextmanager
+
+from flask import Flask, g, jsonify, render_template, request, session
+
+from asgi import ASGI_LOOP_KEY, AsyncBody
+from cache import VersionedCache
+from chess_game import (
+    MOVE_HISTORY_PAGE,
+    create_game,
+    encode_position,
+    king_check_calls,
+    legal_generation_calls,
+    legal_move_cache,
+    load_game,
+    move_to_uci,
+)
+from event_hub import RESYNC_EVENT, EventHub, HubFull, format_event
+from game_registry import GameNotFound, GameRegistry
+from game_store import create_store
+from job_pool import JobNotFound, JobPool, PoolFull
+from metrics import MetricRegistry
+from profiling import ProfileStore, RequestProfiler
 
 app = Flask(__name__)
 app.secret_key = "chess_game_secret_key_2024"
 
 
-class ChessGame:
-    """Chess game logic and state management"""
-
-    def __init__(self):
-        self.board = self.initialize_board()
-        self.current_player = "white"
-        self.game_over = False
-        self.game_result = None  # 'checkmate', 'stalemate', or None
-        self.move_history = []
-        self.captured_pieces = {"white": [], "black": []}
-        # Track piece movements for castling
-        self.piece_moved = {
-            "white_king": False,
-            "white_rook_queenside": False,
-            "white_rook_kingside": False,
-            "black_king": False,
-            "black_rook_queenside": False,
-            "black_rook_kingside": False,
-        }
-
-    def initialize_board(self):
-        """Initialize the chess board with pieces in starting positions"""
-        board = [["" for _ in range(8)] for _ in range(8)]
-
-        # Set up pawns
-        for col in range(8):
-            board[1][col] = "black_pawn"
-            board[6][col] = "white_pawn"
-
-        # Set up other pieces
-        pieces = [
-            "rook",
-            "knight",
-            "bishop",
-            "queen",
-            "king",
-            "bishop",
-            "knight",
-            "rook",
-        ]
-        for col, piece in enumerate(pieces):
-            board[0][col] = f"black_{piece}"
-            board[7][col] = f"white_{piece}"
-
-        return board
-
-    def get_piece_color(self, piece):
-        """Get the color of a piece"""
-        if not piece:
-            return None
-        return piece.split("_")[0]
-
-    def get_piece_type(self, piece):
-        """Get the type of a piece"""
-        if not piece:
-            return None
-        return piece.split("_")[1]
-
-    def is_valid_position(self, row, col):
-        """Check if position is within board bounds"""
-        return 0 <= row < 8 and 0 <= col < 8
-
-    def get_valid_moves(self, row, col):
-        """Get all valid moves for a piece at the given position"""
-        if not self.is_valid_position(row, col):
-            return []
-
-        piece = self.board[row][col]
-        if not piece:
-            return []
-
-        piece_color = self.get_piece_color(piece)
-        piece_type = self.get_piece_type(piece)
-
-        if piece_color != self.current_player:
-            return []
-
-        moves = []
-
-        if piece_type == "pawn":
-            moves = self.get_pawn_moves(row, col, piece_color)
-        elif piece_type == "rook":
-            moves = self.get_rook_moves(row, col, piece_color)
-        elif piece_type == "knight":
-            moves = self.get_knight_moves(row, col, piece_color)
-        elif piece_type == "bishop":
-            moves = self.get_bishop_moves(row, col, piece_color)
-        elif piece_type == "queen":
-            moves = self.get_queen_moves(row, col, piece_color)
-        elif piece_type == "king":
-            moves = self.get_king_moves(row, col, piece_color)
-
-        return moves
-
-    def get_pawn_moves(self, row, col, color):
-        """Get valid moves for a pawn"""
-        moves = []
-        direction = -1 if color == "white" else 1
-        start_row = 6 if color == "white" else 1
-
-        # Forward move
-        new_row = row + direction
-        if self.is_valid_position(new_row, col) and not self.board[new_row][col]:
-            moves.append((new_row, col))
-
-            # Double move from starting position
-            if row == start_row:
-                new_row2 = row + 2 * direction
-                if (
-                    self.is_valid_position(new_row2, col)
-                    and not self.board[new_row2][col]
-                ):
-                    moves.append((new_row2, col))
-
-        # Diagonal captures
-        for col_offset in [-1, 1]:
-            new_col = col + col_offset
-            new_row = row + direction
-            if (
-                self.is_valid_position(new_row, new_col)
-                and self.board[new_row][new_col]
-                and self.get_piece_color(self.board[new_row][new_col]) != color
-            ):
-                moves.append((new_row, new_col))
-
-        return moves
-
-    def get_rook_moves(self, row, col, color):
-        """Get valid moves for a rook"""
-        moves = []
-        directions = [(0, 1), (0, -1), (1, 0), (-1, 0)]
-
-        for dr, dc in directions:
-            for i in range(1, 8):
-                new_row, new_col = row + i * dr, col + i * dc
-                if not self.is_valid_position(new_row, new_col):
-                    break
-
-                target_piece = self.board[new_row][new_col]
-                if not target_piece:
-                    moves.append((new_row, new_col))
-                elif self.get_piece_color(target_piece) != color:
-                    moves.append((new_row, new_col))
-                    break
-                else:
-                    break
-
-        return moves
-
-    def get_knight_moves(self, row, col, color):
-        """Get valid moves for a knight"""
-        moves = []
-        knight_moves = [
-            (-2, -1),
-            (-2, 1),
-            (-1, -2),
-            (-1, 2),
-            (1, -2),
-            (1, 2),
-            (2, -1),
-            (2, 1),
-        ]
-
-        for dr, dc in knight_moves:
-            new_row, new_col = row + dr, col + dc
-            if self.is_valid_position(new_row, new_col):
-                target_piece = self.board[new_row][new_col]
-                if not target_piece or self.get_piece_color(target_piece) != color:
-                    moves.append((new_row, new_col))
-
-        return moves
-
-    def get_bishop_moves(self, row, col, color):
-        """Get valid moves for a bishop"""
-        moves = []
-        directions = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
-
-        for dr, dc in directions:
-            for i in range(1, 8):
-                new_row, new_col = row + i * dr, col + i * dc
-                if not self.is_valid_position(new_row, new_col):
-                    break
-
-                target_piece = self.board[new_row][new_col]
-                if not target_piece:
-                    moves.append((new_row, new_col))
-                elif self.get_piece_color(target_piece) != color:
-                    moves.append((new_row, new_col))
-                    break
-                else:
-                    break
-
-        return moves
-
-    def get_queen_moves(self, row, col, color):
-        """Get valid moves for a queen (combination of rook and bishop)"""
-        return self.get_rook_moves(row, col, color) + self.get_bishop_moves(
-            row, col, color
+# Metrics served on /metrics. Counter increments are single C calls, cheap
+# enough for the move generator's inner loops, so they are always on.
+app_metrics = MetricRegistry()
+request_count = app_metrics.counter(
+    "chess_http_requests_total",
+    "HTTP requests by route, method and status",
+    ("route", "method", "status"),
+)
+request_latency = app_metrics.histogram(
+    "chess_http_request_duration_seconds",
+    "HTTP request latency by route and method",
+    ("route", "method"),
+)
+for counter in (legal_generation_calls, king_check_calls):
+    app_metrics.register(counter)
+
+
+# Live games keyed by game ID
+games = GameRegistry(
+    create_store,  # opened on first use, in the serving process
+    load_game,
+    max_games=int(os.environ.get("CHESS_MAX_GAMES", 1000)),
+    idle_timeout=int(os.environ.get("CHESS_GAME_IDLE_TIMEOUT", 3600)),
+)
+
+# Encoded full game states keyed by (game ID, with legal moves), valid for
+# the game's stored version (see cached_game_state)
+state_cache = VersionedCache(int(os.environ.get("CHESS_STATE_CACHE_SIZE", 2000)))
+
+
+def resolve_game_id(game_id=None):
+    """Get the game a request refers to
+
+    Routes without a game ID in the URL use the game stored in the
+    browser session. Only a POST starts one when the session has none, so
+    crawlers and health checks never create games; other requests then
+    get None (see read_game).
+    """
+    if game_id is not None:
+        return game_id
+    game_id = session.get("game_id")
+    if game_id is not None and game_id in games:
+        return game_id
+    if request.method != "POST":
+        return None
+    game_id = games.create(create_game())
+    session["game_id"] = game_id
+    return game_id
+
+
+@contextmanager
+def read_game(game_id=None):
+    """Hold the game a read-only request refers to, as games.locked does
+
+    A session without a game reads a fresh game that is never stored.
+    """
+    game_id = resolve_game_id(game_id)
+    if game_id is None:
+        yield create_game()
+    else:
+        with games.locked(game_id) as game:
+            yield game
+
+
+# Move events pushed to players and spectators (see /api/events)
+# Threaded servers hold a thread per open stream, so only some of the
+# threads may stream; ASGI streams wait on the event loop and aren't capped
+event_hub = EventHub(
+    int(os.environ.get("CHESS_EVENT_QUEUE_SIZE", 64)),
+    int(os.environ.get("CHESS_MAX_EVENT_STREAMS", 16)),
+)
+EVENT_HEARTBEAT = 15.0
+EVENT_STREAM_RESPONSE = {
+    "mimetype": "text/event-stream",
+    "headers": {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+}
+
+# Computer opponent (see engine.py)
+ENGINE_DEFAULT_TIME = float(os.environ.get("CHESS_ENGINE_TIME", 0.5))
+ENGINE_MAX_TIME = float(os.environ.get("CHESS_ENGINE_MAX_TIME", 2.0))
+ENGINE_TABLE_SIZE = int(os.environ.get("CHESS_ENGINE_TABLE_SIZE", 1 << 18))
+ANALYSIS_MAX_TIME = float(os.environ.get("CHESS_ANALYSIS_MAX_TIME", 30.0))
+ENGINE_MIN_TIME = 0.01  # a search always gets a time limit, however small
+JOB_TIMEOUT_GRACE = 1.0  # slack for queueing on top of a search's time budget
+JOB_MAX_WAIT = 30.0
+
+# Opening book (see book.py) answering engine moves before any search. The
+# file is memory-mapped on first use, so every worker process shares its
+# pages through the OS page cache.
+OPENING_BOOK = os.environ.get("CHESS_OPENING_BOOK")
+opening_book = None
+book_rng = random.Random()
+if hasattr(os, "register_at_fork"):
+    # Workers forked from a preloaded app would otherwise pick the same moves
+    os.register_at_fork(after_in_child=book_rng.seed)
+
+
+def get_opening_book():
+    """Get the opening book, or None if CHESS_OPENING_BOOK is not set"""
+    global opening_book
+    if opening_book is None and OPENING_BOOK:
+        from book import open_book
+
+        opening_book = open_book(OPENING_BOOK)
+    return opening_book
+
+
+# Worker processes for searches, so request threads never hold the GIL on
+# them. Engine moves get their own small pool so they stay fast while long
+# analyses run; CHESS_ENGINE_WORKERS=0 searches engine moves inline instead.
+engine_pool = JobPool(
+    max_workers=int(os.environ.get("CHESS_ENGINE_WORKERS", 1)),
+    max_pending=int(os.environ.get("CHESS_ENGINE_QUEUE", 4)),
+)
+analysis_pool = JobPool(
+    max_workers=int(os.environ.get("CHESS_ANALYSIS_WORKERS", 2)),
+    max_pending=int(os.environ.get("CHESS_ANALYSIS_QUEUE", 16)),
+)
+
+# Figures other objects already keep are read when /metrics is scraped
+app_metrics.counter_function(
+    "chess_legal_move_cache_hits_total",
+    "Legal-move cache hits",
+    lambda: legal_move_cache.hits,
+)
+app_metrics.counter_function(
+    "chess_legal_move_cache_misses_total",
+    "Legal-move cache misses",
+    lambda: legal_move_cache.misses,
+)
+app_metrics.gauge_function(
+    "chess_legal_move_cache_entries",
+    "Legal-move cache size",
+    lambda: len(legal_move_cache),
+)
+app_metrics.counter_function(
+    "chess_state_cache_hits_total",
+    "Game-state requests served from the encoded-state cache",
+    lambda: state_cache.hits,
+)
+app_metrics.counter_function(
+    "chess_state_cache_misses_total",
+    "Game states built and encoded for the cache",
+    lambda: state_cache.misses,
+)
+app_metrics.counter_function(
+    "chess_state_cache_coalesced_total",
+    "Game-state cache misses that waited for another request's build",
+    lambda: state_cache.coalesced,
+)
+app_metrics.gauge_function(
+    "chess_games_live", "Games resident in this process", lambda: len(games)
+)
+app_metrics.counter_function(
+    "chess_game_reloads_total",
+    "Games reloaded from the store after a change elsewhere",
+    lambda: games.reloads,
+)
+app_metrics.counter_function(
+    "chess_game_evictions_total", "Games evicted from memory", lambda: games.evictions
+)
+app_metrics.counter_function(
+    "chess_journal_syncs_total",
+    "Journal batches written and fsynced (journal game store only)",
+    lambda: getattr(games.store, "syncs", None),
+)
+app_metrics.counter_function(
+    "chess_journal_entries_total",
+    "Journal entries written (journal game store only)",
+    lambda: getattr(games.store, "entries_written", None),
+)
+app_metrics.gauge_function(
+    "chess_event_subscribers", "Open Server-Sent Events streams", lambda: len(event_hub)
+)
+app_metrics.counter_function(
+    "chess_event_streams_refused_total",
+    "Event streams refused because all stream threads were busy",
+    lambda: event_hub.refused,
+)
+app_metrics.counter_function(
+    "chess_book_hits_total",
+    "Opening book lookups that found a move",
+    lambda: opening_book.hits if opening_book else None,
+)
+app_metrics.counter_function(
+    "chess_book_misses_total",
+    "Opening book lookups that found none",
+    lambda: opening_book.misses if opening_book else None,
+)
+app_metrics.gauge_function(
+    "chess_jobs_pending",
+    "Queued or running search jobs by pool",
+    lambda: {
+        ("engine",): engine_pool.stats()["pending"],
+        ("analysis",): analysis_pool.stats()["pending"],
+    },
+    ("pool",),
+)
+
+
+@app.before_request
+def start_request_timer():
+    """Note when the request started, for the latency histogram"""
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    """Count the request and record its latency by route"""
+    started = g.get("request_started")
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        request_latency.labels(route, request.method).observe(
+            time.perf_counter() - started
         )
+        request_count.labels(route, request.method, str(response.status_code)).inc()
+    return response
 
-    def get_king_moves(self, row, col, color):
-        """Get valid moves for a king"""
-        moves = []
-        king_moves = [
-            (-1, -1),
-            (-1, 0),
-            (-1, 1),
-            (0, -1),
-            (0, 1),
-            (1, -1),
-            (1, 0),
-            (1, 1),
-        ]
-
-        for dr, dc in king_moves:
-            new_row, new_col = row + dr, col + dc
-            if self.is_valid_position(new_row, new_col):
-                target_piece = self.board[new_row][new_col]
-                if not target_piece or self.get_piece_color(target_piece) != color:
-                    moves.append((new_row, new_col))
-
-        # Add castling moves if available
-        castling_moves = self.get_castling_moves(row, col, color)
-        moves.extend(castling_moves)
-
-        return moves
-
-    def can_castle(self, color, side):
-        """Check if castling is possible for given color and side"""
-        king_key = f"{color}_king"
-        rook_key = f"{color}_rook_{side}"
-
-        # Check if king or rook have moved
-        if self.piece_moved[king_key] or self.piece_moved[rook_key]:
-            return False
-
-        # Determine positions
-        king_row = 7 if color == "white" else 0
-        if side == "kingside":
-            king_col, rook_col = 4, 7
-            between_cols = [5, 6]
-        else:  # queenside
-            king_col, rook_col = 4, 0
-            between_cols = [1, 2, 3]
-
-        # Check if pieces are in correct positions
-        if (
-            self.board[king_row][king_col] != f"{color}_king"
-            or self.board[king_row][rook_col] != f"{color}_rook"
-        ):
-            return False
-
-        # Check if squares between king and rook are empty
-        for col in between_cols:
-            if self.board[king_row][col]:
-                return False
-
-        # Check if king is in check
-        if self.is_king_in_check(color):
-            return False
-
-        # Check if king would pass through or land in check
-        king_path = [4, 5, 6] if side == "kingside" else [4, 3, 2]
-        for col in king_path:
-            # Temporarily move king to check for check
-            original = self.board[king_row][col]
-            self.board[king_row][col] = f"{color}_king"
-            self.board[king_row][4] = ""
-
-            in_check = self.is_king_in_check(color)
-
-            # Restore board
-            self.board[king_row][4] = f"{color}_king"
-            self.board[king_row][col] = original
-
-            if in_check:
-                return False
 
+# Opt-in request profiling (see profiling.py). Without CHESS_PROFILING the
+# middleware is not installed at all, so requests pay nothing for it.
+PROFILING = os.environ.get("CHESS_PROFILING", "").lower() in ("1", "true", "yes")
+PROFILE_TOKEN = os.environ.get("CHESS_PROFILE_TOKEN") or None
+profiles = ProfileStore(int(os.environ.get("CHESS_PROFILE_KEEP", 20)))
+if PROFILING:
+    app.wsgi_app = RequestProfiler(app.wsgi_app, profiles, PROFILE_TOKEN)
+
+
+def profiles_allowed():
+    """Check that profiling is on and the request carries any required token"""
+    if not PROFILING:
+        return False
+    if PROFILE_TOKEN is None:
         return True
+    token = request.headers.get("X-Profile-Token") or request.args.get("token")
+    return token == PROFILE_TOKEN
 
-    def get_castling_moves(self, row, col, color):
-        """Get available castling moves for the king"""
-        moves = []
-
-        # Only kings on their starting square can castle
-        expected_row = 7 if color == "white" else 0
-        if row != expected_row or col != 4:
-            return moves
-
-        # Check kingside castling
-        if self.can_castle(color, "kingside"):
-            moves.append((expected_row, 6))
-
-        # Check queenside castling
-        if self.can_castle(color, "queenside"):
-            moves.append((expected_row, 2))
-
-        return moves
-
-    def make_move(self, from_pos, to_pos):
-        """Make a move on the board"""
-        from_row, from_col = from_pos
-        to_row, to_col = to_pos
-
-        if not self.is_valid_position(from_row, from_col) or not self.is_valid_position(
-            to_row, to_col
-        ):
-            return False, "Invalid position"
-
-        piece = self.board[from_row][from_col]
-        if not piece:
-            return False, "No piece at source position"
-
-        if self.get_piece_color(piece) != self.current_player:
-            return False, "Not your piece"
-
-        valid_moves = self.get_legal_moves(from_row, from_col)
-        if (to_row, to_col) not in valid_moves:
-            return False, "Invalid move"
-
-        # Check if this is a castling move
-        if piece.endswith("_king") and abs(to_col - from_col) == 2:
-            # Determine which side and move the rook
-            if to_col > from_col:  # Kingside castling
-                rook_from_col, rook_to_col = 7, 5
-            else:  # Queenside castling
-                rook_from_col, rook_to_col = 0, 3
-
-            # Move the rook
-            rook = self.board[from_row][rook_from_col]
-            self.board[from_row][rook_to_col] = rook
-            self.board[from_row][rook_from_col] = ""
-
-        # Capture piece if present
-        captured_piece = self.board[to_row][to_col]
-        if captured_piece:
-            self.captured_pieces[self.current_player].append(captured_piece)
-
-        # Make the move
-        self.board[to_row][to_col] = piece
-        self.board[from_row][from_col] = ""
-
-        # Track piece movements for castling
-        self.update_piece_moved_status(piece, from_row, from_col)
-
-        # Record move
-        move_record = {
-            "from": from_pos,
-            "to": to_pos,
-            "piece": piece,
-            "captured": captured_piece,
-            "player": self.current_player,
-            "timestamp": datetime.now().isoformat(),
-        }
-        self.move_history.append(move_record)
 
-        # Switch players
-        self.current_player = "black" if self.current_player == "white" else "white"
+def move_event(game, before):
+    """Build the event for a game's changes since version before
 
-        # Check for checkmate or stalemate
-        result = self.is_checkmate_or_stalemate()
-        if result:
-            if result == "checkmate":
-                return True, f"Checkmate! {self.current_player} wins!"
-            else:
-                return True, "Stalemate! Game is a draw!"
-
-        return True, "Move successful"
-
-    def update_piece_moved_status(self, piece, from_row, from_col):
-        """Update the piece moved tracking for castling"""
-        color = self.get_piece_color(piece)
-        piece_type = piece.split("_")[1]
-
-        if piece_type == "king":
-            self.piece_moved[f"{color}_king"] = True
-        elif piece_type == "rook":
-            # Determine which rook based on starting position
-            if color == "white" and from_row == 7:
-                if from_col == 0:
-                    self.piece_moved["white_rook_queenside"] = True
-                elif from_col == 7:
-                    self.piece_moved["white_rook_kingside"] = True
-            elif color == "black" and from_row == 0:
-                if from_col == 0:
-                    self.piece_moved["black_rook_queenside"] = True
-                elif from_col == 7:
-                    self.piece_moved["black_rook_kingside"] = True
-
-    def find_king(self, color):
-        """Find the position of the king of the specified color"""
-        for row in range(8):
-            for col in range(8):
-                piece = self.board[row][col]
-                if piece == f"{color}_king":
-                    return (row, col)
-        return None
+    Called with the game lock held; publish it with publish_move.
+    """
+    _, in_check = game.get_legal_move_map()
+    return game.get_game_state(in_check, before), game.version
 
-    def is_king_in_check(self, color):
-        """Check if the king of the specified color is in check"""
-        king_pos = self.find_king(color)
-        if not king_pos:
-            return False
-
-        king_row, king_col = king_pos
-        opponent_color = "black" if color == "white" else "white"
-
-        # Check if any opponent piece can attack the king
-        for row in range(8):
-            for col in range(8):
-                piece = self.board[row][col]
-                if piece and self.get_piece_color(piece) == opponent_color:
-                    # Get all possible moves for this piece
-                    piece_type = self.get_piece_type(piece)
-                    moves = []
-
-                    if piece_type == "pawn":
-                        moves = self.get_pawn_moves(row, col, opponent_color)
-                    elif piece_type == "rook":
-                        moves = self.get_rook_moves(row, col, opponent_color)
-                    elif piece_type == "knight":
-                        moves = self.get_knight_moves(row, col, opponent_color)
-                    elif piece_type == "bishop":
-                        moves = self.get_bishop_moves(row, col, opponent_color)
-                    elif piece_type == "queen":
-                        moves = self.get_queen_moves(row, col, opponent_color)
-                    elif piece_type == "king":
-                        moves = self.get_king_moves(row, col, opponent_color)
-
-                    # Check if any move can capture the king
-                    if king_pos in moves:
-                        return True
 
-        return False
+def publish_move(game_id, event):
+    """Push a move_event to the game's subscribers
 
-    def is_move_legal(self, from_pos, to_pos):
-        """Check if a move is legal (doesn't leave own king in check)"""
-        from_row, from_col = from_pos
-        to_row, to_col = to_pos
-
-        # Make a temporary move
-        temp_board = [row[:] for row in self.board]
-        piece = temp_board[from_row][from_col]
-        temp_board[to_row][to_col] = piece
-        temp_board[from_row][from_col] = ""
-
-        # Check if this move leaves the current player's king in check
-        # We need to temporarily set the board and check
-        original_board = self.board
-        self.board = temp_board
-
-        in_check = self.is_king_in_check(self.current_player)
-
-        # Restore the original board
-        self.board = original_board
-
-        return not in_check
-
-    def get_legal_moves(self, row, col):
-        """Get all legal moves for a piece (excluding moves that leave king in check)"""
-        basic_moves = self.get_valid_moves(row, col)
-        legal_moves = []
-
-        for move in basic_moves:
-            if self.is_move_legal((row, col), move):
-                legal_moves.append(move)
-
-        return legal_moves
-
-    def is_checkmate_or_stalemate(self):
-        """Check if the current position is checkmate or stalemate"""
-        # Check if current player has any legal moves
-        has_legal_moves = False
-        for row in range(8):
-            for col in range(8):
-                piece = self.board[row][col]
-                if piece and self.get_piece_color(piece) == self.current_player:
-                    legal_moves = self.get_legal_moves(row, col)
-                    if legal_moves:
-                        has_legal_moves = True
-                        break
-            if has_legal_moves:
-                break
-
-        if not has_legal_moves:
-            if self.is_king_in_check(self.current_player):
-                self.game_result = "checkmate"
-                self.game_over = True
-                return "checkmate"
-            else:
-                self.game_result = "stalemate"
-                self.game_over = True
-                return "stalemate"
+    Called after the games.locked block has saved the move, so a subscriber
+    that refetches the game sees it. Two moves published out of order show
+    up on the client as a version gap, which it answers by refetching. The
+    event is serialized once for all subscribers.
+    """
+    if event is not None:
+        state, version = event
+        event_hub.publish(game_id, "move", state, version)
 
-        return None
 
-    def get_game_state(self):
-        """Get current game state for API"""
-        return {
-            "board": self.board,
-            "current_player": self.current_player,
-            "game_over": self.game_over,
-            "game_result": self.game_result,
-            "move_history": self.move_history,
-            "captured_pieces": self.captured_pieces,
-            "in_check": self.is_king_in_check(self.current_player),
-        }
+def api_game_state(game, since=None):
+    """Get a game's state for a response, with its legal moves if requested
+
+    Clients ask for the legal-move map with ?legal_moves=1, which saves a
+    valid-moves request per piece selection.
+    """
+    move_map, in_check = game.get_legal_move_map()
+    if request.args.get("legal_moves", "").lower() not in ("1", "true"):
+        move_map = None
+    return game.get_game_state(in_check, since, move_map)
+
 
+def parse_since(data):
+    """Get the client's state version from a JSON body, or None
 
-# Global game instance
-game = ChessGame()
+    Raises ValueError if "since" is present but not an integer.
+    """
+    since = data.get("since")
+    if since is None:
+        return None
+    if isinstance(since, int) and not isinstance(since, bool):
+        return since
+    if isinstance(since, str) and since.strip().lstrip("-").isdigit():
+        return int(since)
+    raise ValueError(f"Invalid since version: {since!r}")
+
+
+def parse_search_limits(data, default_time, max_time, max_depth):
+    """Get (time, nodes, depth) search limits from a JSON body
+
+    time is clamped to [ENGINE_MIN_TIME, max_time] and depth to max_depth.
+    Raises ValueError if time is not a finite number or nodes or depth is
+    not a positive integer.
+    """
+    time_limit = data.get("time", default_time)
+    if (
+        isinstance(time_limit, bool)
+        or not isinstance(time_limit, (int, float))
+        or not math.isfinite(time_limit)
+    ):
+        raise ValueError(f"Invalid time limit: {time_limit!r}")
+    time_limit = min(max(float(time_limit), ENGINE_MIN_TIME), max_time)
+
+    limits = {"nodes": data.get("nodes"), "depth": data.get("depth", max_depth)}
+    for name, value in limits.items():
+        if value is None and name == "nodes":
+            continue
+        if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+            raise ValueError(f"Invalid {name} limit: {value!r}")
+    return time_limit, limits["nodes"], min(limits["depth"], max_depth)
+
+
+def cached_game_state(game_id):
+    """Get (state version, encoded JSON body) of a game's full state
+
+    The encoded body is cached per game and ?legal_moves flag for the
+    version the store reports, so polls between moves cost a version check
+    and a dictionary lookup: no game lock, state building or JSON encoding.
+    Any saved change, from this process or another, moves the version on.
+    Concurrent misses build the state once. Without a game (game_id None)
+    this is the starting position, marked "transient" since no game is
+    stored until the first move or new game.
+    """
+    store_version = games.store.get_version(game_id) if game_id else 0
+    if store_version is None:
+        raise GameNotFound(game_id)
+    legal_moves = request.args.get("legal_moves", "").lower() in ("1", "true")
+
+    def build():
+        with read_game(game_id) as game:
+            state = api_game_state(game)
+        if game_id is None:
+            state["transient"] = True
+        return state["version"], app.json.response(state).get_data()
+
+    return state_cache.get((game_id, legal_moves), store_version, build)
+
+
+@app.errorhandler(GameNotFound)
+def game_not_found(error):
+    """Unknown or evicted game IDs answer with a JSON 404"""
+    return jsonify({"success": False, "message": "Game not found"}), 404
+
+
+@app.errorhandler(JobNotFound)
+def job_not_found(error):
+    """Unknown or expired job IDs answer with a JSON 404"""
+    return jsonify({"success": False, "message": "Job not found"}), 404
+
+
+@app.errorhandler(PoolFull)
+def pool_full(error):
+    """Shed load with a 503 while the job queue is full"""
+    response = jsonify({"success": False, "message": "Engine is busy, try again"})
+    response.status_code = 503
+    response.headers["Retry-After"] = "1"
+    return response
+
+
+@app.errorhandler(HubFull)
+def hub_full(error):
+    """Refuse an event stream with a 503 while the stream threads are busy
+
+    EventSource gives up on a 503, and the page then polls instead.
+    """
+    response = jsonify({"success": False, "message": "Too many event streams"})
+    response.status_code = 503
+    response.headers["Retry-After"] = "30"
+    return response
 
 
 @app.route("/")
@@ -534,41 +414,432 @@ def index():
 
 
 @app.route("/api/game-state")
-def get_game_state():
-    """Get current game state"""
-    return jsonify(game.get_game_state())
+@app.route("/api/games/<game_id>/game-state")
+def get_game_state(game_id=None):
+    """Get current game state
+
+    Responses carry an ETag made of the game ID and state version, so
+    polling clients get a bodiless 304 while nothing has changed. Pass
+    ?since=<version> to receive only the changes after that version. Full
+    states are served pre-encoded from state_cache.
+    """
+    game_id = resolve_game_id(game_id)
+    since = request.args.get("since", type=int)
+    if since is None:
+        version, body = cached_game_state(game_id)
+        etag = f"{game_id or 'new'}.{version}"
+        if etag in request.if_none_match:
+            response = app.response_class(status=304)
+        else:
+            response = app.response_class(body, mimetype=app.json.mimetype)
+    else:
+        with read_game(game_id) as game:
+            etag = f"{game_id or 'new'}.{game.version}"
+            if etag in request.if_none_match:
+                response = app.response_class(status=304)
+            else:
+                response = jsonify(api_game_state(game, since))
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
+
+@app.route("/api/move-history")
+@app.route("/api/games/<game_id>/move-history")
+def get_move_history(game_id=None):
+    """Get a page of the move history: ?from=<index>&limit=<count>"""
+    start = max(request.args.get("from", 0, type=int), 0)
+    limit = request.args.get("limit", MOVE_HISTORY_PAGE, type=int)
+    limit = min(max(limit, 0), MOVE_HISTORY_PAGE)
+    with read_game(game_id) as game:
+        moves = game.get_move_history(start, start + limit)
+        count = len(game.history)
+        version = game.version
+    return jsonify(
+        {"from": start, "moves": moves, "move_count": count, "version": version}
+    )
 
 
 @app.route("/api/valid-moves/<int:row>/<int:col>")
-def get_valid_moves(row, col):
+@app.route("/api/games/<game_id>/valid-moves/<int:row>/<int:col>")
+def get_valid_moves(row, col, game_id=None):
     """Get legal moves for a piece at given position"""
-    moves = game.get_legal_moves(row, col)
+    with read_game(game_id) as game:
+        if not game.is_valid_position(row, col):
+            return jsonify({"moves": []})
+        move_map, _ = game.get_legal_move_map()
+    moves = [divmod(to_sq, 8) for to_sq in move_map.get(row * 8 + col, ())]
     return jsonify({"moves": moves})
 
 
 @app.route("/api/make-move", methods=["POST"])
-def make_move():
+@app.route("/api/games/<game_id>/make-move", methods=["POST"])
+def make_move(game_id=None):
     """Make a move"""
     data = request.get_json()
     from_pos = tuple(data["from"])
     to_pos = tuple(data["to"])
+    promotion = data.get("promotion", "queen")
+    try:
+        since = parse_since(data)  # client's state version, for an incremental reply
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    game_id = resolve_game_id(game_id)
+    event = None
+    with games.locked(game_id, write=True) as game:
+        before = game.version
+        success, message = game.make_move(from_pos, to_pos, promotion)
+        if success:
+            event = move_event(game, before)
+        response = jsonify(
+            {
+                "success": success,
+                "message": message,
+                "game_state": api_game_state(game, since),
+            }
+        )
+    publish_move(game_id, event)
+    return response
+
+
+@app.route("/api/undo-move", methods=["POST"])
+@app.route("/api/games/<game_id>/undo-move", methods=["POST"])
+def undo_move(game_id=None):
+    """Take back the last move"""
+    game_id = resolve_game_id(game_id)
+    event = None
+    with games.locked(game_id, write=True) as game:
+        before = game.version
+        success = game.undo_move()
+        if success:
+            event = move_event(game, before)
+        response = jsonify(
+            {
+                "success": success,
+                "message": "Move taken back" if success else "No move to take back",
+                "game_state": api_game_state(game),
+            }
+        )
+    publish_move(game_id, event)
+    return response
+
+
+@app.route("/api/position")
+@app.route("/api/games/<game_id>/position")
+def get_position(game_id=None):
+    """Get the board after the first ?ply=<count> moves (default all)"""
+    with read_game(game_id) as game:
+        count = len(game.history)
+        ply = min(max(request.args.get("ply", count, type=int), 0), count)
+        position = game.position_at(ply)
+        last_move = game.get_move_history(ply - 1, ply) if ply else []
+        version = game.version
+    return jsonify(
+        {
+            "version": version,
+            "ply": ply,
+            "move_count": count,
+            "board": position.board,
+            "fen": position.get_fen(),
+            "current_player": position.current_player,
+            "in_check": position.is_king_in_check(position.turn),
+            "last_move": last_move[0] if last_move else None,
+        }
+    )
+
+
+@app.route("/api/engine-move", methods=["POST"])
+@app.route("/api/games/<game_id>/engine-move", methods=["POST"])
+def engine_move(game_id=None):
+    """Let the engine pick a move for the side to move
+
+    The JSON body may set "time" (seconds, capped at CHESS_ENGINE_MAX_TIME),
+    "nodes" and "depth" limits (a malformed one gets a 400), and "play":
+    true to also make the move. The search runs on a copy of the game, so the game stays unlocked meanwhile.
+    A position in the opening book is answered from the book without a
+    search ("book": true in the reply) unless the body sets "book": false.
+    """
+    from engine import MAX_DEPTH, describe_move, search_position
+
+    data = request.get_json(silent=True) or {}
+    try:
+        time_limit, node_limit, max_depth = parse_search_limits(
+            data, ENGINE_DEFAULT_TIME, ENGINE_MAX_TIME, MAX_DEPTH
+        )
+        since = parse_since(data)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    book = get_opening_book() if data.get("book", True) else None
+
+    game_id = resolve_game_id(game_id)
+    with games.locked(game_id) as game:
+        if game.game_over:
+            return jsonify({"success": False, "message": "Game is over"})
+        version = game.version
+        book_move, weight = book.choose(game, book_rng) if book else (0, 0)
+        position = None if book_move else encode_position(game)
+
+    args = (position, time_limit, node_limit, max_depth, ENGINE_TABLE_SIZE)
+    if book_move:
+        result = {
+            "move": describe_move(book_move),
+            "score": None,
+            "depth": 0,
+            "pv": [move_to_uci(book_move)],
+            "nodes": 0,
+            "weight": weight,
+        }
+    elif engine_pool.max_workers:
+        job = engine_pool.submit(
+            "search", search_position, *args, timeout=time_limit + JOB_TIMEOUT_GRACE
+        )
+        job = engine_pool.wait(job.id)
+        if job.status != "done":
+            return jsonify({"success": False, "message": f"Search {job.status}"}), 503
+        result = job.future.result()
+    else:
+        result = search_position(*args)
+
+    move = result["move"]
+    response = {"success": True, "message": "Engine move found", **result}
+    response["book"] = bool(book_move)
+
+    if data.get("play"):
+        event = None
+        with games.locked(game_id, write=True) as game:
+            if game.version != version:
+                return jsonify(
+                    {"success": False, "message": "Game changed during search"}
+                )
+            success, message = game.make_move(
+                tuple(move["from"]), tuple(move["to"]), move["promotion"] or "queen"
+            )
+            if success:
+                event = move_event(game, version)
+            response["success"] = success
+            response["message"] = message
+            response["game_state"] = api_game_state(game, since)
+        publish_move(game_id, event)
+    return jsonify(response)
+
+
+@app.route("/api/book-moves")
+@app.route("/api/games/<game_id>/book-moves")
+def book_moves(game_id=None):
+    """List the opening book's moves for the current position, best first"""
+    from engine import describe_move
+
+    book = get_opening_book()
+    if book is None:
+        return jsonify({"success": False, "message": "No opening book configured"})
+
+    with read_game(game_id) as game:
+        entries = book.moves(game)
+    total = sum(weight for _, weight in entries)
+    return jsonify(
+        {
+            "success": True,
+            "moves": [
+                {**describe_move(move), "weight": weight, "share": weight / total}
+                for move, weight in entries
+            ],
+        }
+    )
+
+
+@app.route("/api/analysis", methods=["POST"])
+@app.route("/api/games/<game_id>/analysis", methods=["POST"])
+def start_analysis(game_id=None):
+    """Start a background search of the current position
+
+    Takes the same limits as /api/engine-move, with "time" capped at
+    CHESS_ANALYSIS_MAX_TIME. Answers 202 with a job to poll at
+    /api/jobs/<job_id>, or 503 while the job queue is full.
+    """
+    from engine import MAX_DEPTH, search_position
+
+    if not analysis_pool.max_workers:
+        return jsonify({"success": False, "message": "Analysis is disabled"}), 503
+
+    data = request.get_json(silent=True) or {}
+    try:
+        time_limit, node_limit, max_depth = parse_search_limits(
+            data, ANALYSIS_MAX_TIME, ANALYSIS_MAX_TIME, MAX_DEPTH
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    with games.locked(resolve_game_id(game_id)) as game:
+        position = encode_position(game)
+
+    job = analysis_pool.submit(
+        "search",
+        search_position,
+        position,
+        time_limit,
+        node_limit,
+        max_depth,
+        ENGINE_TABLE_SIZE,
+        timeout=time_limit + JOB_TIMEOUT_GRACE,
+    )
+    return jsonify(job.to_dict()), 202
+
+
+@app.route("/api/jobs/<job_id>")
+def get_job(job_id):
+    """Poll a job; ?wait=<seconds> holds the request until it finishes"""
+    wait = min(request.args.get("wait", 0, type=float), JOB_MAX_WAIT)
+    job = analysis_pool.wait(job_id, wait) if wait > 0 else analysis_pool.get(job_id)
+    return jsonify(job.to_dict())
+
+
+@app.route("/api/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    """Cancel a queued or running job"""
+    return jsonify(analysis_pool.cancel(job_id).to_dict())
+
+
+@app.route("/api/events")
+@app.route("/api/games/<game_id>/events")
+def game_events(game_id=None):
+    """Stream a game's moves as Server-Sent Events
+
+    The first event is the current state; each move then arrives as an
+    incremental state with the game version as event ID, so a reconnecting
+    browser resumes from its Last-Event-ID. A resync event asks the client
+    to refetch /api/game-state?since=<version>.
+
+    Served through asgi.py, the stream runs on the server's event loop
+    instead of holding a thread while the connection is idle. Otherwise at
+    most CHESS_MAX_EVENT_STREAMS streams are open per process, and further
+    ones get a 503. A HEAD request gets the headers without subscribing.
+    """
+    game_id = resolve_game_id(game_id)
+    if game_id is None:
+        # Nothing to follow before the first move; 204 stops EventSource
+        # from reconnecting
+        return app.response_class(status=204)
+    if request.method == "HEAD":
+        # Nothing reads a HEAD body, so don't take a stream slot for it
+        with games.locked(game_id):
+            pass  # 404 for an unknown game, as for GET
+        return app.response_class(**EVENT_STREAM_RESPONSE)
+    since = request.headers.get("Last-Event-ID", type=int)
+    loop = request.environ.get(ASGI_LOOP_KEY)
+    with games.locked(game_id) as game:
+        _, in_check = game.get_legal_move_map()
+        first = format_event(
+            "state", game.get_game_state(in_check, since), game.version
+        )
+        subscription = event_hub.subscribe(game_id, game.version, loop)
+
+    def check_version(subscription):
+        # Moves played through another worker process never reach this hub
+        try:
+            with games.locked(game_id) as game:
+                version = game.version
+        except GameNotFound:
+            return RESYNC_EVENT
+        if version != subscription.last_id:
+            subscription.last_id = version
+            return RESYNC_EVENT
+        return None
+
+    # The subscription is released when the response closes, even if the
+    # body is never iterated; stream and astream also release it when done
+    def release():
+        event_hub.unsubscribe(subscription)
+
+    if loop is None:
+        body = event_hub.stream(subscription, first, EVENT_HEARTBEAT, check_version)
+    else:
+        body = AsyncBody(
+            event_hub.astream(subscription, first, EVENT_HEARTBEAT, check_version),
+            release,
+        )
+    response = app.response_class(body, **EVENT_STREAM_RESPONSE)
+    response.call_on_close(release)
+    response.direct_passthrough = loop is not None  # hand the async body over
+    return response
+
+
+@app.route("/api/cache-stats")
+def cache_stats():
+    """Get counters for the caches, game registry, event hub and job pools"""
+    return jsonify(
+        {
+            "legal_moves": legal_move_cache.stats(),
+            "game_states": state_cache.stats(),
+            "registry": games.stats(),
+            "journal": games.store.stats() if hasattr(games.store, "stats") else None,
+            "events": event_hub.stats(),
+            "engine_jobs": engine_pool.stats(),
+            "analysis_jobs": analysis_pool.stats(),
+        }
+    )
+
 
-    success, message = game.make_move(from_pos, to_pos)
+@app.route("/metrics")
+def metrics():
+    """Export request, move-generator, cache and game metrics for Prometheus"""
+    return app.response_class(
+        app_metrics.render(), mimetype="text/plain; version=0.0.4"
+    )
+
+
+@app.route("/api/profiles")
+def list_profiles():
+    """List the slowest profiled requests, slowest first"""
+    if not profiles_allowed():
+        return jsonify({"success": False, "message": "Profiling is disabled"}), 404
     return jsonify(
-        {"success": success, "message": message, "game_state": game.get_game_state()}
+        {
+            "recorded": profiles.recorded,
+            "keep": profiles.keep,
+            "profiles": [profile.to_dict() for profile in profiles.slowest()],
+        }
+    )
+
+
+@app.route("/api/profiles", methods=["DELETE"])
+def clear_profiles():
+    """Drop the kept profiles"""
+    if not profiles_allowed():
+        return jsonify({"success": False, "message": "Profiling is disabled"}), 404
+    profiles.clear()
+    return jsonify({"success": True})
+
+
+@app.route("/api/profiles/<profile_id>")
+def get_profile(profile_id):
+    """Download a profile for pstats or snakeviz; ?format=text for a report"""
+    profile = profiles.get(profile_id) if profiles_allowed() else None
+    if profile is None:
+        return jsonify({"success": False, "message": "Profile not found"}), 404
+    if request.args.get("format") == "text":
+        sort = request.args.get("sort", "cumulative")
+        if sort not in ("cumulative", "tottime", "calls", "ncalls", "time"):
+            sort = "cumulative"
+        return app.response_class(profile.report(sort), mimetype="text/plain")
+    response = app.response_class(profile.stats, mimetype="application/octet-stream")
+    response.headers["Content-Disposition"] = (
+        f"attachment; filename=request-{profile.id}.prof"
     )
+    return response
 
 
 @app.route("/api/new-game", methods=["POST"])
 def new_game():
-    """Start a new game"""
-    global game
-    game = ChessGame()
+    """Start a new game and make it the session's current game"""
+    game = create_game()
+    game_id = games.create(game)
+    session["game_id"] = game_id
     return jsonify(
         {
             "success": True,
             "message": "New game started",
-            "game_state": game.get_game_state(),
+            "game_id": game_id,
+            "game_state": api_game_state(game),
         }
     )
 
@@ -0,0 +1,1166 @@
+"""
+Chess Game
+Board representation, move generation and game state, kept free of the web
+app so worker processes and command-line tools can import it on its own
+"""
+
+import json
+import os
+import random
+import sys
+from array import array
+from base64 import b64decode, b64encode
+from datetime import datetime
+
+from cache import LRUCache
+from metrics import Counter
+
+# Board encoding
+# Squares are stored in a flat bytearray indexed by row * 8 + col (row 0 is
+# black's back rank).  Each square holds a one-byte piece code: the low three
+# bits are the piece type and bit 3 is the color, so 0 is an empty square.
+EMPTY = 0
+PAWN = 1
+KNIGHT = 2
+BISHOP = 3
+ROOK = 4
+QUEEN = 5
+KING = 6
+TYPE_MASK = 7
+COLOR_SHIFT = 3
+
+WHITE = 0
+BLACK = 1
+
+COLOR_NAMES = ("white", "black")
+COLOR_INDEX = {"white": WHITE, "black": BLACK}
+PIECE_NAMES = ("", "pawn", "knight", "bishop", "rook", "queen", "king")
+
+# Conversion between piece codes and the "white_pawn" strings used by the API
+PIECE_STRINGS = [""] * 16
+PIECE_CODES = {"": EMPTY}
+for _color, _color_name in enumerate(COLOR_NAMES):
+    for _type in range(PAWN, KING + 1):
+        _code = (_color << COLOR_SHIFT) | _type
+        PIECE_STRINGS[_code] = f"{_color_name}_{PIECE_NAMES[_type]}"
+        PIECE_CODES[PIECE_STRINGS[_code]] = _code
+
+BACK_RANK = (ROOK, KNIGHT, BISHOP, QUEEN, KING, BISHOP, KNIGHT, ROOK)
+
+KNIGHT_OFFSETS = (
+    (-2, -1),
+    (-2, 1),
+    (-1, -2),
+    (-1, 2),
+    (1, -2),
+    (1, 2),
+    (2, -1),
+    (2, 1),
+)
+KING_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+ROOK_DIRECTIONS = ((0, 1), (0, -1), (1, 0), (-1, 0))
+BISHOP_DIRECTIONS = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+
+# Per-square move tables, built once at import so move generation only
+# walks them, with no offset arithmetic or bounds checks. They hold square
+# numbers; POSITIONS gives the shared (row, col) tuple of each square. All
+# of them take about 2 ms to build and 70 KB of immutable tuples, which
+# workers forked from a preloaded app (gunicorn --preload) share.
+POSITIONS = tuple(divmod(sq, 8) for sq in range(64))
+
+
+def _step_targets(offsets):
+    """Build a per-square tuple of the squares one offset away"""
+    return tuple(
+        tuple(
+            (row + dr) * 8 + col + dc
+            for dr, dc in offsets
+            if 0 <= row + dr < 8 and 0 <= col + dc < 8
+        )
+        for row, col in POSITIONS
+    )
+
+
+def _ray_targets(directions):
+    """Build a per-square tuple of rays, each listing the squares along one
+    direction nearest first (empty rays are left out)"""
+    table = []
+    for row, col in POSITIONS:
+        rays = []
+        for dr, dc in directions:
+            ray = []
+            new_row, new_col = row + dr, col + dc
+            while 0 <= new_row < 8 and 0 <= new_col < 8:
+                ray.append(new_row * 8 + new_col)
+                new_row += dr
+                new_col += dc
+            if ray:
+                rays.append(tuple(ray))
+        table.append(tuple(rays))
+    return tuple(table)
+
+
+KNIGHT_TARGETS = _step_targets(KNIGHT_OFFSETS)
+KING_TARGETS = _step_targets(KING_OFFSETS)
+ROOK_RAYS = _ray_targets(ROOK_DIRECTIONS)
+BISHOP_RAYS = _ray_targets(BISHOP_DIRECTIONS)
+QUEEN_RAYS = tuple(rook + bishop for rook, bishop in zip(ROOK_RAYS, BISHOP_RAYS))
+# Squares attacked by a pawn of each color standing on a square
+PAWN_ATTACK_TARGETS = (
+    _step_targets(((-1, -1), (-1, 1))),
+    _step_targets(((1, -1), (1, 1))),
+)
+
+# Castling rights are kept as a 4-bit mask
+WHITE_KINGSIDE = 1
+WHITE_QUEENSIDE = 2
+BLACK_KINGSIDE = 4
+BLACK_QUEENSIDE = 8
+ALL_CASTLING = 15
+CASTLING_RIGHTS = (
+    {"kingside": WHITE_KINGSIDE, "queenside": WHITE_QUEENSIDE},
+    {"kingside": BLACK_KINGSIDE, "queenside": BLACK_QUEENSIDE},
+)
+
+# Rights that survive a move touching each square: moving the king or a rook
+# off its home square, or capturing a rook there, clears the matching rights
+CASTLING_MASK = [ALL_CASTLING] * 64
+CASTLING_MASK[0] = ALL_CASTLING & ~BLACK_QUEENSIDE
+CASTLING_MASK[4] = ALL_CASTLING & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLING_MASK[7] = ALL_CASTLING & ~BLACK_KINGSIDE
+CASTLING_MASK[56] = ALL_CASTLING & ~WHITE_QUEENSIDE
+CASTLING_MASK[60] = ALL_CASTLING & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLING_MASK[63] = ALL_CASTLING & ~WHITE_KINGSIDE
+
+# Moves handed to push() are packed into an int: bits 0-5 hold the source
+# square, bits 6-11 the destination square and bits 12-14 the piece type a
+# pawn promotes to (0 for other moves)
+MOVE_SQUARE_MASK = 63
+MOVE_TO_SHIFT = 6
+MOVE_PROMOTION_SHIFT = 12
+PROMOTION_TYPES = (QUEEN, ROOK, BISHOP, KNIGHT)
+
+# Move history entries are packed into a 32-bit int: the packed move in bits
+# 0-14, the moving piece's code in bits 15-18, the captured piece's code in
+# bits 19-22 and the flags below
+HISTORY_PIECE_SHIFT = 15
+HISTORY_MOVE_MASK = (1 << HISTORY_PIECE_SHIFT) - 1
+HISTORY_CAPTURED_SHIFT = 19
+HISTORY_EN_PASSANT = 1 << 23
+HISTORY_CASTLING = 1 << 24
+HISTORY_CODE_MASK = 15
+MAX_TIME_OFFSET = (1 << 31) - 1  # move times are int32 millisecond offsets
+
+NO_SQUARE = -1
+
+MOVE_HISTORY_TAIL = 40  # moves included in full game states
+MOVE_HISTORY_PAGE = 500  # most moves served per /api/move-history request
+# Plies between the position snapshots used to jump to any move (position_at)
+CHECKPOINT_INTERVAL = max(int(os.environ.get("CHESS_CHECKPOINT_INTERVAL", 16)), 1)
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+FEN_PIECES = {}
+for _code, _name in enumerate(PIECE_STRINGS):
+    if _name:
+        _letter = "pnbrqk"[(_code & TYPE_MASK) - 1]
+        if _code >> COLOR_SHIFT == WHITE:
+            _letter = _letter.upper()
+        FEN_PIECES[_letter] = _code
+FEN_LETTERS = {code: letter for letter, code in FEN_PIECES.items()}
+FEN_CASTLING = "KQkq"  # in the bit order of the castling rights mask
+
+
+# Zobrist keys for incremental position hashing. The generator is seeded so
+# every worker process computes the same hash for the same position.
+_zobrist_random = random.Random(20240601)
+ZOBRIST_PIECES = [
+    [_zobrist_random.getrandbits(64) for _ in range(64)] for _ in range(16)
+]
+ZOBRIST_CASTLING = [_zobrist_random.getrandbits(64) for _ in range(16)]
+ZOBRIST_EP_FILE = [_zobrist_random.getrandbits(64) for _ in range(8)]
+ZOBRIST_BLACK_TO_MOVE = _zobrist_random.getrandbits(64)
+
+
+def encode_move(from_sq, to_sq, promotion=EMPTY):
+    """Pack a source and destination square into a move int"""
+    return from_sq | (to_sq << MOVE_TO_SHIFT) | (promotion << MOVE_PROMOTION_SHIFT)
+
+
+def square_name(sq):
+    """Get the algebraic name of a square, e.g. 60 -> 'e1'"""
+    return "abcdefgh"[sq & 7] + str(8 - (sq >> 3))
+
+
+def parse_square(name):
+    """Get the square number of an algebraic square name"""
+    return (8 - int(name[1])) * 8 + "abcdefgh".index(name[0])
+
+
+def move_to_uci(move):
+    """Format a packed move in UCI notation, e.g. 'e2e4' or 'e7e8q'"""
+    uci = square_name(move & MOVE_SQUARE_MASK) + square_name(
+        (move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK
+    )
+    promotion = move >> MOVE_PROMOTION_SHIFT
+    if promotion:
+        uci += "pnbrqk"[promotion - 1]
+    return uci
+
+
+class ChessGame:
+    """Chess game logic and state management"""
+
+    backend = "mailbox"
+
+    __slots__ = (
+        "squares",
+        "king_squares",
+        "turn",
+        "castling",
+        "ep_square",
+        "halfmove_clock",
+        "ply",
+        "hash",
+        "start_fen",
+        "version",
+        "base_version",
+        "undo_stack",
+        "game_over",
+        "game_result",
+        "history",
+        "history_times",
+        "history_start",
+        "checkpoints",
+        "captured_pieces",
+    )
+
+    def __init__(self):
+        self.turn = WHITE
+        self.castling = ALL_CASTLING
+        self.ep_square = NO_SQUARE  # square a pawn just skipped over
+        self.halfmove_clock = 0
+        self.ply = 0
+        self.set_squares(self.initialize_board())
+        self.hash = self.compute_hash()  # Zobrist hash, updated by push/pop
+        self.start_fen = START_FEN  # position the move history starts from
+        self.version = 0  # bumped on every change to the game
+        self.base_version = 0  # version at which the history last restarted
+        # (move, captured piece, castling rights, ep square, halfmove clock,
+        # hash) per push
+        self.undo_stack = []
+        self.game_over = False
+        self.game_result = None  # 'checkmate', 'stalemate', or None
+        self.reset_history()
+
+    def reset_history(self):
+        """Start an empty move history"""
+        self.history = array("I")  # packed entries, see HISTORY_PIECE_SHIFT
+        self.history_times = array("i")  # milliseconds since history_start
+        self.history_start = None  # epoch milliseconds of the first move
+        # Snapshot of the position every CHECKPOINT_INTERVAL moves
+        self.checkpoints = [self.snapshot()]
+        self.captured_pieces = {"white": [], "black": []}
+
+    def snapshot(self):
+        """Capture the position (but not the history) as an immutable tuple"""
+        return (
+            bytes(self.squares),
+            self.turn,
+            self.castling,
+            self.ep_square,
+            self.halfmove_clock,
+            self.ply,
+            self.hash,
+        )
+
+    def restore(self, snapshot):
+        """Set up the position captured by snapshot, without any history"""
+        squares, self.turn, self.castling, self.ep_square = snapshot[:4]
+        self.halfmove_clock, self.ply, self.hash = snapshot[4:]
+        self.set_squares(bytearray(squares))
+        self.undo_stack = []
+
+    def initialize_board(self):
+        """Initialize the chess board with pieces in starting positions"""
+        squares = bytearray(64)
+
+        black = BLACK << COLOR_SHIFT
+        for col, piece_type in enumerate(BACK_RANK):
+            squares[col] = black | piece_type
+            squares[8 + col] = black | PAWN
+            squares[48 + col] = PAWN
+            squares[56 + col] = piece_type
+
+        return squares
+
+    @property
+    def board(self):
+        """8x8 list-of-strings view of the board, as served by the API"""
+        strings = PIECE_STRINGS
+        squares = self.squares
+        return [[strings[code] for code in squares[i : i + 8]] for i in range(0, 64, 8)]
+
+    @board.setter
+    def board(self, rows):
+        self.set_squares(bytearray(PIECE_CODES[piece] for row in rows for piece in row))
+        self.hash = self.compute_hash()
+
+    def set_squares(self, squares):
+        """Replace the board with a 64-byte array of piece codes"""
+        self.squares = squares
+        # Indexed by color and kept up to date by push/pop
+        self.king_squares = [
+            squares.find((color << COLOR_SHIFT) | KING) for color in (WHITE, BLACK)
+        ]
+
+    def compute_hash(self):
+        """Compute the Zobrist hash of the position from scratch"""
+        h = ZOBRIST_CASTLING[self.castling]
+        for sq, piece in enumerate(self.squares):
+            if piece:
+                h ^= ZOBRIST_PIECES[piece][sq]
+        if self.ep_square >= 0 and self.ep_capturable():
+            h ^= ZOBRIST_EP_FILE[self.ep_square & 7]
+        if self.turn == BLACK:
+            h ^= ZOBRIST_BLACK_TO_MOVE
+        return h
+
+    def ep_capturable(self):
+        """Whether the side to move has a pawn attacking the en-passant square
+
+        Only then is the square's file part of the hash, so a double push
+        nobody can take reaches the same hash as any other route there.
+        """
+        pawn = (self.turn << COLOR_SHIFT) | PAWN
+        squares = self.squares
+        for sq in PAWN_ATTACK_TARGETS[self.turn ^ 1][self.ep_square]:
+            if squares[sq] == pawn:
+                return True
+        return False
+
+    def set_fen(self, fen):
+        """Set up the position described by a FEN string
+
+        The move history is cleared, since it no longer leads to the board.
+        """
+        fields = fen.split()
+        placement, turn = fields[0], fields[1]
+        castling = fields[2] if len(fields) > 2 else "-"
+        ep_square = fields[3] if len(fields) > 3 else "-"
+
+        squares = bytearray(64)
+        sq = 0
+        for char in placement:
+            if char == "/":
+                continue
+            if char.isdigit():
+                sq += int(char)
+            else:
+                squares[sq] = FEN_PIECES[char]
+                sq += 1
+        if sq != 64:
+            raise ValueError(f"Invalid FEN placement: {placement}")
+
+        self.turn = WHITE if turn == "w" else BLACK
+        self.castling = 0
+        for bit, letter in enumerate(FEN_CASTLING):
+            if letter in castling:
+                self.castling |= 1 << bit
+        self.ep_square = NO_SQUARE if ep_square == "-" else parse_square(ep_square)
+        self.halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+        fullmove = int(fields[5]) if len(fields) > 5 else 1
+        self.ply = (fullmove - 1) * 2 + self.turn
+        self.set_squares(squares)
+        self.hash = self.compute_hash()
+        self.start_fen = fen
+        self.version += 1
+        self.base_version = self.version
+        self.undo_stack = []
+        self.game_over = False
+        self.game_result = None
+        self.reset_history()
+        self.is_checkmate_or_stalemate()
+
+    def get_fen(self):
+        """Describe the current position as a FEN string"""
+        rows = []
+        for start in range(0, 64, 8):
+            row = ""
+            empty = 0
+            for code in self.squares[start : start + 8]:
+                if code:
+                    if empty:
+                        row += str(empty)
+                        empty = 0
+                    row += FEN_LETTERS[code]
+                else:
+                    empty += 1
+            if empty:
+                row += str(empty)
+            rows.append(row)
+
+        castling = "".join(
+            letter
+            for bit, letter in enumerate(FEN_CASTLING)
+            if self.castling & (1 << bit)
+        )
+        ep_square = "-" if self.ep_square < 0 else square_name(self.ep_square)
+        return " ".join(
+            [
+                "/".join(rows),
+                "w" if self.turn == WHITE else "b",
+                castling or "-",
+                ep_square,
+                str(self.halfmove_clock),
+                str(self.ply // 2 + 1),
+            ]
+        )
+
+    @property
+    def current_player(self):
+        """Name of the side to move ('white' or 'black')"""
+        return COLOR_NAMES[self.turn]
+
+    @current_player.setter
+    def current_player(self, color):
+        self.turn = COLOR_INDEX[color]
+
+    def get_piece_color(self, piece):
+        """Get the color of a piece"""
+        if not piece:
+            return None
+        return COLOR_NAMES[PIECE_CODES[piece] >> COLOR_SHIFT]
+
+    def get_piece_type(self, piece):
+        """Get the type of a piece"""
+        if not piece:
+            return None
+        return PIECE_NAMES[PIECE_CODES[piece] & TYPE_MASK]
+
+    def is_valid_position(self, row, col):
+        """Check if position is within board bounds"""
+        return 0 <= row < 8 and 0 <= col < 8
+
+    def get_valid_moves(self, row, col):
+        """Get all valid moves for a piece at the given position"""
+        if not self.is_valid_position(row, col):
+            return []
+
+        piece = self.squares[row * 8 + col]
+        if not piece or piece >> COLOR_SHIFT != self.turn:
+            return []
+
+        return self.get_piece_moves(row, col, piece)
+
+    def get_piece_moves(self, row, col, piece):
+        """Get the moves for a piece code standing at the given position"""
+        color = piece >> COLOR_SHIFT
+        piece_type = piece & TYPE_MASK
+
+        if piece_type == PAWN:
+            return self.get_pawn_moves(row, col, color)
+        elif piece_type == ROOK:
+            return self.get_rook_moves(row, col, color)
+        elif piece_type == KNIGHT:
+            return self.get_knight_moves(row, col, color)
+        elif piece_type == BISHOP:
+            return self.get_bishop_moves(row, col, color)
+        elif piece_type == QUEEN:
+            return self.get_queen_moves(row, col, color)
+        elif piece_type == KING:
+            return self.get_king_moves(row, col, color)
+        return []
+
+    def get_pawn_moves(self, row, col, color):
+        """Get valid moves for a pawn"""
+        squares = self.squares
+        moves = []
+        direction = -1 if color == WHITE else 1
+        start_row = 6 if color == WHITE else 1
+
+        # Forward move
+        new_row = row + direction
+        if 0 <= new_row < 8 and not squares[new_row * 8 + col]:
+            moves.append(POSITIONS[new_row * 8 + col])
+
+            # Double move from starting position
+            if row == start_row and not squares[(row + 2 * direction) * 8 + col]:
+                moves.append(POSITIONS[(row + 2 * direction) * 8 + col])
+
+        # Diagonal captures, including en passant
+        for target_sq in PAWN_ATTACK_TARGETS[color][row * 8 + col]:
+            target = squares[target_sq]
+            if target and target >> COLOR_SHIFT != color:
+                moves.append(POSITIONS[target_sq])
+            elif target_sq == self.ep_square:
+                moves.append(POSITIONS[target_sq])
+
+        return moves
+
+    def get_sliding_moves(self, rays, color):
+        """Get moves for a piece sliding along the given rays"""
+        squares = self.squares
+        moves = []
+
+        for ray in rays:
+            for target_sq in ray:
+                target = squares[target_sq]
+                if target:
+                    if target >> COLOR_SHIFT != color:
+                        moves.append(POSITIONS[target_sq])
+                    break
+                moves.append(POSITIONS[target_sq])
+
+        return moves
+
+    def get_stepping_moves(self, targets, color):
+        """Get moves for a piece that jumps to the given target squares"""
+        squares = self.squares
+        return [
+            POSITIONS[target_sq]
+            for target_sq in targets
+            if not squares[target_sq] or squares[target_sq] >> COLOR_SHIFT != color
+        ]
+
+    def get_rook_moves(self, row, col, color):
+        """Get valid moves for a rook"""
+        return self.get_sliding_moves(ROOK_RAYS[row * 8 + col], color)
+
+    def get_knight_moves(self, row, col, color):
+        """Get valid moves for a knight"""
+        return self.get_stepping_moves(KNIGHT_TARGETS[row * 8 + col], color)
+
+    def get_bishop_moves(self, row, col, color):
+        """Get valid moves for a bishop"""
+        return self.get_sliding_moves(BISHOP_RAYS[row * 8 + col], color)
+
+    def get_queen_moves(self, row, col, color):
+        """Get valid moves for a queen (combination of rook and bishop)"""
+        return self.get_sliding_moves(QUEEN_RAYS[row * 8 + col], color)
+
+    def get_king_moves(self, row, col, color):
+        """Get valid moves for a king"""
+        moves = self.get_stepping_moves(KING_TARGETS[row * 8 + col], color)
+
+        # Add castling moves if available
+        castling_moves = self.get_castling_moves(row, col, color)
+        moves.extend(castling_moves)
+
+        return moves
+
+    def can_castle(self, color, side):
+        """Check if castling is possible for given color and side"""
+        # Check if king or rook have moved
+        if not self.castling & CASTLING_RIGHTS[color][side]:
+            return False
+
+        # Determine positions
+        squares = self.squares
+        base = 56 if color == WHITE else 0
+        king = (color << COLOR_SHIFT) | KING
+        if side == "kingside":
+            rook_col = 7
+            between_cols = [5, 6]
+        else:  # queenside
+            rook_col = 0
+            between_cols = [1, 2, 3]
+
+        # Check if pieces are in correct positions
+        if (
+            squares[base + 4] != king
+            or squares[base + rook_col] != (color << COLOR_SHIFT) | ROOK
+        ):
+            return False
+
+        # Check if squares between king and rook are empty
+        for col in between_cols:
+            if squares[base + col]:
+                return False
+
+        # Check if king is in check or would pass through or land in check.
+        # The king itself can only shield these squares along the back rank,
+        # and any piece attacking through it would already be giving check.
+        opponent_color = color ^ 1
+        king_path = [4, 5, 6] if side == "kingside" else [4, 3, 2]
+        for col in king_path:
+            if self.is_square_attacked(base + col, opponent_color):
+                return False
+
+        return True
+
+    def get_castling_moves(self, row, col, color):
+        """Get available castling moves for the king"""
+        moves = []
+
+        # Only kings on their starting square can castle
+        expected_row = 7 if color == WHITE else 0
+        if row != expected_row or col != 4:
+            return moves
+
+        # Check kingside castling
+        if self.can_castle(color, "kingside"):
+            moves.append((expected_row, 6))
+
+        # Check queenside castling
+        if self.can_castle(color, "queenside"):
+            moves.append((expected_row, 2))
+
+        return moves
+
+    def make_move(self, from_pos, to_pos, promotion="queen"):
+        """Make a move on the board
+
+        A pawn reaching the last rank becomes the piece named by promotion.
+        """
+        from_row, from_col = from_pos
+        to_row, to_col = to_pos
+
+        if not self.is_valid_position(from_row, from_col) or not self.is_valid_position(
+            to_row, to_col
+        ):
+            return False, "Invalid position"
+
+        squares = self.squares
+        from_sq = from_row * 8 + from_col
+        to_sq = to_row * 8 + to_col
+
+        piece = squares[from_sq]
+        if not piece:
+            return False, "No piece at source position"
+
+        if piece >> COLOR_SHIFT != self.turn:
+            return False, "Not your piece"
+
+        # The position's move map is usually cached from showing it
+        if to_sq not in self.get_legal_move_map()[0].get(from_sq, ()):
+            return False, "Invalid move"
+
+        promotion_type = EMPTY
+        if piece & TYPE_MASK == PAWN and to_row in (0, 7):
+            if promotion not in ("queen", "rook", "bishop", "knight"):
+                return False, "Invalid promotion"
+            promotion_type = PIECE_NAMES.index(promotion)
+
+        self.record_move(encode_move(from_sq, to_sq, promotion_type))
+
+        # Check for checkmate or stalemate
+        result = self.is_checkmate_or_stalemate()
+        if result:
+            if result == "checkmate":
+                return True, f"Checkmate! {self.current_player} wins!"
+            else:
+                return True, "Stalemate! Game is a draw!"
+
+        return True, "Move successful"
+
+    def record_move(self, move, timestamp=None):
+        """Play a validated packed move and add it to the game record
+
+        timestamp is the move time in epoch milliseconds (default now).
+        """
+        from_sq = move & MOVE_SQUARE_MASK
+        to_sq = (move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK
+        piece = self.squares[from_sq]
+
+        # Capture piece if present
+        captured = self.squares[to_sq]
+        entry = move | (piece << HISTORY_PIECE_SHIFT)
+        if piece & TYPE_MASK == PAWN and to_sq == self.ep_square:
+            captured = piece ^ (1 << COLOR_SHIFT)
+            entry |= HISTORY_EN_PASSANT
+        elif piece & TYPE_MASK == KING and abs(to_sq - from_sq) == 2:
+            entry |= HISTORY_CASTLING
+        if captured:
+            self.captured_pieces[self.current_player].append(PIECE_STRINGS[captured])
+
+        # Make the move (this also switches players)
+        self.push(move)
+        self.version += 1
+
+        # Record move
+        if timestamp is None:
+            timestamp = round(datetime.now().timestamp() * 1000)
+        if self.history_start is None:
+            self.history_start = timestamp
+        self.history.append(entry | (captured << HISTORY_CAPTURED_SHIFT))
+        self.history_times.append(
+            min(max(timestamp - self.history_start, 0), MAX_TIME_OFFSET)
+        )
+        if len(self.history) % CHECKPOINT_INTERVAL == 0:
+            self.checkpoints.append(self.snapshot())
+
+    def undo_move(self):
+        """Take back the last move of the game record
+
+        Returns False if there is no move to take back. Incremental states
+        cannot span a takeback, so it restarts the version history.
+        """
+        if not self.history or not self.undo_stack:
+            return False
+        entry = self.history.pop()
+        self.history_times.pop()
+        if len(self.history) < (len(self.checkpoints) - 1) * CHECKPOINT_INTERVAL:
+            self.checkpoints.pop()
+        self.pop()
+        if (entry >> HISTORY_CAPTURED_SHIFT) & HISTORY_CODE_MASK:
+            self.captured_pieces[self.current_player].pop()
+        if not self.history:
+            self.history_start = None
+        self.version += 1
+        self.base_version = self.version
+        self.game_over = False
+        self.game_result = None
+        return True
+
+    def position_at(self, index):
+        """Get a new game set up at the position after the first index moves
+
+        The nearest earlier checkpoint is restored and at most
+        CHECKPOINT_INTERVAL - 1 moves are replayed with push, so any move
+        of a long game is reached in constant time.
+        """
+        index = min(max(index, 0), len(self.history))
+        checkpoint = index // CHECKPOINT_INTERVAL
+        game = create_game(self.backend)
+        game.restore(self.checkpoints[checkpoint])
+        for entry in self.history[checkpoint * CHECKPOINT_INTERVAL : index]:
+            game.push(entry & HISTORY_MOVE_MASK)
+        return game
+
+    def get_move_history(self, start=0, stop=None):
+        """Get move records for history[start:stop], built on demand
+
+        Each record holds the from and to (row, col), the piece and captured
+        piece strings, the player, the move in UCI notation and an ISO
+        timestamp.
+        """
+        records = []
+        begin = self.history_start or 0
+        times = self.history_times
+        for index in range(*slice(start, stop).indices(len(self.history))):
+            entry = self.history[index]
+            move = entry & HISTORY_MOVE_MASK
+            piece = (entry >> HISTORY_PIECE_SHIFT) & HISTORY_CODE_MASK
+            captured = (entry >> HISTORY_CAPTURED_SHIFT) & HISTORY_CODE_MASK
+            stamp = datetime.fromtimestamp((begin + times[index]) / 1000)
+            records.append(
+                {
+                    "from": divmod(move & MOVE_SQUARE_MASK, 8),
+                    "to": divmod((move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK, 8),
+                    "piece": PIECE_STRINGS[piece],
+                    "captured": PIECE_STRINGS[captured],
+                    "player": COLOR_NAMES[piece >> COLOR_SHIFT],
+                    "uci": move_to_uci(move),
+                    "timestamp": stamp.isoformat(),
+                }
+            )
+        return records
+
+    @property
+    def move_history(self):
+        """The whole move history as a list of move records"""
+        return self.get_move_history()
+
+    def to_record(self):
+        """Serialize the game compactly for a game store
+
+        The record is a small JSON object holding the starting FEN, the
+        packed moves as base64 16-bit integers and the move times as
+        millisecond offsets. load_game rebuilds the game from it.
+        """
+        moves = array("H", (entry[0] for entry in self.undo_stack))
+        offsets = array("i", self.history_times)
+        if sys.byteorder == "big":
+            moves.byteswap()
+            offsets.byteswap()
+
+        return json.dumps(
+            {
+                "backend": self.backend,
+                "fen": self.start_fen,
+                "moves": b64encode(moves.tobytes()).decode("ascii"),
+                "t0": self.history_start or 0,
+                "times": b64encode(offsets.tobytes()).decode("ascii"),
+                "v": self.version,
+                "bv": self.base_version,
+            },
+            separators=(",", ":"),
+        )
+
+    def push(self, move):
+        """Play a packed move without validation, recording how to undo it"""
+        squares = self.squares
+        from_sq = move & MOVE_SQUARE_MASK
+        to_sq = (move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK
+        piece = squares[from_sq]
+        captured = squares[to_sq]
+        ep_square = self.ep_square
+        castling = self.castling
+        zobrist = ZOBRIST_PIECES
+
+        self.undo_stack.append(
+            (move, captured, castling, ep_square, self.halfmove_clock, self.hash)
+        )
+
+        h = self.hash ^ ZOBRIST_BLACK_TO_MOVE ^ ZOBRIST_CASTLING[castling]
+        h ^= zobrist[piece][from_sq] ^ zobrist[piece][to_sq]
+        if captured:
+            h ^= zobrist[captured][to_sq]
+        if ep_square >= 0 and self.ep_capturable():
+            h ^= ZOBRIST_EP_FILE[ep_square & 7]
+
+        squares[to_sq] = piece
+        squares[from_sq] = EMPTY
+        self.ep_square = NO_SQUARE
+        self.halfmove_clock = 0 if captured else self.halfmove_clock + 1
+
+        piece_type = piece & TYPE_MASK
+        if piece_type == PAWN:
+            self.halfmove_clock = 0
+            promotion = move >> MOVE_PROMOTION_SHIFT
+            if promotion:
+                promoted = (piece & ~TYPE_MASK) | promotion
+                squares[to_sq] = promoted
+                h ^= zobrist[piece][to_sq] ^ zobrist[promoted][to_sq]
+            elif to_sq == ep_square:
+                # En passant: the captured pawn stands beside the source square
+                captured_sq = (from_sq & ~7) | (to_sq & 7)
+                squares[captured_sq] = EMPTY
+                h ^= zobrist[piece ^ (1 << COLOR_SHIFT)][captured_sq]
+            elif to_sq - from_sq in (16, -16):
+                self.ep_square = (from_sq + to_sq) >> 1
+        elif piece_type == KING:
+            self.king_squares[piece >> COLOR_SHIFT] = to_sq
+            # Castling also moves the rook
+            rook_from = NO_SQUARE
+            if to_sq - from_sq == 2:
+                rook_from, rook_to = from_sq + 3, from_sq + 1
+            elif from_sq - to_sq == 2:
+                rook_from, rook_to = from_sq - 4, from_sq - 1
+            if rook_from >= 0:
+                rook = squares[rook_from]
+                squares[rook_to] = rook
+                squares[rook_from] = EMPTY
+                h ^= zobrist[rook][rook_from] ^ zobrist[rook][rook_to]
+
+        castling &= CASTLING_MASK[from_sq] & CASTLING_MASK[to_sq]
+        self.castling = castling
+        self.turn ^= 1
+        self.ply += 1
+        if self.ep_square >= 0 and self.ep_capturable():
+            h ^= ZOBRIST_EP_FILE[to_sq & 7]
+        self.hash = h ^ ZOBRIST_CASTLING[castling]
+
+    def pop(self):
+        """Take back the last move played with push"""
+        move, captured, castling, ep_square, halfmove_clock, h = self.undo_stack.pop()
+        squares = self.squares
+        from_sq = move & MOVE_SQUARE_MASK
+        to_sq = (move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK
+        piece = squares[to_sq]
+        if move >> MOVE_PROMOTION_SHIFT:
+            piece = (piece & ~TYPE_MASK) | PAWN
+
+        squares[from_sq] = piece
+        squares[to_sq] = captured
+
+        piece_type = piece & TYPE_MASK
+        if piece_type == PAWN:
+            if to_sq == ep_square:
+                squares[(from_sq & ~7) | (to_sq & 7)] = piece ^ (1 << COLOR_SHIFT)
+        elif piece_type == KING:
+            self.king_squares[piece >> COLOR_SHIFT] = from_sq
+            if to_sq - from_sq == 2:
+                squares[from_sq + 3] = squares[from_sq + 1]
+                squares[from_sq + 1] = EMPTY
+            elif from_sq - to_sq == 2:
+                squares[from_sq - 4] = squares[from_sq - 1]
+                squares[from_sq - 1] = EMPTY
+
+        self.castling = castling
+        self.ep_square = ep_square
+        self.halfmove_clock = halfmove_clock
+        self.hash = h
+        self.turn ^= 1
+        self.ply -= 1
+
+    def find_king(self, color):
+        """Find the position of the king of the specified color"""
+        sq = self.king_squares[color]
+        if sq < 0:
+            return None
+        return divmod(sq, 8)
+
+    def is_square_attacked(self, sq, by_color):
+        """Check if any piece of the given color attacks a square"""
+        squares = self.squares
+        side = by_color << COLOR_SHIFT
+
+        # A pawn attacks the square from where an opposing pawn on it would
+        # attack
+        pawn = side | PAWN
+        for attacker_sq in PAWN_ATTACK_TARGETS[by_color ^ 1][sq]:
+            if squares[attacker_sq] == pawn:
+                return True
+
+        # Knights and kings
+        knight = side | KNIGHT
+        for attacker_sq in KNIGHT_TARGETS[sq]:
+            if squares[attacker_sq] == knight:
+                return True
+        king = side | KING
+        for attacker_sq in KING_TARGETS[sq]:
+            if squares[attacker_sq] == king:
+                return True
+
+        # Sliding pieces: walk each ray out to the first occupied square
+        queen = side | QUEEN
+        for rays, attacker in (
+            (ROOK_RAYS[sq], side | ROOK),
+            (BISHOP_RAYS[sq], side | BISHOP),
+        ):
+            for ray in rays:
+                for attacker_sq in ray:
+                    target = squares[attacker_sq]
+                    if target:
+                        if target == attacker or target == queen:
+                            return True
+                        break
+
+        return False
+
+    def is_king_in_check(self, color):
+        """Check if the king of the specified color is in check"""
+        king_check_calls.inc()
+        king_sq = self.king_squares[color]
+        if king_sq < 0:
+            return False
+        return self.is_square_attacked(king_sq, color ^ 1)
+
+    def is_move_legal(self, from_pos, to_pos):
+        """Check if a move is legal (doesn't leave own king in check)"""
+        from_row, from_col = from_pos
+        to_row, to_col = to_pos
+
+        color = self.turn
+        self.push(encode_move(from_row * 8 + from_col, to_row * 8 + to_col))
+        in_check = self.is_king_in_check(color)
+        self.pop()
+
+        return not in_check
+
+    def get_legal_moves(self, row, col):
+        """Get all legal moves for a piece (excluding moves that leave king in check)"""
+        basic_moves = self.get_valid_moves(row, col)
+        legal_moves = []
+
+        for move in basic_moves:
+            if self.is_move_legal((row, col), move):
+                legal_moves.append(move)
+
+        return legal_moves
+
+    def generate_moves(self):
+        """Generate pseudo-legal packed moves for the side to move"""
+        moves = []
+        turn = self.turn
+        for sq, piece in enumerate(self.squares):
+            if piece and piece >> COLOR_SHIFT == turn:
+                promotes = piece & TYPE_MASK == PAWN
+                for to_row, to_col in self.get_piece_moves(sq >> 3, sq & 7, piece):
+                    move = encode_move(sq, to_row * 8 + to_col)
+                    if promotes and to_row in (0, 7):
+                        for promotion in PROMOTION_TYPES:
+                            moves.append(move | (promotion << MOVE_PROMOTION_SHIFT))
+                    else:
+                        moves.append(move)
+        return moves
+
+    def generate_legal_moves(self):
+        """Generate the packed moves that don't leave the mover's king in check"""
+        legal_generation_calls.inc()
+        color = self.turn
+        legal_moves = []
+        for move in self.generate_moves():
+            self.push(move)
+            if not self.is_king_in_check(color):
+                legal_moves.append(move)
+            self.pop()
+        return legal_moves
+
+    def get_legal_move_map(self):
+        """Get the legal target squares of every piece of the side to move
+
+        Returns (move_map, in_check), where move_map maps each from-square
+        with a legal move to its target squares. Results are cached per
+        position in legal_move_cache, which all games share.
+        """
+        entry = legal_move_cache.get(self.hash)
+        if entry is None:
+            move_map = {}
+            for move in self.generate_legal_moves():
+                targets = move_map.setdefault(move & MOVE_SQUARE_MASK, [])
+                to_sq = (move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK
+                if to_sq not in targets:  # promotions share a target
+                    targets.append(to_sq)
+            entry = (move_map, self.is_king_in_check(self.turn))
+            legal_move_cache.put(self.hash, entry)
+        return entry
+
+    def is_checkmate_or_stalemate(self):
+        """Check if the current position is checkmate or stalemate"""
+        # Check if current player has any legal moves
+        move_map, in_check = self.get_legal_move_map()
+        if not move_map:
+            if in_check:
+                self.game_result = "checkmate"
+                self.game_over = True
+                return "checkmate"
+            else:
+                self.game_result = "stalemate"
+                self.game_over = True
+                return "stalemate"
+
+        return None
+
+    def get_game_state(self, in_check=None, since=None, move_map=None):
+        """Get current game state for API
+
+        Callers that already know whether the side to move is in check (for
+        instance from the legal-move cache) can pass it in. With since set
+        to an earlier version, only the moves played after it and the
+        squares they changed are included (see get_changes_since). A move
+        map from get_legal_move_map is included as "legal_moves", keyed by
+        "row,col" of each movable piece.
+
+        Full states carry only the last MOVE_HISTORY_TAIL moves, starting
+        at index "history_from"; earlier ones are paged in with
+        get_move_history, so the state stays the same size as games grow.
+        """
+        if in_check is None:
+            in_check = self.is_king_in_check(self.turn)
+        state = {
+            "version": self.version,
+            "current_player": self.current_player,
+            "game_over": self.game_over,
+            "game_result": self.game_result,
+            "captured_pieces": self.captured_pieces,
+            "in_check": in_check,
+            "move_count": len(self.history),
+        }
+        if since is not None and self.base_version <= since <= self.version:
+            state.update(self.get_changes_since(since))
+        else:
+            state["board"] = self.board
+            start = max(len(self.history) - MOVE_HISTORY_TAIL, 0)
+            state["history_from"] = start
+            state["move_history"] = self.get_move_history(start)
+        if move_map is not None:
+            state["legal_moves"] = {
+                f"{sq >> 3},{sq & 7}": [[to_sq >> 3, to_sq & 7] for to_sq in targets]
+                for sq, targets in move_map.items()
+            }
+        return state
+
+    def get_changes_since(self, version):
+        """Get the moves played after a version and the squares they changed
+
+        The version must not predate base_version, since the history before
+        that is gone. Changed squares are given as [row, col, piece] with
+        the piece currently on them.
+        """
+        count = self.version - version
+        entries = self.undo_stack[len(self.undo_stack) - count :]
+        changed = set()
+        for move, _, _, ep_square, _, _ in entries:
+            from_sq = move & MOVE_SQUARE_MASK
+            to_sq = (move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK
+            changed.update((from_sq, to_sq))
+            if to_sq == ep_square:
+                changed.update((to_sq - 8, to_sq + 8))  # en passant capture
+            if from_sq in (4, 60) and abs(to_sq - from_sq) == 2:
+                changed.update(range(from_sq - 4, from_sq + 4))  # castling rook
+
+        squares = self.squares
+        return {
+            "since": version,
+            "new_moves": self.get_move_history(len(self.history) - count),
+            "changed_squares": [
+                [sq >> 3, sq & 7, PIECE_STRINGS[squares[sq]]] for sq in sorted(changed)
+            ],
+        }
+
+
+GAME_BACKENDS = ("mailbox", "bitboard")
+DEFAULT_BACKEND = os.environ.get("CHESS_BACKEND", "mailbox")
+
+
+def create_game(backend=None):
+    """Create a game using the named move-generation backend"""
+    backend = backend or DEFAULT_BACKEND
+    if backend == "mailbox":
+        return ChessGame()
+    if backend == "bitboard":
+        from bitboard import BitboardChessGame
+
+        return BitboardChessGame()
+    raise ValueError(f"Unknown chess backend: {backend}")
+
+
+def encode_position(game):
+    """Encode a game's position as its starting FEN and packed move bytes
+
+    Unlike a FEN this keeps the moves, so repetitions can still be detected.
+    It is cheap to pickle, e.g. to hand a position to a worker process.
+    """
+    moves = array("H", (entry[0] for entry in game.undo_stack))
+    return game.start_fen, moves.tobytes()
+
+
+def decode_position(position, backend="bitboard"):
+    """Rebuild a game from encode_position, without the move history"""
+    start_fen, move_bytes = position
+    game = create_game(backend)
+    if start_fen != START_FEN:
+        game.set_fen(start_fen)
+    moves = array("H")
+    moves.frombytes(move_bytes)
+    for move in moves:
+        game.push(move)
+    return game
+
+
+def load_game(record):
+    """Rebuild a game from a record made by ChessGame.to_record"""
+    data = json.loads(record)
+    game = create_game(data["backend"])
+    if data["fen"] != START_FEN:
+        game.set_fen(data["fen"])
+
+    moves = array("H")
+    moves.frombytes(b64decode(data["moves"]))
+    offsets = array("i")
+    offsets.frombytes(b64decode(data["times"]))
+    if sys.byteorder == "big":
+        moves.byteswap()
+        offsets.byteswap()
+
+    # The moves were validated when first played, so replay skips the
+    # legality and game-over checks until the final position
+    for move, offset in zip(moves, offsets):
+        game.record_move(move, data["t0"] + offset)
+    game.version = data["v"]
+    game.base_version = data["bv"]
+    game.is_checkmate_or_stalemate()
+    return game
+
+
+# Legal-move maps keyed by Zobrist hash (see ChessGame.get_legal_move_map)
+legal_move_cache = LRUCache(int(os.environ.get("CHESS_MOVE_CACHE_SIZE", 20000)))
+
+# Move-generator call counters, exported on /metrics by chess_app. An
+# increment is a single C call, cheap enough for the inner loops.
+legal_generation_calls = Counter(
+    "chess_generate_legal_moves_calls_total", "Legal-move generations for a position"
+)
+king_check_calls = Counter("chess_is_king_in_check_calls_total", "King-in-check tests")
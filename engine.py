@@ -0,0 +1,470 @@
+"""
+Chess Engine
+Negamax alpha-beta search with iterative deepening, a transposition table,
+killer/history move ordering and strict time or node budgets
+"""
+
+import time
+
+from chess_game import (
+    BISHOP,
+    COLOR_SHIFT,
+    KING,
+    KNIGHT,
+    MOVE_PROMOTION_SHIFT,
+    MOVE_SQUARE_MASK,
+    MOVE_TO_SHIFT,
+    PAWN,
+    PIECE_NAMES,
+    QUEEN,
+    ROOK,
+    TYPE_MASK,
+    WHITE,
+    move_to_uci,
+)
+
+MATE = 100000
+MATE_BOUND = MATE - 1000  # scores beyond this are mates in N plies
+INFINITY = MATE + 1
+MAX_DEPTH = 32
+
+# Transposition table entry flags
+EXACT = 0
+LOWER = 1  # score is a lower bound (the search failed high)
+UPPER = 2  # score is an upper bound (the search failed low)
+
+PIECE_VALUES = (0, 100, 320, 330, 500, 900, 0)
+
+# Piece-square tables from white's point of view, indexed like
+# ChessGame.squares (row 0 is the eighth rank)
+PIECE_SQUARE_TABLES = {
+    PAWN: (
+        0, 0, 0, 0, 0, 0, 0, 0,
+        50, 50, 50, 50, 50, 50, 50, 50,
+        10, 10, 20, 30, 30, 20, 10, 10,
+        5, 5, 10, 25, 25, 10, 5, 5,
+        0, 0, 0, 20, 20, 0, 0, 0,
+        5, -5, -10, 0, 0, -10, -5, 5,
+        5, 10, 10, -20, -20, 10, 10, 5,
+        0, 0, 0, 0, 0, 0, 0, 0,
+    ),
+    KNIGHT: (
+        -50, -40, -30, -30, -30, -30, -40, -50,
+        -40, -20, 0, 0, 0, 0, -20, -40,
+        -30, 0, 10, 15, 15, 10, 0, -30,
+        -30, 5, 15, 20, 20, 15, 5, -30,
+        -30, 0, 15, 20, 20, 15, 0, -30,
+        -30, 5, 10, 15, 15, 10, 5, -30,
+        -40, -20, 0, 5, 5, 0, -20, -40,
+        -50, -40, -30, -30, -30, -30, -40, -50,
+    ),
+    BISHOP: (
+        -20, -10, -10, -10, -10, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 10, 10, 5, 0, -10,
+        -10, 5, 5, 10, 10, 5, 5, -10,
+        -10, 0, 10, 10, 10, 10, 0, -10,
+        -10, 10, 10, 10, 10, 10, 10, -10,
+        -10, 5, 0, 0, 0, 0, 5, -10,
+        -20, -10, -10, -10, -10, -10, -10, -20,
+    ),
+    ROOK: (
+        0, 0, 0, 0, 0, 0, 0, 0,
+        5, 10, 10, 10, 10, 10, 10, 5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        0, 0, 0, 5, 5, 0, 0, 0,
+    ),
+    QUEEN: (
+        -20, -10, -10, -5, -5, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 5, 5, 5, 0, -10,
+        -5, 0, 5, 5, 5, 5, 0, -5,
+        0, 0, 5, 5, 5, 5, 0, -5,
+        -10, 5, 5, 5, 5, 5, 0, -10,
+        -10, 0, 5, 0, 0, 0, 0, -10,
+        -20, -10, -10, -5, -5, -10, -10, -20,
+    ),
+    KING: (
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -20, -30, -30, -40, -40, -30, -30, -20,
+        -10, -20, -20, -20, -20, -20, -20, -10,
+        20, 20, 0, 0, 0, 0, 20, 20,
+        20, 30, 10, 0, 0, 10, 30, 20,
+    ),
+}  # fmt: skip
+
+# Material plus position for every piece code on every square, signed so
+# that white pieces count positive (black squares are mirrored vertically)
+PIECE_SQUARE_VALUES = [[0] * 64 for _ in range(16)]
+for _type, _table in PIECE_SQUARE_TABLES.items():
+    for _sq in range(64):
+        PIECE_SQUARE_VALUES[_type][_sq] = PIECE_VALUES[_type] + _table[_sq]
+        PIECE_SQUARE_VALUES[(1 << COLOR_SHIFT) | _type][_sq] = -(
+            PIECE_VALUES[_type] + _table[_sq ^ 56]
+        )
+
+
+def evaluate(game):
+    """Static evaluation in centipawns from the side to move's point of view"""
+    values = PIECE_SQUARE_VALUES
+    score = 0
+    for sq, piece in enumerate(game.squares):
+        if piece:
+            score += values[piece][sq]
+    return score if game.turn == WHITE else -score
+
+
+class SearchAborted(Exception):
+    """Raised inside the search when the time or node budget runs out"""
+
+
+class TranspositionTable:
+    """Fixed-size table of search results indexed by Zobrist hash
+
+    Each slot keeps one entry. A new result replaces the stored one if it
+    was searched at least as deep or the stored one is left over from an
+    earlier search, so deep results survive within a search without
+    filling the table with stale entries across searches.
+    """
+
+    def __init__(self, size=1 << 18):
+        size = 1 << max(size - 1, 1).bit_length()  # round up to a power of two
+        self.mask = size - 1
+        self.entries = [None] * size  # (key, depth, score, flag, move, generation)
+        self.generation = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def new_search(self):
+        """Age existing entries so they give way to the next search"""
+        self.generation = (self.generation + 1) & 0xFF
+
+    def get(self, key):
+        """Get the entry for a position, or None"""
+        entry = self.entries[key & self.mask]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def put(self, key, depth, score, flag, move):
+        """Store a search result, subject to the replacement policy"""
+        index = key & self.mask
+        old = self.entries[index]
+        if old is None or old[5] != self.generation or depth >= old[1]:
+            self.entries[index] = (key, depth, score, flag, move, self.generation)
+
+    def clear(self):
+        """Drop every entry"""
+        self.entries = [None] * len(self.entries)
+
+
+def score_to_table(score, ply):
+    """Make a mate score relative to the stored position rather than the root"""
+    if score > MATE_BOUND:
+        return score + ply
+    if score < -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def score_from_table(score, ply):
+    """Make a stored mate score relative to the root again"""
+    if score > MATE_BOUND:
+        return score - ply
+    if score < -MATE_BOUND:
+        return score + ply
+    return score
+
+
+class Search:
+    """One search of a position, with its own budget and ordering state"""
+
+    def __init__(self, game, table, time_limit=None, node_limit=None, stop=None):
+        self.game = game
+        self.table = table
+        self.node_limit = node_limit
+        self.stop = stop  # polled like the clock; returns True to abort
+        self.start = time.perf_counter()
+        self.deadline = None if time_limit is None else self.start + time_limit
+        self.nodes = 0
+        self.killers = [[0, 0] for _ in range(MAX_DEPTH + 1)]
+        self.history = [0] * 4096  # indexed by from | to << 6
+        self.best_move = 0
+        self.best_score = -INFINITY
+
+    def check_limits(self):
+        """Abort the search once the node or time budget is spent"""
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            raise SearchAborted
+        if not self.nodes & 255:
+            if self.deadline is not None and time.perf_counter() >= self.deadline:
+                raise SearchAborted
+            if self.stop is not None and self.stop():
+                raise SearchAborted
+
+    def is_draw(self):
+        """Check for the fifty-move rule or a repetition since the last reset"""
+        game = self.game
+        clock = game.halfmove_clock
+        if clock >= 100:
+            return True
+        stack = game.undo_stack
+        key = game.hash
+        # Undo entries hold the hash before each move; the same side was to
+        # move two, four, ... plies ago
+        for i in range(len(stack) - 2, max(len(stack) - clock, 0) - 1, -2):
+            if stack[i][5] == key:
+                return True
+        return False
+
+    def order_moves(self, moves, tt_move, ply):
+        """Sort moves: hash move, captures by MVV-LVA, killers, then history"""
+        squares = self.game.squares
+        killers = self.killers[ply]
+        history = self.history
+
+        def priority(move):
+            if move == tt_move:
+                return 1 << 30
+            victim = squares[(move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK] & TYPE_MASK
+            promotion = move >> MOVE_PROMOTION_SHIFT
+            if victim or promotion:
+                attacker = squares[move & MOVE_SQUARE_MASK] & TYPE_MASK
+                return (1 << 24) + (victim + promotion) * 16 - attacker
+            if move == killers[0]:
+                return 1 << 22
+            if move == killers[1]:
+                return (1 << 22) - 1
+            return history[move & 4095]
+
+        return sorted(moves, key=priority, reverse=True)
+
+    def negamax(self, depth, alpha, beta, ply):
+        """Alpha-beta search returning the score for the side to move"""
+        game = self.game
+        self.nodes += 1
+        self.check_limits()
+        if ply and self.is_draw():
+            return 0
+        if depth <= 0:
+            return self.quiesce(alpha, beta, ply)
+
+        key = game.hash
+        entry = self.table.get(key)
+        tt_move = 0
+        if entry is not None:
+            tt_move = entry[4]
+            if ply and entry[1] >= depth:
+                score = score_from_table(entry[2], ply)
+                flag = entry[3]
+                if (
+                    flag == EXACT
+                    or (flag == LOWER and score >= beta)
+                    or (flag == UPPER and score <= alpha)
+                ):
+                    return score
+
+        moves = game.generate_legal_moves()
+        if not moves:
+            return -MATE + ply if game.is_king_in_check(game.turn) else 0
+
+        squares = game.squares
+        original_alpha = alpha
+        best_score = -INFINITY
+        best_move = 0
+        for move in self.order_moves(moves, tt_move, ply):
+            quiet = not (
+                squares[(move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK]
+                or move >> MOVE_PROMOTION_SHIFT
+            )
+            game.push(move)
+            score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)
+            game.pop()
+
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if ply == 0:
+                    self.best_move = move
+                    self.best_score = score
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                if quiet:
+                    killers = self.killers[ply]
+                    if killers[0] != move:
+                        killers[1] = killers[0]
+                        killers[0] = move
+                    self.history[move & 4095] += depth * depth
+                break
+
+        if best_score <= original_alpha:
+            flag = UPPER
+        elif best_score >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.table.put(key, depth, score_to_table(best_score, ply), flag, best_move)
+        return best_score
+
+    def quiesce(self, alpha, beta, ply):
+        """Search captures and promotions until the position is quiet"""
+        game = self.game
+        self.nodes += 1
+        self.check_limits()
+
+        stand_pat = evaluate(game)
+        if stand_pat >= beta:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+
+        squares = game.squares
+        color = game.turn
+        captures = [
+            move
+            for move in game.generate_moves()
+            if squares[(move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK]
+            or move >> MOVE_PROMOTION_SHIFT
+        ]
+        for move in self.order_moves(captures, 0, 0):
+            game.push(move)
+            if game.is_king_in_check(color):
+                game.pop()
+                continue
+            score = -self.quiesce(-beta, -alpha, ply + 1)
+            game.pop()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    def principal_variation(self, max_length):
+        """Follow hash moves from the root to recover the expected line"""
+        game = self.game
+        line = []
+        seen = set()
+        while len(line) < max_length and game.hash not in seen:
+            seen.add(game.hash)
+            entry = self.table.get(game.hash)
+            if entry is None or entry[4] not in game.generate_legal_moves():
+                break
+            line.append(entry[4])
+            game.push(entry[4])
+        for _ in line:
+            game.pop()
+        return line
+
+    def run(self, max_depth=MAX_DEPTH):
+        """Deepen iteratively until the budget or max_depth is reached"""
+        game = self.game
+        root_size = len(game.undo_stack)
+        moves = game.generate_legal_moves()
+        result = {"move": moves[0] if moves else 0, "score": 0, "depth": 0, "pv": []}
+        if len(moves) == 1:
+            max_depth = 1  # forced move, just score it
+
+        for depth in range(1, min(max_depth, MAX_DEPTH) + 1):
+            self.best_move = 0
+            try:
+                score = self.negamax(depth, -INFINITY, INFINITY, 0)
+            except SearchAborted:
+                while len(game.undo_stack) > root_size:
+                    game.pop()
+                # The previous best move is searched first, so a partial
+                # iteration that completed it can only have improved on it
+                if self.best_move:
+                    result["move"] = self.best_move
+                    result["score"] = self.best_score
+                break
+
+            result = {
+                "move": self.best_move,
+                "score": score,
+                "depth": depth,
+                "pv": self.principal_variation(depth),
+            }
+            if abs(score) > MATE_BOUND:
+                break  # a forced mate won't improve with depth
+            if self.deadline is not None:
+                elapsed = time.perf_counter() - self.start
+                if elapsed * 2 > self.deadline - self.start:
+                    break  # the next iteration would likely not finish
+
+        seconds = time.perf_counter() - self.start
+        result["nodes"] = self.nodes
+        result["seconds"] = round(seconds, 6)
+        result["nps"] = round(self.nodes / seconds) if seconds else None
+        return result
+
+
+class Engine:
+    """Computer opponent that keeps its transposition table between moves"""
+
+    def __init__(self, table_size=1 << 18):
+        self.table = TranspositionTable(table_size)
+
+    def search(
+        self, game, time_limit=None, node_limit=None, max_depth=MAX_DEPTH, stop=None
+    ):
+        """Find the best move for the side to move within the budget
+
+        The game is searched in place with push/pop and left as it was.
+        Returns a dict with the packed move (0 if there are no legal moves),
+        its score in centipawns, the depth reached, the principal variation
+        and the node count and speed. stop, if given, is polled during the
+        search and ends it early when it returns True.
+        """
+        self.table.new_search()
+        search = Search(game, self.table, time_limit, node_limit, stop)
+        return search.run(max_depth)
+
+
+# Engine of the current process, kept so its table carries over between
+# searches (see search_position)
+process_engine = None
+
+
+def search_position(
+    position, time_limit=None, node_limit=None, max_depth=MAX_DEPTH, table_size=1 << 18
+):
+    """Search a position from chess_game.encode_position
+
+    This is the job-pool entry point, so it takes and returns plain data:
+    the best move as from/to/promotion/UCI, plus the search statistics.
+    """
+    from chess_game import decode_position
+    from job_pool import cancelled
+
+    global process_engine
+    if process_engine is None:
+        process_engine = Engine(table_size)
+
+    result = process_engine.search(
+        decode_position(position), time_limit, node_limit, max_depth, cancelled
+    )
+    result["move"] = describe_move(result["move"]) if result["move"] else None
+    result["pv"] = [move_to_uci(move) for move in result["pv"]]
+    return result
+
+
+def describe_move(move):
+    """Get the API representation of a packed move"""
+    from_sq = move & MOVE_SQUARE_MASK
+    to_sq = (move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK
+    promotion = move >> MOVE_PROMOTION_SHIFT
+    return {
+        "from": [from_sq >> 3, from_sq & 7],
+        "to": [to_sq >> 3, to_sq & 7],
+        "promotion": PIECE_NAMES[promotion] or None,
+        "uci": move_to_uci(move),
+    }
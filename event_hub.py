@@ -0,0 +1,232 @@
+"""
+Event Hub
+Fans out game events to Server-Sent Events subscribers through bounded
+per-subscriber queues
+"""
+
+import asyncio
+import json
+import queue
+import threading
+
+# Sent to a subscriber whose queue overflowed, telling it to refetch the state
+RESYNC_EVENT = b"event: resync\ndata: {}\n\n"
+KEEPALIVE = b": keepalive\n\n"
+
+
+class HubFull(Exception):
+    """Raised when max_blocking thread-held streams are already open"""
+
+
+def format_event(event, data, event_id=None):
+    """Serialize an event in the text/event-stream wire format"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append("data: " + json.dumps(data, separators=(",", ":")))
+    return ("\n".join(lines) + "\n\n").encode()
+
+
+class Subscription:
+    """One subscriber's queue of pre-serialized events"""
+
+    __slots__ = ("channel", "queue", "lagged", "last_id")
+
+    def __init__(self, channel, maxsize, last_id=None):
+        self.channel = channel
+        self.queue = queue.Queue(maxsize)  # (event_id, message) pairs
+        self.lagged = False  # set when events were dropped on overflow
+        self.last_id = last_id  # ID of the last event delivered
+
+    def get(self, timeout):
+        """Wait for the next event, returning None if none arrives in time"""
+        try:
+            self.last_id, message = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        return message
+
+    def drain(self):
+        """Discard all queued events"""
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def notify(self):
+        """Called after an event was queued; blocking readers need nothing"""
+
+
+class AsyncSubscription(Subscription):
+    """Subscription read from an asyncio event loop
+
+    Publishers in other threads queue events as usual and wake the loop, so
+    a waiting subscriber costs a suspended coroutine rather than a thread.
+    """
+
+    __slots__ = ("loop", "ready")
+
+    def __init__(self, channel, maxsize, loop, last_id=None):
+        super().__init__(channel, maxsize, last_id)
+        self.loop = loop
+        self.ready = asyncio.Event()
+
+    def notify(self):
+        self.loop.call_soon_threadsafe(self.ready.set)
+
+    async def next(self, timeout):
+        """Wait for the next event, returning None if none arrives in time"""
+        while True:
+            try:
+                self.last_id, message = self.queue.get_nowait()
+                return message
+            except queue.Empty:
+                pass
+            self.ready.clear()
+            if not self.queue.empty():
+                continue  # published between the check and the clear
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+
+
+class EventHub:
+    """Publish/subscribe hub keyed by channel (one channel per game)
+
+    publish serializes an event once and hands the same bytes to every
+    subscriber without blocking. A subscriber whose queue is full loses the
+    event and is flagged as lagged; its stream then skips ahead and sends a
+    resync event, so a slow client never holds up the game or other
+    subscribers.
+
+    A blocking subscription (one without an event loop) holds a server
+    thread for as long as its stream is open, so at most max_blocking of
+    them are accepted; further ones raise HubFull and the client is
+    expected to poll instead.
+    """
+
+    def __init__(self, queue_size=64, max_blocking=None):
+        self.queue_size = queue_size
+        self.max_blocking = max_blocking
+        self.blocking = 0
+        self.refused = 0
+        self.published = 0
+        self.dropped = 0
+        self._channels = {}  # channel -> set of Subscriptions
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._channels.values())
+
+    def subscribe(self, channel, last_id=None, loop=None):
+        """Start receiving a channel's events
+
+        With an asyncio event loop the subscription is read with astream.
+        Raises HubFull if a blocking subscription would exceed max_blocking.
+        """
+        if loop is None:
+            subscription = Subscription(channel, self.queue_size, last_id)
+        else:
+            subscription = AsyncSubscription(channel, self.queue_size, loop, last_id)
+        with self._lock:
+            if loop is None:
+                if self.max_blocking is not None and self.blocking >= self.max_blocking:
+                    self.refused += 1
+                    raise HubFull(self.max_blocking)
+                self.blocking += 1
+            self._channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Stop receiving events"""
+        with self._lock:
+            subscribers = self._channels.get(subscription.channel)
+            if subscribers is None or subscription not in subscribers:
+                return
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._channels[subscription.channel]
+            if not isinstance(subscription, AsyncSubscription):
+                self.blocking -= 1
+
+    def publish(self, channel, event, data, event_id=None):
+        """Send an event to every subscriber of a channel"""
+        subscribers = self._channels.get(channel)
+        if not subscribers:
+            return 0
+
+        message = format_event(event, data, event_id)
+        with self._lock:
+            subscribers = list(subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait((event_id, message))
+            except queue.Full:
+                subscription.lagged = True
+                self.dropped += 1
+            subscription.notify()
+        self.published += 1
+        return len(subscribers)
+
+    def stream(self, subscription, first=None, heartbeat=15.0, on_idle=None):
+        """Yield a subscription's events as text/event-stream chunks
+
+        Sends a comment every heartbeat seconds so proxies keep the
+        connection open, and unsubscribes when the client goes away. If no
+        event arrived for a heartbeat, on_idle(subscription) may return a
+        chunk to send instead, e.g. a resync when another process changed
+        the game.
+        """
+        try:
+            if first is not None:
+                yield first
+            while True:
+                if subscription.lagged:
+                    subscription.lagged = False
+                    subscription.drain()
+                    yield RESYNC_EVENT
+                message = subscription.get(heartbeat)
+                if message is None:
+                    message = (on_idle and on_idle(subscription)) or KEEPALIVE
+                yield message
+        finally:
+            self.unsubscribe(subscription)
+
+    async def astream(self, subscription, first=None, heartbeat=15.0, on_idle=None):
+        """Async version of stream for an AsyncSubscription
+
+        on_idle may block (it can look at the game store), so it runs in the
+        loop's default executor.
+        """
+        loop = subscription.loop
+        try:
+            if first is not None:
+                yield first
+            while True:
+                if subscription.lagged:
+                    subscription.lagged = False
+                    subscription.drain()
+                    yield RESYNC_EVENT
+                message = await subscription.next(heartbeat)
+                if message is None and on_idle is not None:
+                    message = await loop.run_in_executor(None, on_idle, subscription)
+                yield message or KEEPALIVE
+        finally:
+            self.unsubscribe(subscription)
+
+    def stats(self):
+        """Get subscriber and delivery counters"""
+        return {
+            "channels": len(self._channels),
+            "subscribers": len(self),
+            "blocking": self.blocking,
+            "max_blocking": self.max_blocking,
+            "refused": self.refused,
+            "queue_size": self.queue_size,
+            "published": self.published,
+            "dropped": self.dropped,
+        }
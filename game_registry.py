@@ -0,0 +1,205 @@
+"""
+Game Registry
+Keeps live games keyed by ID, with one lock per game and bounded residency
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class GameNotFound(KeyError):
+    """Raised when a game ID is unknown or the game has been evicted"""
+
+
+class GameEntry:
+    """A resident game together with its lock, stored version and last use
+
+    pins counts the requests that have been handed the entry and not yet
+    finished with it; a pinned entry is never evicted, so two requests
+    can't end up with separate copies of the same game.
+    """
+
+    __slots__ = ("game", "version", "lock", "last_used", "pins")
+
+    def __init__(self, game=None, version=None):
+        self.game = game
+        self.version = version
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.pins = 0
+
+
+class GameRegistry:
+    """Live games keyed by ID, backed by a game store
+
+    The store (see game_store.py) holds every game as a serialized record
+    and is the source of truth; the registry keeps recently used games
+    deserialized in memory and reloads one only when the store reports a
+    newer version, e.g. after another worker process played a move.
+
+    Requests on the same game serialize on that game's lock while requests
+    on different games run in parallel. Games idle for longer than
+    idle_timeout seconds are dropped, and at most max_games stay resident.
+
+    store may be a function returning the store, which is then created on
+    first use, in the process that serves requests rather than any process
+    that merely imports the registry's module.
+    """
+
+    def __init__(self, store, loader, max_games=1000, idle_timeout=3600):
+        self._store = None if callable(store) else store
+        self._store_factory = store if callable(store) else None
+        self._store_lock = threading.Lock()
+        self.loader = loader  # rebuilds a game from its record
+        self.max_games = max_games
+        self.idle_timeout = idle_timeout
+        self.evictions = 0
+        self.reloads = 0
+        self._entries = OrderedDict()  # least recently used first
+        self._lock = threading.Lock()
+        self._last_purge = time.monotonic()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def store(self):
+        """The game store, created on first use"""
+        if self._store is None:
+            with self._store_lock:
+                if self._store is None:
+                    self._store = self._store_factory()
+        return self._store
+
+    def __contains__(self, game_id):
+        return game_id in self._entries or self.store.get_version(game_id) is not None
+
+    def create(self, game):
+        """Register a game under a fresh ID and return the ID"""
+        game_id = uuid.uuid4().hex
+        version = self.store.save(game_id, game.to_record())
+        with self._lock:
+            self._evict(reserve=1)
+            self._entries[game_id] = GameEntry(game, version)
+        return game_id
+
+    def remove(self, game_id):
+        """Forget a game"""
+        with self._lock:
+            self._entries.pop(game_id, None)
+        self.store.delete(game_id)
+
+    def _entry(self, game_id):
+        """Get and pin the resident entry for a game, adding an empty one if
+        needed; release it with _unpin
+
+        An unknown ID raises GameNotFound before a slot is reserved, so
+        requests for made-up IDs can't evict resident games.
+        """
+        if game_id not in self._entries and self.store.get_version(game_id) is None:
+            raise GameNotFound(game_id)
+        with self._lock:
+            entry = self._entries.get(game_id)
+            if entry is None:
+                self._evict(reserve=1)
+                entry = self._entries[game_id] = GameEntry()
+            else:
+                self._entries.move_to_end(game_id)
+            entry.last_used = time.monotonic()
+            entry.pins += 1
+            return entry
+
+    def _unpin(self, entry):
+        """Release an entry pinned by _entry"""
+        with self._lock:
+            entry.pins -= 1
+
+    def _sync(self, game_id, entry):
+        """Bring a resident game up to date with the store"""
+        version = self.store.get_version(game_id)
+        if version is not None and entry.game is not None and entry.version == version:
+            return entry.game
+
+        loaded = self.store.load(game_id) if version is not None else None
+        if loaded is None:
+            with self._lock:
+                if self._entries.get(game_id) is entry:
+                    del self._entries[game_id]
+            raise GameNotFound(game_id)
+
+        entry.version, record = loaded
+        entry.game = self.loader(record)
+        self.reloads += 1
+        return entry.game
+
+    @contextmanager
+    def locked(self, game_id, write=False):
+        """Hold a game's lock for the duration of a with block
+
+        With write=True the store's write lock is held too, and the game is
+        saved afterwards if the block played or took back a move.
+        """
+        entry = self._entry(game_id)
+        try:
+            with entry.lock:
+                if not write:
+                    yield self._sync(game_id, entry)
+                    return
+
+                with self.store.write_lock(game_id):
+                    game = self._sync(game_id, entry)
+                    before = (game.ply, game.hash)
+                    yield game
+                    if (game.ply, game.hash) != before:
+                        entry.version = self.store.save(game_id, game.to_record())
+        finally:
+            self._unpin(entry)
+
+    def _evict(self, reserve=0):
+        """Drop idle games, then least recently used ones above the cap
+
+        Must be called with the registry lock held. Games pinned by an
+        in-flight request are never evicted. Evicted games stay
+        in the store until they have been idle for idle_timeout.
+        """
+        now = time.monotonic()
+        deadline = now - self.idle_timeout
+        for game_id, entry in list(self._entries.items()):
+            if entry.last_used >= deadline:
+                break  # entries are ordered by last use
+            if not entry.pins:
+                del self._entries[game_id]
+                self.evictions += 1
+
+        excess = len(self._entries) + reserve - self.max_games
+        if excess > 0:
+            for game_id, entry in list(self._entries.items()):
+                if excess <= 0:
+                    break
+                if not entry.pins:
+                    del self._entries[game_id]
+                    self.evictions += 1
+                    excess -= 1
+
+        if now - self._last_purge > min(self.idle_timeout, 60):
+            self._last_purge = now
+            self.store.purge_idle(self.idle_timeout)
+
+    def evict_idle(self):
+        """Drop games that have been idle for longer than the timeout"""
+        with self._lock:
+            self._evict()
+
+    def stats(self):
+        """Get the resident game count and eviction counters"""
+        return {
+            "games": len(self._entries),
+            "stored_games": len(self.store),
+            "max_games": self.max_games,
+            "idle_timeout": self.idle_timeout,
+            "evictions": self.evictions,
+            "reloads": self.reloads,
+        }
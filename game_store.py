@@ -0,0 +1,613 @@
+"""
+Game Store
+Storage backends holding serialized games so several worker processes can
+serve the same game
+"""
+
+import atexit
+import json
+import os
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from base64 import b64decode, b64encode
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Journal entries: a CRC-32 of the rest of the entry, a fixed header, then
+# the game ID and the record. A torn write at the end of the file fails the
+# checksum and is dropped on replay.
+JOURNAL_CHECKSUM = struct.Struct("<I")
+JOURNAL_ENTRY = struct.Struct("<IBBId")  # record length, kind, ID length, version, time
+JOURNAL_SAVE = 1
+JOURNAL_DELETE = 2
+JOURNAL_MOVE = 3
+
+# Record fields (base64 arrays, see ChessGame.to_record) that only grow as a
+# game goes on; a move entry carries just their new tail
+JOURNAL_APPEND_FIELDS = ("moves", "times")
+
+
+class MemoryGameStore:
+    """Serialized games kept in a dict, for a single process (development)
+
+    Reads count as use: a game that is only watched is not purged as idle.
+    """
+
+    def __init__(self):
+        self._records = {}  # game_id -> (version, record, saved)
+        self._accessed = {}  # game_id -> time of the last save or read
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._records)
+
+    def get_version(self, game_id):
+        """Get the stored version of a game, or None if it doesn't exist"""
+        entry = self._records.get(game_id)
+        if entry is None:
+            return None
+        self._accessed[game_id] = time.time()
+        return entry[0]
+
+    def load(self, game_id):
+        """Get (version, record) for a game, or None if it doesn't exist"""
+        entry = self._records.get(game_id)
+        if entry is None:
+            return None
+        self._accessed[game_id] = time.time()
+        return entry[:2]
+
+    def save(self, game_id, record):
+        """Store a game's record and return its new version"""
+        with self._lock:
+            entry = self._records.get(game_id)
+            version = entry[0] + 1 if entry else 1
+            now = time.time()
+            self._records[game_id] = (version, record, now)
+            self._accessed[game_id] = now
+        return version
+
+    @contextmanager
+    def write_lock(self, game_id):
+        """Exclude other writers while a game is updated
+
+        Within one process the registry's per-game lock already does this.
+        """
+        yield
+
+    def delete(self, game_id):
+        """Remove a game"""
+        with self._lock:
+            self._records.pop(game_id, None)
+            self._accessed.pop(game_id, None)
+
+    def idle_games(self, idle_timeout):
+        """List the games neither saved nor read for idle_timeout seconds
+
+        Must be called with the lock held. Also forgets access times left
+        behind by reads racing a delete.
+        """
+        deadline = time.time() - idle_timeout
+        for game_id in [key for key in self._accessed if key not in self._records]:
+            del self._accessed[game_id]
+        return [
+            game_id
+            for game_id, entry in self._records.items()
+            if self._accessed.get(game_id, entry[2]) < deadline
+        ]
+
+    def purge_idle(self, idle_timeout):
+        """Remove games neither saved nor read for idle_timeout seconds"""
+        with self._lock:
+            for game_id in self.idle_games(idle_timeout):
+                del self._records[game_id]
+                self._accessed.pop(game_id, None)
+
+
+def encode_entry(kind, game_id, version, updated, record=""):
+    """Encode one journal entry"""
+    key = game_id.encode("ascii")
+    data = record.encode("utf-8")
+    body = JOURNAL_ENTRY.pack(len(data), kind, len(key), version, updated) + key + data
+    return JOURNAL_CHECKSUM.pack(zlib.crc32(body)) + body
+
+
+def read_entries(f):
+    """Yield (kind, game_id, version, updated, record, end offset) from a journal
+
+    Stops at the end of the file or at the first incomplete or corrupt
+    entry.
+    """
+    header_size = JOURNAL_CHECKSUM.size + JOURNAL_ENTRY.size
+    while True:
+        header = f.read(header_size)
+        if len(header) < header_size:
+            return
+        (checksum,) = JOURNAL_CHECKSUM.unpack_from(header)
+        length, kind, key_length, version, updated = JOURNAL_ENTRY.unpack_from(
+            header, JOURNAL_CHECKSUM.size
+        )
+        payload = f.read(key_length + length)
+        if len(payload) < key_length + length:
+            return
+        if zlib.crc32(payload, zlib.crc32(header[JOURNAL_CHECKSUM.size :])) != checksum:
+            return
+        game_id = payload[:key_length].decode("ascii")
+        record = payload[key_length:].decode("utf-8")
+        yield kind, game_id, version, updated, record, f.tell()
+
+
+def record_delta(old, new):
+    """Encode the change from record old to record new for a move entry
+
+    Returns None unless new only appends to old's growing fields, e.g.
+    after an undo or a new starting position.
+    """
+    old = json.loads(old)
+    new = json.loads(new)
+    if old.keys() != new.keys():
+        return None
+    delta = {}
+    for key, value in new.items():
+        if key in JOURNAL_APPEND_FIELDS:
+            before = b64decode(old[key])
+            after = b64decode(value)
+            if not after.startswith(before):
+                return None
+            delta[key] = b64encode(after[len(before) :]).decode("ascii")
+        elif value != old[key]:
+            delta[key] = value
+    return json.dumps(delta, separators=(",", ":"))
+
+
+def apply_deltas(record, deltas):
+    """Rebuild a full record from a saved one and the move entries after it"""
+    data = json.loads(record)
+    parts = {key: [b64decode(data[key])] for key in JOURNAL_APPEND_FIELDS}
+    for delta in deltas:
+        for key, value in json.loads(delta).items():
+            if key in parts:
+                parts[key].append(b64decode(value))
+            else:
+                data[key] = value
+    for key, chunks in parts.items():
+        data[key] = b64encode(b"".join(chunks)).decode("ascii")
+    return json.dumps(data, separators=(",", ":"))
+
+
+class JournalLocked(Exception):
+    """Raised when a journal belongs to another process"""
+
+
+def lock_exclusive(fd):
+    """Lock an open file without waiting, returning False if it is taken
+
+    The lock is held until the file is closed. A forked child shares its
+    parent's lock, so owners also check their process ID.
+    """
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+def fsync_directory(path):
+    """Make a rename in path's directory durable, where the OS allows it"""
+    if not hasattr(os, "O_DIRECTORY"):
+        return  # Windows has no directory handles to sync
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class JournalGameStore(MemoryGameStore):
+    """Serialized games in memory, made durable by an append-only journal
+
+    Every save and delete is queued as a checksummed journal entry; request
+    threads never touch the disk. A save that only adds moves is journaled
+    as just the new moves and times, so a long game costs a constant amount
+    per move rather than a copy of its whole record. A background thread
+    writes the queued entries together and fsyncs once per batch (group
+    commit), flush_interval seconds after the first one or as soon as
+    flush_records are waiting, so a crash loses at most the last batch.
+    Once the journal has grown to compact_ratio times the size of the live
+    games, it is rewritten as one full entry per game. On start-up the journal is replayed to restore every
+    game. Like MemoryGameStore it serves a single worker process.
+
+    The process that opens the journal owns it: an exclusive lock on
+    path.lock stops any other process from replaying or truncating it
+    (raising JournalLocked), and a process forked from the owner refuses
+    to write to it.
+    """
+
+    def __init__(
+        self,
+        path,
+        flush_interval=0.05,
+        flush_records=100,
+        compact_ratio=4,
+        compact_min_bytes=1 << 20,
+    ):
+        super().__init__()
+        self._lock_fd = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        if not lock_exclusive(self._lock_fd):
+            os.close(self._lock_fd)
+            raise JournalLocked(f"Journal {path} is in use by another process")
+        self._owner_pid = os.getpid()
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_records = flush_records
+        self.compact_ratio = compact_ratio
+        self.compact_min_bytes = compact_min_bytes
+        self.entries_written = 0
+        self.syncs = 0
+        self.compactions = 0
+        self._pending = []  # encoded entries waiting for the flusher
+        self._wakeup = threading.Condition(self._lock)
+        self._io_lock = threading.Lock()  # serializes writes to the file
+        self._flusher = None
+        self._closed = False
+        self._live_bytes = 0  # approximate size of a compacted journal
+        self.replayed = self._replay()
+        self._file = open(path, "ab")
+        self._journal_bytes = self._file.tell()
+        atexit.register(self.close)
+
+    @staticmethod
+    def _entry_size(game_id, record):
+        return JOURNAL_CHECKSUM.size + JOURNAL_ENTRY.size + len(game_id) + len(record)
+
+    def _replay(self):
+        """Restore the games from the journal, returning the entries read"""
+        if not os.path.exists(self.path):
+            return 0
+        count = 0
+        end = 0
+        deltas = {}  # game_id -> move entries since its last full record
+        with open(self.path, "rb") as f:
+            for kind, game_id, version, updated, record, end in read_entries(f):
+                if kind == JOURNAL_SAVE:
+                    self._records[game_id] = (version, record, updated)
+                    deltas.pop(game_id, None)
+                elif kind == JOURNAL_MOVE:
+                    if game_id in self._records:
+                        base = self._records[game_id][1]
+                        self._records[game_id] = (version, base, updated)
+                        deltas.setdefault(game_id, []).append(record)
+                else:
+                    self._records.pop(game_id, None)
+                    deltas.pop(game_id, None)
+                count += 1
+            size = f.seek(0, os.SEEK_END)
+        # Apply each game's moves at once, not one full record per entry
+        for game_id, records in deltas.items():
+            version, base, updated = self._records[game_id]
+            self._records[game_id] = (version, apply_deltas(base, records), updated)
+        # Reads aren't journaled, so restored games start a fresh idle period
+        now = time.time()
+        self._accessed = dict.fromkeys(self._records, now)
+        if end < size:
+            # The last write was cut short; drop it so new entries follow a
+            # complete one
+            with open(self.path, "r+b") as f:
+                f.truncate(end)
+        self._live_bytes = sum(
+            self._entry_size(game_id, entry[1])
+            for game_id, entry in self._records.items()
+        )
+        return count
+
+    def _is_owner(self):
+        return os.getpid() == self._owner_pid
+
+    def _check_owner(self):
+        """Refuse changes from a process forked after the journal was opened"""
+        if not self._is_owner():
+            raise JournalLocked(
+                f"Journal {self.path} belongs to process {self._owner_pid}"
+            )
+
+    def _queue(self, entry):
+        """Queue an encoded entry for the flusher; the lock must be held"""
+        self._pending.append(entry)
+        if self._flusher is None and not self._closed:
+            self._flusher = threading.Thread(
+                target=self._run, name="journal-flusher", daemon=True
+            )
+            self._flusher.start()
+        if len(self._pending) == 1 or len(self._pending) >= self.flush_records:
+            self._wakeup.notify()
+
+    def save(self, game_id, record):
+        """Store a game's record and return its new version"""
+        self._check_owner()
+        with self._lock:
+            previous = self._records.get(game_id)
+        # Work out the delta outside the lock; it only holds if no other
+        # save got in meanwhile
+        delta = previous and record_delta(previous[1], record)
+        with self._lock:
+            entry = self._records.get(game_id)
+            version = entry[0] + 1 if entry else 1
+            now = time.time()
+            self._records[game_id] = (version, record, now)
+            self._accessed[game_id] = now
+            self._live_bytes += self._entry_size(game_id, record)
+            if entry:
+                self._live_bytes -= self._entry_size(game_id, entry[1])
+            if delta is not None and entry is previous:
+                self._queue(encode_entry(JOURNAL_MOVE, game_id, version, now, delta))
+            else:
+                self._queue(encode_entry(JOURNAL_SAVE, game_id, version, now, record))
+        return version
+
+    def _remove(self, game_id):
+        """Drop a game and journal it; the lock must be held"""
+        entry = self._records.pop(game_id)
+        self._accessed.pop(game_id, None)
+        self._live_bytes -= self._entry_size(game_id, entry[1])
+        self._queue(encode_entry(JOURNAL_DELETE, game_id, entry[0], time.time()))
+
+    def delete(self, game_id):
+        """Remove a game"""
+        self._check_owner()
+        with self._lock:
+            if game_id in self._records:
+                self._remove(game_id)
+
+    def purge_idle(self, idle_timeout):
+        """Remove games neither saved nor read for idle_timeout seconds"""
+        self._check_owner()
+        with self._lock:
+            for game_id in self.idle_games(idle_timeout):
+                self._remove(game_id)
+
+    def _run(self):
+        """Flusher thread: write queued entries in batches, compacting as needed"""
+        while True:
+            with self._lock:
+                while not self._pending and not self._closed:
+                    self._wakeup.wait()
+                if self._closed:
+                    return  # close() writes what is left
+                if len(self._pending) < self.flush_records:
+                    self._wakeup.wait(self.flush_interval)  # gather a batch
+            self.flush()
+            if self._journal_bytes > max(
+                self.compact_min_bytes, self.compact_ratio * self._live_bytes
+            ):
+                self.compact()
+
+    def flush(self):
+        """Write every queued entry and fsync the journal"""
+        if not self._is_owner():
+            return
+        with self._io_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch or self._file.closed:
+                return
+            self._file.write(b"".join(batch))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._journal_bytes = self._file.tell()
+            self.entries_written += len(batch)
+            self.syncs += 1
+
+    def compact(self):
+        """Rewrite the journal as one full entry per live game
+
+        The new journal is written beside the old one and renamed over it,
+        so a crash part-way leaves the old journal intact.
+        """
+        if not self._is_owner():
+            return
+        with self._io_lock:
+            if self._file.closed:
+                return
+            with self._lock:
+                snapshot = list(self._records.items())
+                self._pending = []  # already reflected in the snapshot
+            temporary = f"{self.path}.compact"
+            with open(temporary, "wb") as f:
+                for game_id, (version, record, updated) in snapshot:
+                    f.write(
+                        encode_entry(JOURNAL_SAVE, game_id, version, updated, record)
+                    )
+                f.flush()
+                os.fsync(f.fileno())
+            self._file.close()
+            os.replace(temporary, self.path)
+            fsync_directory(self.path)
+            self._file = open(self.path, "ab")
+            self._journal_bytes = self._file.tell()
+            self.compactions += 1
+
+    def close(self):
+        """Write the remaining entries, close the journal and release it"""
+        if not self._is_owner():
+            return  # e.g. at exit of a forked child; the owner closes it
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wakeup.notify_all()
+        self.flush()
+        with self._io_lock:
+            self._file.close()
+        os.close(self._lock_fd)
+
+    def stats(self):
+        """Get the journal's write counters"""
+        return {
+            "path": self.path,
+            "replayed": self.replayed,
+            "entries_written": self.entries_written,
+            "syncs": self.syncs,
+            "compactions": self.compactions,
+            "journal_bytes": self._journal_bytes,
+        }
+
+
+class SQLiteGameStore:
+    """Serialized games in a local SQLite database shared by worker processes
+
+    The database runs in WAL mode so readers never block the single writer.
+    Each thread keeps its own connection. Reads refresh a game's updated
+    time at most once per touch_interval, so watched games aren't purged
+    without turning every poll into a write.
+    """
+
+    def __init__(self, path, busy_timeout=5.0, touch_interval=60.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.touch_interval = touch_interval
+        self._local = threading.local()
+        self._touched = {}  # game_id -> when this process last refreshed it
+        self._touch_lock = threading.Lock()
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS games ("
+            " game_id TEXT PRIMARY KEY,"
+            " version INTEGER NOT NULL,"
+            " record BLOB NOT NULL,"
+            " updated REAL NOT NULL)"
+        )
+        # Workers forked from a preloaded app must not inherit this connection
+        conn.close()
+        self._local.conn = None
+
+    def _connect(self):
+        """Get this thread's connection, opening it on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path, timeout=self.busy_timeout, isolation_level=None
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM games").fetchone()[0]
+
+    def _touch(self, game_id):
+        """Mark a game as used, writing only if the last mark is stale"""
+        now = time.time()
+        with self._touch_lock:
+            if now - self._touched.get(game_id, 0.0) < self.touch_interval:
+                return
+            self._touched[game_id] = now
+        self._connect().execute(
+            "UPDATE games SET updated = ? WHERE game_id = ? AND updated < ?",
+            (now, game_id, now),
+        )
+
+    def get_version(self, game_id):
+        """Get the stored version of a game, or None if it doesn't exist"""
+        row = (
+            self._connect()
+            .execute("SELECT version FROM games WHERE game_id = ?", (game_id,))
+            .fetchone()
+        )
+        if row is None:
+            return None
+        self._touch(game_id)
+        return row[0]
+
+    def load(self, game_id):
+        """Get (version, record) for a game, or None if it doesn't exist"""
+        row = (
+            self._connect()
+            .execute("SELECT version, record FROM games WHERE game_id = ?", (game_id,))
+            .fetchone()
+        )
+        if row is None:
+            return None
+        self._touch(game_id)
+        return row[0], row[1]
+
+    def save(self, game_id, record):
+        """Store a game's record and return its new version"""
+        conn = self._connect()
+        conn.execute(
+            "INSERT INTO games (game_id, version, record, updated)"
+            " VALUES (?, 1, ?, ?)"
+            " ON CONFLICT(game_id) DO UPDATE SET"
+            " version = version + 1, record = excluded.record,"
+            " updated = excluded.updated",
+            (game_id, record, time.time()),
+        )
+        return self.get_version(game_id)
+
+    @contextmanager
+    def write_lock(self, game_id):
+        """Hold the database write lock while a game is updated
+
+        BEGIN IMMEDIATE serializes writers across processes, so a worker
+        that reloads the game inside this block sees every earlier move.
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def delete(self, game_id):
+        """Remove a game"""
+        self._connect().execute("DELETE FROM games WHERE game_id = ?", (game_id,))
+        with self._touch_lock:
+            self._touched.pop(game_id, None)
+
+    def purge_idle(self, idle_timeout):
+        """Remove games neither saved nor read for idle_timeout seconds
+
+        Reads are only recorded every touch_interval, so the interval is
+        shortened to a quarter of the timeout if it is longer.
+        """
+        now = time.time()
+        with self._touch_lock:
+            self.touch_interval = min(self.touch_interval, idle_timeout / 4)
+            self._touched = {
+                game_id: touched
+                for game_id, touched in self._touched.items()
+                if now - touched < self.touch_interval
+            }
+        self._connect().execute(
+            "DELETE FROM games WHERE updated < ?", (now - idle_timeout,)
+        )
+
+
+def create_store(url=None):
+    """Create a game store from a URL such as 'memory', 'journal:///games.log'
+    or 'sqlite:///games.db'"""
+    url = url or os.environ.get("CHESS_GAME_STORE", "memory")
+    if url == "memory":
+        return MemoryGameStore()
+    if url.startswith("journal:///"):
+        return JournalGameStore(
+            url[len("journal:///") :],
+            flush_interval=float(os.environ.get("CHESS_JOURNAL_FLUSH_INTERVAL", 0.05)),
+            flush_records=int(os.environ.get("CHESS_JOURNAL_FLUSH_RECORDS", 100)),
+        )
+    if url.startswith("sqlite:///"):
+        return SQLiteGameStore(url[len("sqlite:///") :])
+    raise ValueError(f"Unknown game store: {url}")
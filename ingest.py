@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Game Ingestion
+Streams PGN or FEN archives, validates and replays every game with the
+ChessGame rules and writes per-game results as JSON Lines
+"""
+
+import argparse
+import json
+import re
+import sys
+import time
+from itertools import islice
+from multiprocessing import Pool
+
+from chess_game import (
+    BISHOP,
+    EMPTY,
+    GAME_BACKENDS,
+    KING,
+    KNIGHT,
+    MOVE_PROMOTION_SHIFT,
+    MOVE_SQUARE_MASK,
+    MOVE_TO_SHIFT,
+    PAWN,
+    PIECE_NAMES,
+    QUEEN,
+    ROOK,
+    TYPE_MASK,
+    WHITE,
+    create_game,
+    parse_square,
+)
+
+SAN_PIECES = {"N": KNIGHT, "B": BISHOP, "R": ROOK, "Q": QUEEN, "K": KING}
+SAN_PATTERN = re.compile(r"^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$")
+CASTLING_SAN = {"O-O": 6, "0-0": 6, "O-O-O": 2, "0-0-0": 2}  # king's target column
+TAG_PATTERN = re.compile(r'^\[(\w+)\s+"(.*)"\]$')
+TOKEN_PATTERN = re.compile(r"\{[^}]*\}|\(|\)|\$\d+|\d+\.+|[^\s(){}]+")
+RESULTS = {"1-0", "0-1", "1/2-1/2", "*"}
+
+
+def read_pgn(lines):
+    """Yield (headers, movetext) for each game in a stream of PGN lines
+
+    A game ends at the next tag section or at a result token closing a
+    movetext line. Only one game is held in memory at a time, so archives
+    of any size can be streamed from disk.
+    """
+    headers = {}
+    movetext = []
+    for line in lines:
+        line = line.strip()
+        if line.startswith("["):
+            if movetext:
+                yield headers, " ".join(movetext)
+                headers, movetext = {}, []
+            match = TAG_PATTERN.match(line)
+            if match:
+                headers[match.group(1)] = match.group(2)
+        elif line and not line.startswith("%"):
+            comment = line.find(";")  # rest-of-line comment
+            if comment >= 0:
+                line = line[:comment]
+            movetext.append(line)
+            words = line.split()
+            if words and words[-1] in RESULTS:
+                yield headers, " ".join(movetext)
+                headers, movetext = {}, []
+    if headers or movetext:
+        yield headers, " ".join(movetext)
+
+
+def read_fens(lines):
+    """Yield each non-empty, non-comment line of a FEN or EPD file"""
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            yield line
+
+
+def san_tokens(movetext):
+    """Get the mainline SAN moves of a movetext, skipping comments,
+    variations, NAGs, move numbers and the result"""
+    tokens = []
+    depth = 0
+    for token in TOKEN_PATTERN.findall(movetext):
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth or token[0] in "{$" or token[0].isdigit() and token[-1] == ".":
+            continue
+        elif token not in RESULTS:
+            tokens.append(token)
+    return tokens
+
+
+def parse_san(game, san):
+    """Find the legal packed move a SAN token describes in the position
+
+    Raises ValueError if the token is malformed, illegal or ambiguous.
+    """
+    token = san.rstrip("+#!?")
+    if token in CASTLING_SAN:
+        row = 7 if game.turn == WHITE else 0
+        kind, from_file, from_rank = KING, 4, row
+        to_sq = row * 8 + CASTLING_SAN[token]
+        promotion = EMPTY
+    else:
+        match = SAN_PATTERN.match(token)
+        if match is None:
+            raise ValueError(f"Malformed move: {san}")
+        letter, file_name, rank_name, target, promotion_letter = match.groups()
+        kind = SAN_PIECES[letter] if letter else PAWN
+        from_file = "abcdefgh".index(file_name) if file_name else None
+        from_rank = 8 - int(rank_name) if rank_name else None
+        to_sq = parse_square(target)
+        promotion = SAN_PIECES[promotion_letter] if promotion_letter else EMPTY
+
+    squares = game.squares
+    color = game.turn
+    found = 0
+    for move in game.generate_moves():
+        if (move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK != to_sq:
+            continue
+        from_sq = move & MOVE_SQUARE_MASK
+        if (
+            squares[from_sq] & TYPE_MASK != kind
+            or move >> MOVE_PROMOTION_SHIFT != promotion
+            or (from_file is not None and from_sq & 7 != from_file)
+            or (from_rank is not None and from_sq >> 3 != from_rank)
+        ):
+            continue
+        game.push(move)
+        legal = not game.is_king_in_check(color)
+        game.pop()
+        if legal:
+            if found:
+                raise ValueError(f"Ambiguous move: {san}")
+            found = move
+
+    if not found:
+        raise ValueError(f"Illegal move: {san}")
+    return found
+
+
+def move_positions(move):
+    """Convert a packed move to the (from_pos, to_pos, promotion) of make_move"""
+    from_sq = move & MOVE_SQUARE_MASK
+    to_sq = (move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK
+    promotion = PIECE_NAMES[move >> MOVE_PROMOTION_SHIFT] or "queen"
+    return divmod(from_sq, 8), divmod(to_sq, 8), promotion
+
+
+def replay_pgn(item, backend="bitboard", with_moves=False):
+    """Validate and replay one game, returning its result record
+
+    Moves are played with push only: no move records, timestamps or JSON
+    are produced along the way. A move after checkmate or stalemate is
+    rejected as illegal, since the position has no legal moves. With
+    with_moves the record lists the moves in make_move's form.
+    """
+    index, headers, movetext = item
+    record = {"index": index, "headers": headers, "valid": True, "plies": 0}
+    game = create_game(backend)
+    moves = []
+    try:
+        if headers.get("FEN"):
+            game.set_fen(headers["FEN"])
+        for san in san_tokens(movetext):
+            move = parse_san(game, san)
+            game.push(move)
+            moves.append(move)
+        game.is_checkmate_or_stalemate()
+    except (ValueError, KeyError, IndexError) as error:
+        record["valid"] = False
+        record["error"] = str(error) if isinstance(error, ValueError) else "Invalid FEN"
+    record["plies"] = len(moves)
+    record["termination"] = game.game_result
+    record["fen"] = game.get_fen()
+    if with_moves:
+        record["moves"] = [move_positions(move) for move in moves]
+    return record
+
+
+def check_fen(item, backend="bitboard"):
+    """Validate one FEN, returning its result record"""
+    index, fen = item
+    record = {"index": index, "fen": fen, "valid": True}
+    game = create_game(backend)
+    try:
+        game.set_fen(fen)
+    except (ValueError, KeyError, IndexError) as error:
+        record["valid"] = False
+        record["error"] = str(error) if isinstance(error, ValueError) else "Invalid FEN"
+        return record
+    if -1 in game.king_squares:
+        record["valid"] = False
+        record["error"] = "Missing king"
+        return record
+    record["legal_moves"] = len(game.generate_legal_moves())
+    record["in_check"] = game.is_king_in_check(game.turn)
+    record["termination"] = game.game_result
+    return record
+
+
+def process(task):
+    """Worker entry point: (kind, item, backend, with_moves) to a record"""
+    kind, item, backend, with_moves = task
+    if kind == "fen":
+        return check_fen(item, backend)
+    return replay_pgn(item, backend, with_moves)
+
+
+def run(items, kind, backend, workers=1, with_moves=False, chunksize=32):
+    """Yield result records in input order, optionally across processes
+
+    Items are read in batches, so memory use stays bounded however long
+    the input stream is.
+    """
+    tasks = ((kind, item, backend, with_moves) for item in items)
+    if workers <= 1:
+        yield from map(process, tasks)
+        return
+
+    with Pool(workers) as pool:
+        while True:
+            batch = list(islice(tasks, workers * chunksize * 4))
+            if not batch:
+                break
+            yield from pool.imap(process, batch, chunksize)
+
+
+def main(argv=None):
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(
+        description="Validate and replay PGN or FEN archives"
+    )
+    parser.add_argument("path", help="PGN or FEN file ('-' for stdin)")
+    parser.add_argument("--fen", action="store_true", help="input is one FEN per line")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes")
+    parser.add_argument(
+        "--backend", choices=GAME_BACKENDS, default="bitboard", help="move generator"
+    )
+    parser.add_argument("--output", metavar="PATH", help="JSON Lines output file")
+    parser.add_argument(
+        "--moves", action="store_true", help="include each game's moves"
+    )
+    args = parser.parse_args(argv)
+
+    source = (
+        sys.stdin
+        if args.path == "-"
+        else open(args.path, encoding="utf-8", errors="replace")
+    )
+    output = open(args.output, "w") if args.output else sys.stdout
+    if args.fen:
+        items = enumerate(read_fens(source))
+    else:
+        items = (
+            (index, headers, movetext)
+            for index, (headers, movetext) in enumerate(read_pgn(source))
+        )
+
+    start = time.perf_counter()
+    total = valid = plies = 0
+    try:
+        kind = "fen" if args.fen else "pgn"
+        for record in run(items, kind, args.backend, args.workers, args.moves):
+            output.write(json.dumps(record, separators=(",", ":")) + "\n")
+            total += 1
+            valid += record["valid"]
+            plies += record.get("plies", 0)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+
+    seconds = time.perf_counter() - start
+    rate = round(total / seconds * 60) if seconds else None
+    print(
+        f"📥 {total} {'positions' if args.fen else 'games'} ({valid} valid, "
+        f"{plies} plies) in {seconds:.2f}s, {rate} per minute",
+        file=sys.stderr,
+    )
+    return 0 if valid == total else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+"""
+Job Pool
+Runs CPU-heavy jobs in worker processes with job IDs, cancellation,
+timeouts and a bounded queue
+"""
+
+import multiprocessing
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait as wait_futures
+from concurrent.futures.process import BrokenProcessPool
+
+# Cancellation flags shared with the worker processes, one per job slot
+_cancel_flags = None
+_current_slot = None
+
+
+def _init_worker(flags):
+    """Worker process initializer: keep a handle on the cancellation flags"""
+    global _cancel_flags
+    _cancel_flags = flags
+
+
+def _run_job(slot, fn, args):
+    """Run a job function in a worker, exposing its slot to cancelled()"""
+    global _current_slot
+    _current_slot = slot
+    try:
+        return fn(*args)
+    finally:
+        _current_slot = None
+
+
+def cancelled():
+    """Check from inside a job whether it has been cancelled or timed out
+
+    Long-running job functions should poll this and return early.
+    """
+    if _cancel_flags is None or _current_slot is None:
+        return False
+    return bool(_cancel_flags[_current_slot])
+
+
+class PoolFull(Exception):
+    """Raised when the pool already has max_pending unfinished jobs"""
+
+
+class JobNotFound(KeyError):
+    """Raised when a job ID is unknown or its result has expired"""
+
+
+class Job:
+    """A submitted job and its future"""
+
+    __slots__ = ("id", "kind", "slot", "future", "submitted", "deadline", "state")
+
+    def __init__(self, kind, slot, future, timeout=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.slot = slot
+        self.future = future
+        self.submitted = time.monotonic()
+        self.deadline = self.submitted + timeout if timeout else None
+        self.state = None  # "cancelled" or "timeout" once stopped by the pool
+
+    @property
+    def status(self):
+        """One of queued, running, done, failed, cancelled or timeout"""
+        if self.state:
+            return self.state
+        future = self.future
+        if future.done():
+            return "failed" if future.exception() else "done"
+        return "running" if future.running() else "queued"
+
+    def to_dict(self):
+        """Get the job's status, and its result or error once finished"""
+        info = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "seconds": round(time.monotonic() - self.submitted, 3),
+        }
+        if info["status"] == "done":
+            info["result"] = self.future.result()
+        elif info["status"] == "failed":
+            info["error"] = str(self.future.exception())
+        return info
+
+
+class JobPool:
+    """Process pool for CPU-bound jobs
+
+    Worker processes are started on first use with the spawn method, so
+    forking a threaded web server is never an issue. At most max_pending
+    jobs may be queued or running; submit raises PoolFull beyond that so
+    callers can shed load. A cancelled or timed-out job that is already
+    running is told to stop through a shared flag (see cancelled()).
+    Finished jobs are kept for keep_results seconds for polling.
+    """
+
+    def __init__(self, max_workers=2, max_pending=16, keep_results=300):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.keep_results = keep_results
+        self.submitted = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.timeouts = 0
+        self._executor = None
+        self._flags = None
+        self._jobs = {}
+        self._finished = {}  # job_id -> time the job was seen finished
+        self._slots = list(range(max_pending))
+        self._lock = threading.RLock()  # future callbacks may run while held
+
+    def _start(self):
+        """Start the worker processes"""
+        context = multiprocessing.get_context("spawn")
+        self._flags = context.Array("b", self.max_pending, lock=False)
+        self._executor = ProcessPoolExecutor(
+            self.max_workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self._flags,),
+        )
+
+    def submit(self, kind, fn, *args, timeout=None):
+        """Queue fn(*args) in a worker process and return its Job
+
+        fn must be a picklable module-level function. The job is stopped
+        once timeout seconds have passed since submission.
+        """
+        with self._lock:
+            self._reap()
+            if not self._slots:
+                self.rejected += 1
+                raise PoolFull(f"{self.max_pending} jobs already pending")
+            if self._executor is None:
+                self._start()
+            slot = self._slots.pop()
+            self._flags[slot] = 0
+            try:
+                future = self._executor.submit(_run_job, slot, fn, args)
+            except BrokenProcessPool:
+                self._start()  # a worker died; replace the pool
+                future = self._executor.submit(_run_job, slot, fn, args)
+            job = Job(kind, slot, future, timeout)
+            self._jobs[job.id] = job
+            self.submitted += 1
+        future.add_done_callback(lambda _: self._release(job))
+        return job
+
+    def _release(self, job):
+        """Return a finished job's slot to the free list"""
+        with self._lock:
+            if job.slot is not None:
+                self._slots.append(job.slot)
+                job.slot = None
+            self._finished.setdefault(job.id, time.monotonic())
+
+    def _stop(self, job, state):
+        """Cancel a job, signalling its worker if it is already running"""
+        if job.state or job.future.done():
+            return False
+        job.state = state
+        if not job.future.cancel() and job.slot is not None:
+            self._flags[job.slot] = 1
+        return True
+
+    def _reap(self):
+        """Time out overdue jobs and forget expired results
+
+        Must be called with the pool lock held.
+        """
+        now = time.monotonic()
+        for job in self._jobs.values():
+            if job.deadline and now >= job.deadline and self._stop(job, "timeout"):
+                self.timeouts += 1
+        expired = now - self.keep_results
+        for job_id, finished in list(self._finished.items()):
+            if finished < expired:
+                del self._finished[job_id]
+                self._jobs.pop(job_id, None)
+
+    def get(self, job_id):
+        """Look up a job"""
+        with self._lock:
+            self._reap()
+            job = self._jobs.get(job_id)
+        if job is None:
+            raise JobNotFound(job_id)
+        return job
+
+    def wait(self, job_id, timeout=None):
+        """Wait up to timeout seconds (and no later than its deadline) for a job"""
+        job = self.get(job_id)
+        if job.deadline:
+            remaining = job.deadline - time.monotonic()
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        if timeout is None or timeout > 0:
+            wait_futures([job.future], timeout)
+        return self.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job"""
+        job = self.get(job_id)
+        with self._lock:
+            if self._stop(job, "cancelled"):
+                self.cancelled += 1
+        return job
+
+    def shutdown(self):
+        """Stop the worker processes"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self):
+        """Get the pool size, queue depth and job counters"""
+        return {
+            "workers": self.max_workers,
+            "started": self._executor is not None,
+            "pending": self.max_pending - len(self._slots),
+            "max_pending": self.max_pending,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "cancelled": self.cancelled,
+            "timeouts": self.timeouts,
+        }
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+Load Test
+Plays simultaneous random legal games against the chess API, in process or
+over HTTP, and reports throughput and latency percentiles per route
+"""
+
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+# Requests are grouped under these route names in the report
+NEW_GAME = "POST /api/new-game"
+GAME_STATE = "GET /api/game-state"
+VALID_MOVES = "GET /api/valid-moves"
+MAKE_MOVE = "POST /api/make-move"
+ROUTES = (NEW_GAME, GAME_STATE, VALID_MOVES, MAKE_MOVE)
+
+
+class TestClientTransport:
+    """Sends requests to the Flask app in this process through its test client"""
+
+    def __init__(self):
+        from chess_app import app
+
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None):
+        """Send a request, returning (status, parsed JSON or None)"""
+        response = self.client.open(path, method=method, json=body)
+        return response.status_code, response.get_json(silent=True)
+
+    def close(self):
+        pass
+
+
+class HTTPTransport:
+    """Sends requests over one keep-alive HTTP connection, like a browser tab"""
+
+    def __init__(self, url, timeout=30.0):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self.connection = None
+
+    def request(self, method, path, body=None):
+        """Send a request, returning (status, parsed JSON or None)"""
+        headers = {}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        for attempt in (0, 1):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(
+                    self.host, self.port, timeout=self.timeout
+                )
+            try:
+                self.connection.request(method, path, data, headers)
+                response = self.connection.getresponse()
+                payload = response.read()
+                break
+            except (http.client.HTTPException, OSError):
+                self.close()  # the server closed an idle connection; retry once
+                if attempt:
+                    raise
+        try:
+            return response.status, json.loads(payload) if payload else None
+        except ValueError:
+            return response.status, None
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class Recorder:
+    """Collects request latencies per route from every player thread"""
+
+    def __init__(self):
+        self.latencies = {route: [] for route in ROUTES}
+        self.errors = {route: 0 for route in ROUTES}
+        self.moves = 0
+        self.games = 0
+        self._lock = threading.Lock()
+
+    def call(self, transport, route, method, path, body=None):
+        """Time one request, counting failures as errors"""
+        start = time.perf_counter()
+        try:
+            status, data = transport.request(method, path, body)
+        except (http.client.HTTPException, OSError):
+            status, data = None, None
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.latencies[route].append(elapsed)
+            if status is None or status >= 400:
+                self.errors[route] += 1
+        return data if status is not None and status < 400 else None
+
+    def count(self, games=0, moves=0):
+        """Count started games and successful moves"""
+        with self._lock:
+            self.games += games
+            self.moves += moves
+
+
+def play(transport, recorder, rng, plies, clicks, think, deadline):
+    """Play random legal games until plies moves were made or time runs out
+
+    Each turn polls the state with the legal-move map, clicks a few of the
+    side to move's pieces (valid-moves requests, as the page does on
+    selection) and plays a random legal move. A finished game is replaced
+    by a new one.
+    """
+    played = 0
+    game_id = None
+    state = None
+    while played < plies and (deadline is None or time.monotonic() < deadline):
+        if game_id is None or state is None or state.get("game_over"):
+            data = recorder.call(transport, NEW_GAME, "POST", "/api/new-game")
+            if data is None:
+                return
+            game_id = data["game_id"]
+            recorder.count(games=1)
+
+        base = f"/api/games/{game_id}"
+        state = recorder.call(
+            transport, GAME_STATE, "GET", f"{base}/game-state?legal_moves=1"
+        )
+        if state is None:
+            return
+        legal_moves = state.get("legal_moves") or {}
+        if not legal_moves:
+            state["game_over"] = True
+            continue
+
+        pieces = list(legal_moves)
+        for square in rng.sample(pieces, min(clicks, len(pieces))):
+            row, col = square.split(",")
+            recorder.call(
+                transport, VALID_MOVES, "GET", f"{base}/valid-moves/{row}/{col}"
+            )
+
+        square = rng.choice(pieces)
+        target = rng.choice(legal_moves[square])
+        body = {
+            "from": [int(value) for value in square.split(",")],
+            "to": target,
+            "since": state["version"],
+        }
+        result = recorder.call(transport, MAKE_MOVE, "POST", f"{base}/make-move", body)
+        if result is not None and result.get("success"):
+            played += 1
+            recorder.count(moves=1)
+        if think:
+            time.sleep(rng.uniform(0, 2 * think))
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return None
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+
+def summarize(recorder, seconds):
+    """Throughput and latency percentiles (milliseconds) per route"""
+    routes = {}
+    total = 0
+    errors = 0
+    for route in ROUTES:
+        values = sorted(recorder.latencies[route])
+        total += len(values)
+        errors += recorder.errors[route]
+        if not values:
+            continue
+        routes[route] = {
+            "requests": len(values),
+            "errors": recorder.errors[route],
+            "per_second": round(len(values) / seconds, 2),
+            "mean_ms": round(sum(values) / len(values) * 1000, 3),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+            "max_ms": round(values[-1] * 1000, 3),
+        }
+    return {
+        "seconds": round(seconds, 3),
+        "requests": total,
+        "errors": errors,
+        "requests_per_second": round(total / seconds, 2) if seconds else None,
+        "games": recorder.games,
+        "moves": recorder.moves,
+        "moves_per_second": round(recorder.moves / seconds, 2) if seconds else None,
+        "routes": routes,
+    }
+
+
+def run_load(
+    make_transport, players, plies, clicks=2, think=0.0, duration=None, seed=None
+):
+    """Play players concurrent games and return the summary report"""
+    recorder = Recorder()
+    seeds = random.Random(seed)
+    deadline = time.monotonic() + duration if duration else None
+
+    def player(player_seed):
+        transport = make_transport()
+        try:
+            play(
+                transport,
+                recorder,
+                random.Random(player_seed),
+                plies,
+                clicks,
+                think,
+                deadline,
+            )
+        finally:
+            transport.close()
+
+    threads = [
+        threading.Thread(target=player, args=(seeds.getrandbits(32),), daemon=True)
+        for _ in range(players)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(recorder, time.perf_counter() - start)
+
+
+def free_port():
+    """Find a free local TCP port"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def render_gunicorn_options(path=None):
+    """Get the gunicorn options of render.yaml's start command
+
+    Reads the first startCommand line, so load tests run the server the
+    way production does (e.g. with --preload). The bind address comes
+    from start_gunicorn instead.
+    """
+    path = path or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "render.yaml"
+    )
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            key, _, command = line.strip().partition(":")
+            if key == "startCommand":
+                words = command.split()
+                if words[:2] != ["gunicorn", "app:application"]:
+                    raise ValueError(f"Unexpected start command in {path}: {command}")
+                return " ".join(words[2:])
+    raise ValueError(f"No startCommand in {path}")
+
+
+def start_gunicorn(arguments, port, timeout=30.0):
+    """Start a local gunicorn serving app:application and wait until it answers"""
+    command = [
+        sys.executable,
+        "-m",
+        "gunicorn",
+        "app:application",
+        "--bind",
+        f"127.0.0.1:{port}",
+    ] + arguments
+    process = subprocess.Popen(
+        command,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {process.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("gunicorn did not start in time")
+
+
+def print_summary(report):
+    """Print a human-readable summary of a load test report"""
+    print(
+        f"🏋️ Load test: {report['target']} ({report['players']} players)",
+        file=sys.stderr,
+    )
+    print("=" * 72, file=sys.stderr)
+    for route, entry in report["routes"].items():
+        print(
+            f"{route:<22} {entry['requests']:>7} req {entry['per_second']:>9}/s  "
+            f"p50 {entry['p50_ms']:>8}  p95 {entry['p95_ms']:>8}  "
+            f"p99 {entry['p99_ms']:>8} ms",
+            file=sys.stderr,
+        )
+    print("=" * 72, file=sys.stderr)
+    print(
+        f"{report['requests']} requests ({report['errors']} errors) in "
+        f"{report['seconds']}s: {report['requests_per_second']} req/s, "
+        f"{report['moves_per_second']} moves/s",
+        file=sys.stderr,
+    )
+
+
+def main(argv=None):
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(
+        description="Play concurrent random games against the chess API"
+    )
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", help="server to test, e.g. http://127.0.0.1:8000")
+    target.add_argument(
+        "--gunicorn",
+        nargs="?",
+        const="",
+        metavar="ARGS",
+        help="start a local gunicorn with these options (default render.yaml's)",
+    )
+    parser.add_argument("--players", type=int, default=8, help="concurrent games")
+    parser.add_argument("--plies", type=int, default=40, help="moves per player")
+    parser.add_argument(
+        "--clicks", type=int, default=2, help="valid-moves requests per move"
+    )
+    parser.add_argument(
+        "--think", type=float, default=0.0, help="mean pause between moves (s)"
+    )
+    parser.add_argument("--duration", type=float, help="stop after this many seconds")
+    parser.add_argument("--seed", type=int, help="random seed for repeatable runs")
+    parser.add_argument(
+        "--json", metavar="PATH", default="-", help="report file (default stdout)"
+    )
+    args = parser.parse_args(argv)
+
+    server = None
+    if args.gunicorn == "":
+        args.gunicorn = render_gunicorn_options()
+    if args.gunicorn is not None:
+        port = free_port()
+        server = start_gunicorn(args.gunicorn.split(), port)
+        args.url = f"http://127.0.0.1:{port}"
+
+    if args.url:
+        label = f"{args.url} (gunicorn {args.gunicorn})" if server else args.url
+
+        def make_transport():
+            return HTTPTransport(args.url)
+
+    else:
+        label = "in-process test client"
+        make_transport = TestClientTransport
+
+    try:
+        report = {"target": label, "players": args.players, "plies": args.plies}
+        report.update(
+            run_load(
+                make_transport,
+                args.players,
+                args.plies,
+                args.clicks,
+                args.think,
+                args.duration,
+                args.seed,
+            )
+        )
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print_summary(report)
+    if args.json == "-":
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📄 Report written to {args.json}", file=sys.stderr)
+    return 0 if report["errors"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
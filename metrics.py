@@ -0,0 +1,260 @@
+"""
+Metrics
+Cheap in-process counters and latency histograms, exported in the
+Prometheus text format
+"""
+
+import abc
+import itertools
+import threading
+from bisect import bisect_left
+
+# Request latency buckets in seconds
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def format_labels(names, values, extra=""):
+    """Format a label set as {name="value",...}"""
+    pairs = [
+        '{}="{}"'.format(
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value):
+    """Format a sample value, writing whole floats without a fraction"""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class CounterValue:
+    """One counter time series
+
+    inc is bound straight to itertools.count's __next__, so an increment is
+    a single C call that is atomic under the GIL: no lock and no Python
+    frame. Reading takes a value from the same iterator, so reads are
+    subtracted back out.
+    """
+
+    __slots__ = ("inc", "_count", "_reads", "_lock")
+
+    def __init__(self):
+        self._count = itertools.count()
+        self._reads = 0
+        self._lock = threading.Lock()
+        self.inc = self._count.__next__
+
+    @property
+    def value(self):
+        """Current count"""
+        with self._lock:
+            value = next(self._count) - self._reads
+            self._reads += 1
+        return value
+
+
+class HistogramValue:
+    """One histogram time series with fixed bucket bounds"""
+
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last bucket is +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """Record one observation"""
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def snapshot(self):
+        """Get (cumulative bucket counts, sum) consistently"""
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+        return list(itertools.accumulate(counts)), total
+
+
+class Metric(abc.ABC):
+    """A named metric family with optional labels"""
+
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    @abc.abstractmethod
+    def samples(self):
+        """Yield (suffix, label names, label values, extra label, value)"""
+
+    def render(self):
+        """Format the metric in the Prometheus text format"""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for suffix, names, values, extra, value in self.samples():
+            labels = format_labels(names, values, extra)
+            lines.append(f"{self.name}{suffix}{labels} {format_value(value)}")
+        return "\n".join(lines)
+
+
+class SeriesMetric(Metric):
+    """Metric that records its own values, one time series per label set
+
+    labels(*values) returns the time series for one label combination,
+    creating it on first use; metrics without labels are their own series.
+    """
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """Get the time series for a combination of label values"""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._new_child()
+        return child
+
+    @abc.abstractmethod
+    def _new_child(self):
+        """Create the time series for one label combination"""
+
+
+class Counter(SeriesMetric):
+    """Monotonically increasing count"""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        if not self.labelnames:
+            self.inc = self.labels().inc
+
+    def _new_child(self):
+        return CounterValue()
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            yield "", self.labelnames, values, "", child.value
+
+
+class Histogram(SeriesMetric):
+    """Distribution of observations over fixed buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        if not self.labelnames:
+            self.observe = self.labels().observe
+
+    def _new_child(self):
+        return HistogramValue(self.buckets)
+
+    def samples(self):
+        bounds = [format_value(float(bound)) for bound in self.buckets] + ["+Inf"]
+        for values, child in list(self._children.items()):
+            cumulative, total = child.snapshot()
+            for bound, count in zip(bounds, cumulative):
+                yield "_bucket", self.labelnames, values, f'le="{bound}"', count
+            yield "_sum", self.labelnames, values, "", total
+            yield "_count", self.labelnames, values, "", cumulative[-1]
+
+
+class CallbackMetric(Metric):
+    """Counter or gauge whose values are read from a function at scrape time
+
+    The function returns a number, or a mapping from label-value tuples to
+    numbers for metrics with labels. This exports counters that other
+    objects already keep, such as cache hits, without double counting.
+    """
+
+    def __init__(self, kind, name, documentation, function, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self.function = function
+
+    def samples(self):
+        result = self.function()
+        if not isinstance(result, dict):
+            result = {(): result}
+        for values, value in result.items():
+            if value is not None:
+                yield "", self.labelnames, values, "", value
+
+
+class MetricRegistry:
+    """Collection of metrics rendered together for a /metrics endpoint"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Add a metric, returning it"""
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Duplicate metric: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        """Create and register a Counter"""
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        """Create and register a Histogram"""
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge_function(self, name, documentation, function, labelnames=()):
+        """Register a gauge read from function at scrape time"""
+        return self.register(
+            CallbackMetric("gauge", name, documentation, function, labelnames)
+        )
+
+    def counter_function(self, name, documentation, function, labelnames=()):
+        """Register a counter read from function at scrape time"""
+        return self.register(
+            CallbackMetric("counter", name, documentation, function, labelnames)
+        )
+
+    def render(self):
+        """Format every metric in the Prometheus text format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
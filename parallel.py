@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Parallel Analysis
+Splits perft and engine analysis at the root across worker processes and
+reports per-core throughput and scaling efficiency
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from chess_game import (
+    GAME_BACKENDS,
+    START_FEN,
+    create_game,
+    decode_position,
+    encode_position,
+    move_to_uci,
+)
+from engine import MATE_BOUND, MAX_DEPTH, Engine
+from perft import perft
+
+# Engine of the current worker process (see search_root_move)
+worker_engine = None
+
+
+def perft_root_move(position, move, depth, backend):
+    """Worker task: count the leaf nodes below one root move"""
+    game = decode_position(position, backend)
+    start = time.process_time()
+    game.push(move)
+    nodes = perft(game, depth - 1)
+    return move, nodes, time.process_time() - start, os.getpid()
+
+
+def search_root_move(position, move, depth, deadline, table_size):
+    """Worker task: score one root move by searching the reply position
+
+    deadline is a wall-clock time shared by all tasks of an analysis; a
+    task that starts after it returns without searching, and one whose
+    search it cuts short of depth returns a score of None, since a
+    shallower score can't be ranked against the others.
+    """
+    global worker_engine
+    if worker_engine is None:
+        worker_engine = Engine(table_size)
+
+    start = time.process_time()
+    time_limit = deadline - time.time() if deadline else None
+    if time_limit is not None and time_limit <= 0:
+        return move, None, 0, [], 0, 0.0, os.getpid()
+
+    game = decode_position(position)
+    game.push(move)
+    max_depth = max(depth - 1, 1)
+    forced = len(game.generate_legal_moves()) <= 1  # searched to depth 1 only
+    result = worker_engine.search(game, time_limit, max_depth=max_depth)
+    score = -result["score"]
+    if score > MATE_BOUND:
+        score -= 1  # one ply further from the root
+    elif score < -MATE_BOUND:
+        score += 1
+    elif result["depth"] < max_depth and not forced:
+        score = None  # the deadline stopped the search early
+    return (
+        move,
+        score,
+        result["depth"] + 1,
+        [move] + result["pv"],
+        result["nodes"],
+        time.process_time() - start,
+        os.getpid(),
+    )
+
+
+def run_root_split(task, position, moves, workers, *args):
+    """Run task for every root move on a process pool
+
+    Each root move is its own task, so the pool balances uneven subtrees.
+    Returns the task results and the wall-clock time.
+    """
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(task, position, move, *args) for move in moves]
+        results = [future.result() for future in as_completed(futures)]
+    return results, time.perf_counter() - start
+
+
+def summarize(nodes, wall_seconds, tasks, workers):
+    """Throughput per worker process and scaling of a root-split run
+
+    tasks holds (nodes, CPU seconds, pid) per root move. Speedup is the
+    summed CPU time over the wall-clock time, so efficiency shows how busy
+    the workers kept the cores (pool start-up and idle tails count against
+    it, and so do more workers than cores).
+    """
+    per_worker = {}
+    for task_nodes, seconds, pid in tasks:
+        entry = per_worker.setdefault(pid, {"pid": pid, "moves": 0, "nodes": 0})
+        entry["moves"] += 1
+        entry["nodes"] += task_nodes
+        entry["seconds"] = entry.get("seconds", 0.0) + seconds
+    for entry in per_worker.values():
+        entry["nps"] = (
+            round(entry["nodes"] / entry["seconds"]) if entry["seconds"] else None
+        )
+        entry["seconds"] = round(entry["seconds"], 6)
+
+    busy = sum(seconds for _, seconds, _ in tasks)
+    speedup = busy / wall_seconds if wall_seconds else None
+    return {
+        "workers": workers,
+        "nodes": nodes,
+        "wall_seconds": round(wall_seconds, 6),
+        "busy_seconds": round(busy, 6),
+        "nps": round(nodes / wall_seconds) if wall_seconds else None,
+        "speedup": round(speedup, 3) if speedup else None,
+        "efficiency": round(speedup / workers, 3) if speedup else None,
+        "per_worker": sorted(per_worker.values(), key=lambda entry: entry["pid"]),
+    }
+
+
+def parallel_perft(fen, depth, workers, backend="bitboard"):
+    """Run perft with the root moves divided across worker processes"""
+    game = create_game(backend)
+    game.set_fen(fen)
+    moves = game.generate_legal_moves()
+    results, wall = run_root_split(
+        perft_root_move, encode_position(game), moves, workers, depth, backend
+    )
+    nodes = sum(result[1] for result in results)
+    report = {"fen": fen, "depth": depth, "backend": backend}
+    report.update(summarize(nodes, wall, [result[1:] for result in results], workers))
+    report["divide"] = {move_to_uci(result[0]): result[1] for result in results}
+    return report
+
+
+def parallel_search(fen, depth, workers, time_limit=None, table_size=1 << 18):
+    """Score every root move to the given depth across worker processes
+
+    Root moves are searched independently with full windows, so there is no
+    alpha-beta cutoff between them; in exchange every root move gets an
+    exact score. Moves whose search could not start or reach the depth
+    before the time limit are left out of the ranking and listed under
+    "incomplete".
+    """
+    game = create_game("bitboard")
+    game.set_fen(fen)
+    moves = game.generate_legal_moves()
+    report = {
+        "fen": fen,
+        "depth": depth,
+        "best_move": None,
+        "moves": [],
+        "incomplete": [],
+    }
+    if not moves:
+        return report
+
+    deadline = time.time() + time_limit if time_limit else None
+    results, wall = run_root_split(
+        search_root_move,
+        encode_position(game),
+        moves,
+        workers,
+        depth,
+        deadline,
+        table_size,
+    )
+    scored = sorted(
+        (result for result in results if result[1] is not None),
+        key=lambda result: result[1],
+        reverse=True,
+    )
+    nodes = sum(result[4] for result in results)
+    report.update(summarize(nodes, wall, [result[4:] for result in results], workers))
+    report["moves"] = [
+        {
+            "move": move_to_uci(move),
+            "score": score,
+            "depth": reached,
+            "pv": [move_to_uci(pv_move) for pv_move in pv],
+        }
+        for move, score, reached, pv, _, _, _ in scored
+    ]
+    report["incomplete"] = [
+        move_to_uci(result[0]) for result in results if result[1] is None
+    ]
+    if scored:
+        report["best_move"] = report["moves"][0]["move"]
+        report["score"] = scored[0][1]
+        report["depth_reached"] = min(result[2] for result in scored)
+    return report
+
+
+def print_report(report, serial=None):
+    """Print a human-readable parallel run report"""
+    print(f"♔ Parallel analysis: {report['fen']} ♛")
+    print("=" * 60)
+    if "wall_seconds" not in report:
+        print("No legal moves")
+        return
+    if "divide" in report:
+        print(f"Perft depth {report['depth']}: {report['nodes']} nodes")
+    if report.get("best_move"):
+        print(f"Best move {report['best_move']} ({report['score']} cp)")
+        for entry in report["moves"][:5]:
+            print(f"  {entry['move']:>6} {entry['score']:>7}  {' '.join(entry['pv'])}")
+    if report.get("incomplete"):
+        print(f"Not searched in time: {' '.join(report['incomplete'])}")
+    for entry in report.get("per_worker", []):
+        print(
+            f"  worker {entry['pid']}: {entry['moves']:>3} root moves "
+            f"{entry['nodes']:>10} nodes {entry['nps'] or 0:>9} nps"
+        )
+    print("=" * 60)
+    print(
+        f"{report['workers']} workers: {report['wall_seconds']:.3f}s wall, "
+        f"{report['nps']} nodes/sec, speedup {report['speedup']}, "
+        f"efficiency {report['efficiency']}"
+    )
+    if serial is not None:
+        print(
+            f"Serial run: {serial:.3f}s, measured speedup "
+            f"{serial / report['wall_seconds']:.2f}x"
+        )
+
+
+def main(argv=None):
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(
+        description="Run perft or engine analysis split across CPU cores"
+    )
+    parser.add_argument("mode", choices=("perft", "search"))
+    parser.add_argument("--fen", default=START_FEN, help="position (default start)")
+    parser.add_argument("--depth", type=int, default=4, help="depth (default 4)")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="worker processes (default one per CPU)",
+    )
+    parser.add_argument(
+        "--backend", choices=GAME_BACKENDS, default="bitboard", help="perft backend"
+    )
+    parser.add_argument("--time", type=float, help="search time limit in seconds")
+    parser.add_argument(
+        "--compare", action="store_true", help="also time a single-process run"
+    )
+    parser.add_argument("--json", metavar="PATH", help="write the report as JSON")
+    args = parser.parse_args(argv)
+
+    if args.mode == "perft":
+        report = parallel_perft(args.fen, args.depth, args.workers, args.backend)
+    else:
+        depth = min(args.depth, MAX_DEPTH)
+        report = parallel_search(args.fen, depth, args.workers, args.time)
+
+    serial = None
+    if args.compare and "wall_seconds" in report:
+        game = create_game(args.backend if args.mode == "perft" else "bitboard")
+        game.set_fen(args.fen)
+        start = time.perf_counter()
+        if args.mode == "perft":
+            perft(game, args.depth)
+        else:
+            Engine().search(game, args.time, max_depth=args.depth)
+        serial = time.perf_counter() - start
+        report["serial_seconds"] = round(serial, 6)
+
+    print_report(report, serial)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📄 Report written to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Perft Benchmark
+Counts move-generator leaf nodes from standard test positions to check
+correctness and measure throughput of the ChessGame backends
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+
+from chess_game import GAME_BACKENDS, START_FEN, create_game, move_to_uci
+
+# Standard perft positions with known node counts per depth
+# (see https://www.chessprogramming.org/Perft_Results)
+TEST_POSITIONS = [
+    {
+        "name": "start",
+        "fen": START_FEN,
+        "nodes": [20, 400, 8902, 197281, 4865609, 119060324],
+    },
+    {
+        "name": "kiwipete",
+        "fen": "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        "nodes": [48, 2039, 97862, 4085603, 193690690],
+    },
+    {
+        "name": "endgame",
+        "fen": "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+        "nodes": [14, 191, 2812, 43238, 674624, 11030083],
+    },
+    {
+        "name": "promotions",
+        "fen": "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+        "nodes": [6, 264, 9467, 422333, 15833292],
+    },
+    {
+        "name": "talkchess",
+        "fen": "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+        "nodes": [44, 1486, 62379, 2103487, 89941194],
+    },
+    {
+        "name": "middlegame",
+        "fen": "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+        "nodes": [46, 2079, 89890, 3894594, 164075551],
+    },
+]
+
+
+def perft(game, depth):
+    """Count the leaf nodes of the legal move tree to the given depth"""
+    moves = game.generate_legal_moves()
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1
+
+    nodes = 0
+    for move in moves:
+        game.push(move)
+        nodes += perft(game, depth - 1)
+        game.pop()
+    return nodes
+
+
+def divide(game, depth):
+    """Count leaf nodes below each root move, keyed by UCI notation"""
+    counts = {}
+    for move in game.generate_legal_moves():
+        game.push(move)
+        counts[move_to_uci(move)] = perft(game, depth - 1)
+        game.pop()
+    return counts
+
+
+def run_position(position, max_depth, backend):
+    """Run perft at every depth up to max_depth for one test position"""
+    game = create_game(backend)
+    game.set_fen(position["fen"])
+
+    depths = []
+    for depth in range(1, max_depth + 1):
+        start = time.perf_counter()
+        nodes = perft(game, depth)
+        seconds = time.perf_counter() - start
+
+        expected = None
+        if depth <= len(position.get("nodes", [])):
+            expected = position["nodes"][depth - 1]
+        depths.append(
+            {
+                "depth": depth,
+                "nodes": nodes,
+                "expected": expected,
+                "ok": expected is None or nodes == expected,
+                "seconds": round(seconds, 6),
+                "nps": round(nodes / seconds) if seconds else None,
+            }
+        )
+
+    return {"name": position["name"], "fen": position["fen"], "depths": depths}
+
+
+def run_suite(positions, max_depth, backend):
+    """Run perft over several positions and summarise the throughput"""
+    start = time.perf_counter()
+    results = [run_position(position, max_depth, backend) for position in positions]
+    seconds = time.perf_counter() - start
+    nodes = sum(entry["nodes"] for result in results for entry in result["depths"])
+
+    return {
+        "backend": backend,
+        "max_depth": max_depth,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "results": results,
+        "total_nodes": nodes,
+        "total_seconds": round(seconds, 6),
+        "nps": round(nodes / seconds) if seconds else None,
+        "ok": all(entry["ok"] for result in results for entry in result["depths"]),
+    }
+
+
+def print_report(report):
+    """Print a human-readable perft report"""
+    print(f"♔ Perft ({report['backend']} backend) ♛")
+    print("=" * 60)
+    for result in report["results"]:
+        print(f"{result['name']}: {result['fen']}")
+        for entry in result["depths"]:
+            status = "✅" if entry["ok"] else f"❌ expected {entry['expected']}"
+            print(
+                f"  depth {entry['depth']}: {entry['nodes']:>10} nodes "
+                f"{entry['seconds']:>9.3f}s {entry['nps'] or 0:>9} nps {status}"
+            )
+    print("=" * 60)
+    print(
+        f"Total: {report['total_nodes']} nodes in {report['total_seconds']:.3f}s "
+        f"({report['nps']} nodes/sec)"
+    )
+
+
+def main(argv=None):
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(
+        description="Run perft on the chess move generator"
+    )
+    parser.add_argument(
+        "--depth", type=int, default=3, help="maximum depth (default 3)"
+    )
+    parser.add_argument(
+        "--backend", choices=GAME_BACKENDS, default="mailbox", help="move generator"
+    )
+    parser.add_argument(
+        "--position",
+        action="append",
+        choices=[position["name"] for position in TEST_POSITIONS],
+        help="test position to run (repeatable, default all)",
+    )
+    parser.add_argument("--fen", help="run a custom FEN instead of the test positions")
+    parser.add_argument("--divide", action="store_true", help="print per-move counts")
+    parser.add_argument("--json", metavar="PATH", help="write the report as JSON")
+    args = parser.parse_args(argv)
+
+    if args.fen:
+        positions = [{"name": "custom", "fen": args.fen}]
+    else:
+        names = args.position or [position["name"] for position in TEST_POSITIONS]
+        positions = [p for p in TEST_POSITIONS if p["name"] in names]
+
+    if args.divide:
+        for position in positions:
+            game = create_game(args.backend)
+            game.set_fen(position["fen"])
+            counts = divide(game, args.depth)
+            for uci, nodes in sorted(counts.items()):
+                print(f"{uci}: {nodes}")
+            print(f"Total: {sum(counts.values())}")
+        return 0
+
+    report = run_suite(positions, args.depth, args.backend)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📄 Report written to {args.json}")
+
+    return 0 if report["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
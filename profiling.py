@@ -0,0 +1,193 @@
+"""
+Request Profiling
+Opt-in cProfile capture of single requests, keeping the slowest profiles
+for download
+"""
+
+import cProfile
+import heapq
+import io
+import itertools
+import marshal
+import pstats
+import threading
+import time
+import uuid
+from datetime import datetime
+from urllib.parse import parse_qs
+
+PROFILE_HEADER = "HTTP_X_PROFILE"  # the X-Profile request header
+PROFILE_QUERY = "profile"
+
+
+class StatsLoader:
+    """Hands marshalled statistics to pstats.Stats"""
+
+    def __init__(self, data):
+        self.stats = marshal.loads(data)
+
+    def create_stats(self):
+        """pstats calls this before reading .stats; they are already there"""
+
+
+class Profile:
+    """One profiled request and its cProfile statistics"""
+
+    __slots__ = (
+        "id",
+        "method",
+        "path",
+        "query",
+        "status",
+        "seconds",
+        "started",
+        "stats",
+    )
+
+    def __init__(self, profile_id, environ, status, seconds, started, stats):
+        self.id = profile_id
+        self.method = environ.get("REQUEST_METHOD", "")
+        self.path = environ.get("PATH_INFO", "")
+        self.query = environ.get("QUERY_STRING", "")
+        self.status = status
+        self.seconds = seconds
+        self.started = started
+        self.stats = stats  # marshalled pstats data, as written by dump_stats
+
+    def to_dict(self):
+        """Get the request details, without the statistics"""
+        return {
+            "profile_id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "query": self.query,
+            "status": self.status,
+            "seconds": round(self.seconds, 6),
+            "started": self.started.isoformat(),
+        }
+
+    def report(self, sort="cumulative", limit=40):
+        """Format the statistics as a pstats text report"""
+        output = io.StringIO()
+        stats = pstats.Stats(StatsLoader(self.stats), stream=output)
+        stats.sort_stats(sort).print_stats(limit)
+        return output.getvalue()
+
+
+class ProfileStore:
+    """Keeps the slowest profiles seen, up to a fixed number
+
+    A min-heap ordered by duration holds the profiles, so a new profile
+    replaces the fastest kept one once the store is full.
+    """
+
+    def __init__(self, keep=20):
+        self.keep = keep
+        self.recorded = 0
+        self._heap = []  # (seconds, sequence, Profile)
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def add(self, profile):
+        """Offer a profile, returning whether it was kept"""
+        item = (profile.seconds, next(self._sequence), profile)
+        with self._lock:
+            self.recorded += 1
+            if len(self._heap) < self.keep:
+                heapq.heappush(self._heap, item)
+                return True
+            if item[0] > self._heap[0][0]:
+                heapq.heapreplace(self._heap, item)
+                return True
+        return False
+
+    def get(self, profile_id):
+        """Look up a kept profile, or None"""
+        with self._lock:
+            for _, _, profile in self._heap:
+                if profile.id == profile_id:
+                    return profile
+        return None
+
+    def slowest(self):
+        """Get the kept profiles, slowest first"""
+        with self._lock:
+            items = sorted(self._heap, reverse=True)
+        return [profile for _, _, profile in items]
+
+    def clear(self):
+        """Drop every kept profile"""
+        with self._lock:
+            self._heap = []
+
+
+class RequestProfiler:
+    """WSGI middleware profiling the requests that ask for it
+
+    A request is profiled when it carries an X-Profile header or a
+    ?profile= query flag. With a token configured the flag's value must
+    match it; otherwise any of 1/true/yes turns profiling on. Only one
+    request is profiled at a time (cProfile may not run in two threads at
+    once), and others go through unprofiled meanwhile. The response gets an
+    X-Profile-Id header naming the profile. The body of a streamed response
+    is produced after the profiler stops, so only its set-up is measured.
+
+    Installing the middleware is itself the opt-in: without it requests run
+    exactly as before.
+    """
+
+    def __init__(self, app, store, token=None):
+        self.app = app
+        self.store = store
+        self.token = token
+        self._lock = threading.Lock()
+
+    def requested(self, environ):
+        """Check whether a request asks to be profiled"""
+        value = environ.get(PROFILE_HEADER)
+        if value is None and PROFILE_QUERY in environ.get("QUERY_STRING", ""):
+            value = parse_qs(environ["QUERY_STRING"]).get(PROFILE_QUERY, [None])[0]
+        if value is None:
+            return False
+        if self.token:
+            return value == self.token
+        return value.lower() in ("1", "true", "yes")
+
+    def __call__(self, environ, start_response):
+        if not self.requested(environ) or not self._lock.acquire(blocking=False):
+            return self.app(environ, start_response)
+
+        profile_id = uuid.uuid4().hex
+        status = []
+
+        def profiled_start_response(response_status, headers, exc_info=None):
+            status.append(int(response_status.split()[0]))
+            headers.append(("X-Profile-Id", profile_id))
+            return start_response(response_status, headers, exc_info)
+
+        started = datetime.now()
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            profiler.enable()
+            try:
+                return self.app(environ, profiled_start_response)
+            finally:
+                profiler.disable()
+                seconds = time.perf_counter() - start
+                profiler.create_stats()
+                self.store.add(
+                    Profile(
+                        profile_id,
+                        environ,
+                        status[0] if status else None,
+                        seconds,
+                        started,
+                        marshal.dumps(profiler.stats),
+                    )
+                )
+        finally:
+            self._lock.release()